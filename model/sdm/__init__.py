@@ -0,0 +1 @@
+"""Reusable building blocks for the scalloped hammerhead species distribution model pipeline."""
@@ -0,0 +1,252 @@
+"""
+Monthly background (sampling effort) rasters on the accessible-area grid.
+
+For every (year, month) the Elasmobranchii background records are binned onto the grid,
+after dropping those within `min_distance_m` of a presence of the same month. The counts
+are smoothed with a Gaussian filter and normalised to a probability raster. Everything
+is done on whole arrays:
+
+- grid lookups use `searchsorted` on the coordinate axes instead of a per-point argmin;
+- the accessible-area mask is read by index for all points at once;
+- counts per cell come from one `np.unique` per month;
+- the smoothing of the months runs in a process pool.
+
+The result is written to a memory-mapped stack keyed by a hash of every input, so
+re-running the notebook with unchanged data just maps the file back in.
+
+`sample_background` then draws the background points for all presences of a month in one
+call, by inverse-CDF lookups on a cumulative sum built once per raster.
+"""
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+from pyproj import Transformer
+from scipy.ndimage import gaussian_filter
+from scipy.spatial import cKDTree
+
+CACHE_VERSION = 1
+_TO_3857 = Transformer.from_crs("EPSG:4326", "EPSG:3857", always_xy=True)
+
+
+def grid_index(axis, values):
+    """
+    Index of the nearest axis coordinate for every value (ties go to the lower index, like
+    `np.abs(axis - v).argmin()`). The axis may be ascending or descending.
+    """
+    axis = np.asarray(axis, dtype=float)
+    values = np.asarray(values, dtype=float)
+    n = len(axis)
+    if n == 1:
+        return np.zeros(len(values), dtype=np.int64)
+    descending = axis[0] > axis[-1]
+    asc = axis[::-1] if descending else axis
+    idx = np.searchsorted(asc, values).clip(1, n - 1)
+    below, above = values - asc[idx - 1], asc[idx] - values
+    # on a tie keep the lower index of the original axis (the upper one once reversed)
+    idx -= (below < above) if descending else (below <= above)
+    return n - 1 - idx if descending else idx
+
+
+def mask_lookup(mask, lon_axis, lat_axis, lons, lats):
+    """Value of a (lat, lon) grid at the nearest node of every point."""
+    return np.asarray(mask)[grid_index(lat_axis, lats), grid_index(lon_axis, lons)]
+
+
+def in_accessible_area(accessible_area, lons, lats):
+    """Boolean array: does each point fall in an accessible cell (an xarray 0/1 mask)."""
+    return mask_lookup(
+        accessible_area.values, accessible_area["longitude"].values, accessible_area["latitude"].values,
+        lons, lats,
+    ) == 1
+
+
+def far_from(lons, lats, ref_lons, ref_lats, threshold_m):
+    """
+    Points at least `threshold_m` (EPSG:3857 metres, as the original `sjoin_nearest`) from
+    every reference point. With no reference points nothing is kept, matching the join.
+    """
+    if len(ref_lons) == 0 or len(lons) == 0:
+        return np.zeros(len(lons), dtype=bool)
+    tree = cKDTree(np.column_stack(_TO_3857.transform(ref_lons, ref_lats)))
+    dist, _ = tree.query(np.column_stack(_TO_3857.transform(lons, lats)), k=1)
+    return dist >= threshold_m
+
+
+def cell_counts(lons, lats, lon_axis, lat_axis, mask):
+    """(flat cell ids, counts) of points per grid cell, skipping cells outside the mask."""
+    i = grid_index(lat_axis, lats)
+    j = grid_index(lon_axis, lons)
+    keep = np.asarray(mask)[i, j] != 0
+    cells, counts = np.unique(i[keep] * len(lon_axis) + j[keep], return_counts=True)
+    return cells, counts
+
+
+def probability_raster(cells, counts, shape, sigma=1):
+    """Smoothed and normalised count raster (all zeros when there are no counts)."""
+    raw = np.zeros(shape, dtype=float)
+    raw.flat[cells] = counts
+    prob = gaussian_filter(raw, sigma=sigma)
+    total = prob.sum()
+    return prob / total if total > 0 else prob
+
+
+def _fill_slot(args):
+    path, slot, cells, counts, shape, sigma = args
+    stack = np.load(path, mmap_mode="r+")
+    stack[slot] = probability_raster(cells, counts, shape, sigma)
+    stack.flush()
+    return slot
+
+
+class BackgroundRasters:
+    """Read-only mapping (year, month) -> probability raster, backed by a memory-mapped stack."""
+
+    def __init__(self, stack, keys):
+        self.stack = stack
+        self._slots = {tuple(k): i for i, k in enumerate(keys)}
+
+    def __getitem__(self, key):
+        return self.stack[self._slots[tuple(key)]]
+
+    def get(self, key, default=None):
+        return self[key] if tuple(key) in self._slots else default
+
+    def __contains__(self, key):
+        return tuple(key) in self._slots
+
+    def __iter__(self):
+        return iter(self._slots)
+
+    def __len__(self):
+        return len(self._slots)
+
+    def keys(self):
+        return self._slots.keys()
+
+    def items(self):
+        return ((k, self[k]) for k in self._slots)
+
+    @property
+    def shape(self):
+        return self.stack.shape[1:]
+
+
+def _year_month(dates):
+    dates = np.asarray(dates, dtype="datetime64[M]")
+    years = dates.astype("datetime64[Y]").astype(int) + 1970
+    months = dates.astype(int) % 12 + 1
+    return years, months
+
+
+def build_background_rasters(bg_lons, bg_lats, bg_dates, pr_lons, pr_lats, pr_dates,
+                             lon_axis, lat_axis, mask, keys, min_distance_m=5000, sigma=1,
+                             cache_dir=None, workers=None):
+    """
+    Probability rasters for the given (year, month) keys.
+
+    Background points within `min_distance_m` of a same-month presence are dropped, the
+    rest are binned on the (lat_axis, lon_axis) grid where `mask` is non-zero, and each
+    month is smoothed with a Gaussian of `sigma` cells and normalised to sum to 1. With
+    `cache_dir` the stack is stored as `background_rasters_<hash>.npy` and reused when the inputs match.
+    """
+    keys = [tuple(int(v) for v in k) for k in keys]
+    lon_axis, lat_axis = np.asarray(lon_axis, dtype=float), np.asarray(lat_axis, dtype=float)
+    mask = np.asarray(mask)
+    shape = (len(lat_axis), len(lon_axis))
+
+    bg_lons, bg_lats = np.asarray(bg_lons, dtype=float), np.asarray(bg_lats, dtype=float)
+    pr_lons, pr_lats = np.asarray(pr_lons, dtype=float), np.asarray(pr_lats, dtype=float)
+    bg_y, bg_m = _year_month(bg_dates)
+    pr_y, pr_m = _year_month(pr_dates)
+
+    if not keys:
+        return BackgroundRasters(np.empty((0,) + shape, dtype=np.float32), keys)
+
+    sparse = []
+    for year, month in keys:
+        b = (bg_y == year) & (bg_m == month)
+        p = (pr_y == year) & (pr_m == month)
+        far = far_from(bg_lons[b], bg_lats[b], pr_lons[p], pr_lats[p], min_distance_m)
+        sparse.append(cell_counts(bg_lons[b][far], bg_lats[b][far], lon_axis, lat_axis, mask))
+
+    if cache_dir is None:
+        stack = np.empty((len(keys),) + shape, dtype=np.float32)
+        with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+            rasters = pool.map(probability_raster, *zip(*sparse), [shape] * len(keys), [sigma] * len(keys))
+            for slot, raster in enumerate(rasters):
+                stack[slot] = raster
+        return BackgroundRasters(stack, keys)
+
+    digest = hashlib.sha1()
+    digest.update(json.dumps([CACHE_VERSION, keys, shape, min_distance_m, sigma]).encode())
+    for arr in (lon_axis, lat_axis, mask):
+        digest.update(np.ascontiguousarray(arr).tobytes())
+    for cells, counts in sparse:
+        digest.update(cells.tobytes())
+        digest.update(counts.tobytes())
+
+    cache_dir = Path(cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    path = cache_dir / f"background_rasters_{digest.hexdigest()[:16]}.npy"
+    if path.exists():
+        print(f"Loaded cached background rasters from {path}")
+        return BackgroundRasters(np.load(path, mmap_mode="r"), keys)
+
+    tmp = path.with_suffix(".tmp.npy")
+    np.lib.format.open_memmap(tmp, mode="w+", dtype=np.float32, shape=(len(keys),) + shape).flush()
+    tasks = [(tmp, slot, cells, counts, shape, sigma) for slot, (cells, counts) in enumerate(sparse)]
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        for _ in pool.map(_fill_slot, tasks):
+            pass
+    os.replace(tmp, path)
+    (cache_dir / f"{path.stem}.json").write_text(json.dumps({"keys": keys, "shape": shape}))
+    print(f"Wrote {len(keys)} background rasters to {path}")
+    return BackgroundRasters(np.load(path, mmap_mode="r"), keys)
+
+
+def _cell_half_widths(axis):
+    return np.abs(np.gradient(np.asarray(axis, dtype=float))) / 2 if len(axis) > 1 else np.zeros(1)
+
+
+def sample_background(rasters, presence_dates, per_presence, lon_axis, lat_axis, seed=42, jitter=False):
+    """
+    Draw `per_presence` background cells for every presence from the raster of its (year, month).
+
+    Presences are grouped by month; each month builds the cumulative sum of its raster once
+    and draws all of its cells with one `searchsorted`, from a single seeded Generator.
+    Presences whose month has no raster (or an empty one) get no background points. With
+    `jitter` each point is moved uniformly within its cell instead of sitting on the node.
+
+    Returns (lons, lats, dates) ordered by presence, `per_presence` consecutive rows each.
+    """
+    rng = np.random.default_rng(seed)
+    lon_axis, lat_axis = np.asarray(lon_axis, dtype=float), np.asarray(lat_axis, dtype=float)
+    presence_dates = np.asarray(presence_dates, dtype="datetime64[ns]")
+    years, months = _year_month(presence_dates)
+
+    # presence i owns rows [i * per_presence, (i + 1) * per_presence) until empty ones are dropped
+    cells = np.full((len(presence_dates), per_presence), -1, dtype=np.int64)
+    ym = years * 12 + (months - 1)
+    for key in np.unique(ym):
+        raster = rasters.get((int(key // 12), int(key % 12 + 1)))
+        if raster is None:
+            continue
+        cdf = np.cumsum(np.asarray(raster, dtype=np.float64).ravel())
+        if not cdf[-1] > 0:
+            continue
+        members = np.flatnonzero(ym == key)
+        u = rng.random((len(members), per_presence)) * cdf[-1]
+        cells[members] = np.searchsorted(cdf, u, side="right").clip(0, len(cdf) - 1)
+
+    drawn = cells[:, 0] >= 0
+    flat = cells[drawn].ravel()
+    i, j = np.unravel_index(flat, (len(lat_axis), len(lon_axis)))
+    bg_lons, bg_lats = lon_axis[j], lat_axis[i]
+    if jitter:
+        bg_lons = bg_lons + rng.uniform(-1, 1, len(flat)) * _cell_half_widths(lon_axis)[j]
+        bg_lats = bg_lats + rng.uniform(-1, 1, len(flat)) * _cell_half_widths(lat_axis)[i]
+    return bg_lons, bg_lats, np.repeat(presence_dates[drawn], per_presence)
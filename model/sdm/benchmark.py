@@ -0,0 +1,296 @@
+"""
+Offline benchmark of the model pipeline stages on synthetic data.
+
+Every stage runs in a fresh process so its peak memory is its own: the Meteomatics bulk
+download (against the local stand-in API of `sdm.meteomatics`), packing the monthly CSVs
+into datacubes, point extraction from the cubes, spatial thinning, the monthly background
+rasters and a whole-grid prediction with a small xgboost model. A scale sets the number of
+points (and grid cells) and the Meteomatics grid resolution:
+
+    10k  -> 10,000 points, 4 degree grid
+    100k -> 100,000 points, 2 degree grid
+    1M   -> 1,000,000 points, 1 degree grid (the notebook's resolution)
+
+Each stage is set up and run `--repeat` times and reports the fastest and median wall time
+(of the stage call itself, after its inputs are loaded), points per second and the memory the
+stage call adds on top of the process after imports and setup (`rss_delta_mb`; the whole
+process peak, mostly imports, is kept as `peak_rss_mb`). The results are written to JSON in
+the same layout as `sharks-from-space/scripts/benchmark.py`. With `--baseline` they are
+compared against an earlier run: a stage regresses (exit code 1) when its fastest time or its
+memory delta exceeds the baseline by more than the tolerance *and* by more than an absolute
+floor (`--min-delta` seconds, `--min-rss-delta` MB), so sub-second stages do not fail on noise.
+The comparison is `compare` from `sharks-from-space/scripts/benchmark.py`, imported from
+there; only the default time floor differs, as these timings exclude process start-up. A
+baseline without `rss_delta_mb` (from before it was recorded) is compared on time only.
+Synthetic inputs are generated with a fixed seed and kept in the work directory for the next run.
+
+    python -m sdm.benchmark ../outputs/benchmark --scale 10k
+    python -m sdm.benchmark ../outputs/benchmark --scale 10k \
+        --baseline ../outputs/benchmark/results_10k.json --tolerance 0.2
+"""
+import argparse
+import calendar
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import sys
+import threading
+import time
+from http.server import ThreadingHTTPServer
+from pathlib import Path
+
+import numpy as np
+import xgboost as xgb
+
+from sdm import inference, spatial
+from sdm.background import build_background_rasters
+from sdm.meteomatics import BBOX, _StandInHandler, download_months, extract, pack_variable
+
+SCALES = {"10k": (10_000, 4.0), "100k": (100_000, 2.0), "1M": (1_000_000, 1.0)}
+MONTHS = ((2010, 1), (2010, 2))
+BOUNDS = (-98.0, 8.0, -60.0, 34.0)   # lon_min, lat_min, lon_max, lat_max of the synthetic points
+THIN_DISTANCE_M = 5000
+BACKGROUND_RES = 0.1
+FEATURES = ("sst", "depth", "distance_to_shore_m")
+STAGES = ("meteomatics_download", "meteomatics_pack", "meteomatics_extract", "thin",
+          "background_rasters", "predict_grid")
+
+
+def _points(work, n, seed, name="points"):
+    """Seeded random (lons, lats, dates) inside BOUNDS over MONTHS, cached as `<work>/<name>_<n>.npz`."""
+    path = Path(work) / f"{name}_{n}.npz"
+    if not path.exists():
+        rng = np.random.default_rng(seed)
+        lon_min, lat_min, lon_max, lat_max = BOUNDS
+        start = np.datetime64(f"{MONTHS[0][0]}-{MONTHS[0][1]:02d}-01")
+        end = np.datetime64(f"{MONTHS[-1][0]}-{MONTHS[-1][1]:02d}") + np.timedelta64(1, "M")
+        days = int((end.astype("datetime64[D]") - start).astype(int))
+        np.savez(path, lons=rng.uniform(lon_min, lon_max, n), lats=rng.uniform(lat_min, lat_max, n),
+                 dates=start + rng.integers(0, days, n))
+    data = np.load(path)
+    return data["lons"], data["lats"], data["dates"]
+
+
+def _grid_rows(res):
+    """Rows the stand-in returns for MONTHS over the download bounding box at `res` degrees."""
+    n_lat = len(np.arange(BBOX["lat_max"], BBOX["lat_min"] - res / 2, -res))
+    n_lon = len(np.arange(BBOX["lon_min"], BBOX["lon_max"] + res / 2, res))
+    return n_lat * n_lon * sum(calendar.monthrange(y, m)[1] for y, m in MONTHS)
+
+
+# --------- stages: set up the inputs and return (timed callable, number of points) ----------
+def meteomatics_download(work, n, res, seed):
+    out = Path(work) / "meteomatics"
+    shutil.rmtree(out, ignore_errors=True)
+
+    def run():
+        server = ThreadingHTTPServer(("127.0.0.1", 0), _StandInHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            summary = download_months([("t_sea_sfc:C", "sst", y, m) for y, m in MONTHS], out,
+                                      base_url=f"http://127.0.0.1:{server.server_address[1]}", res_deg=res)
+        finally:
+            server.shutdown()
+        if summary["failed"]:
+            raise RuntimeError(f"stand-in downloads failed: {summary['failed']}")
+    return run, _grid_rows(res)
+
+
+def meteomatics_pack(work, n, res, seed):
+    cube = Path(work) / "cube" / "sst"
+    shutil.rmtree(cube, ignore_errors=True)
+    return lambda: pack_variable(Path(work) / "meteomatics" / "sst", cube), _grid_rows(res)
+
+
+def meteomatics_extract(work, n, res, seed):
+    lons, lats, dates = _points(work, n, seed)
+    return lambda: extract({"sst": Path(work) / "cube" / "sst"}, dates, lats, lons), n
+
+
+def thin(work, n, res, seed):
+    lons, lats, _ = _points(work, n, seed)
+    return lambda: spatial.thin(lons, lats, THIN_DISTANCE_M), n
+
+
+def background_rasters(work, n, res, seed):
+    lons, lats, dates = _points(work, n, seed)
+    pr_lons, pr_lats, pr_dates = _points(work, max(n // 10, 1), seed + 1, "presences")
+    lon_min, lat_min, lon_max, lat_max = BOUNDS
+    lon_axis = np.arange(lon_min, lon_max, BACKGROUND_RES) + BACKGROUND_RES / 2
+    lat_axis = np.arange(lat_min, lat_max, BACKGROUND_RES) + BACKGROUND_RES / 2
+    mask = np.ones((len(lat_axis), len(lon_axis)), dtype=np.uint8)
+    return lambda: build_background_rasters(lons, lats, dates, pr_lons, pr_lats, pr_dates,
+                                            lon_axis, lat_axis, mask, MONTHS), n
+
+
+def _model(work, seed):
+    """Small xgboost classifier on synthetic FEATURES, trained once and kept in the work directory."""
+    path = Path(work) / "model.json"
+    if not path.exists():
+        rng = np.random.default_rng(seed)
+        X = np.column_stack([rng.normal(25, 3, 20_000), rng.uniform(-5000, 0, 20_000),
+                             rng.uniform(0, 300_000, 20_000)])
+        y = (X[:, 0] + X[:, 1] / 1000 + rng.normal(0, 2, len(X)) > 24).astype(int)
+        model = xgb.XGBClassifier(n_estimators=200, max_depth=6, learning_rate=0.1, random_state=seed)
+        model.fit(X, y)
+        model.save_model(path)
+    model = xgb.XGBClassifier()
+    model.load_model(path)
+    return model
+
+
+def predict_grid(work, n, res, seed):
+    """About `n` cells: the packed SST cube plus two synthetic layers, scored by `predict_grid`."""
+    model = _model(work, seed)
+    lon_min, lat_min, lon_max, lat_max = BOUNDS
+    side = int(np.sqrt(n))
+    lat_axis = np.linspace(lat_max, lat_min, side)
+    lon_axis = np.linspace(lon_min, lon_max, n // side)
+    stack = inference.FeatureStack(lat_axis, lon_axis)
+    stack.add_cube("sst", Path(work) / "cube" / "sst", f"{MONTHS[0][0]}-{MONTHS[0][1]:02d}-15")
+    stack.add("depth", -4000 * np.abs(np.sin(np.radians(np.add.outer(lat_axis * 7, lon_axis * 5)))))
+    stack.add("distance_to_shore_m", np.abs(np.add.outer(lat_axis - lat_min, lon_axis - lon_min)) * 1e4)
+    mask = np.ones(stack.shape, dtype=bool)
+    return lambda: inference.predict_grid(model, stack, mask, list(FEATURES)), stack.shape[0] * stack.shape[1]
+
+
+# --------- running ----------
+def _status_mb(field):
+    with open("/proc/self/status") as f:
+        return next(int(line.split()[1]) for line in f if line.startswith(field + ":")) / 1024
+
+
+def _peak_rss_mb():
+    """Peak resident memory of this process. VmHWM only counts the current program, whereas
+    ru_maxrss of a spawned child starts from its parent's peak at fork time."""
+    try:
+        return _status_mb("VmHWM")
+    except (OSError, StopIteration):
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss / 2 ** 20 if sys.platform == "darwin" else rss / 1024
+
+
+def _reset_peak_rss():
+    """Current RSS in MB, with the peak reset to it where the kernel allows (Linux clear_refs);
+    elsewhere the current peak, so that the delta measured after the call is a lower bound."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return _status_mb("VmRSS")
+    except (OSError, StopIteration):
+        return _peak_rss_mb()
+
+
+def _child(conn, name, work, n, res, seed, repeat):
+    try:
+        times, deltas = [], []
+        for _ in range(repeat):
+            run, points = globals()[name](work, n, res, seed)
+            before = _reset_peak_rss()
+            t0 = time.perf_counter()
+            run()
+            times.append(time.perf_counter() - t0)
+            deltas.append(max(_peak_rss_mb() - before, 0.0))
+        conn.send({"times": times, "points": points, "rss_delta_mb": max(deltas), "peak_rss_mb": _peak_rss_mb()})
+    except BaseException as error:
+        conn.send({"error": f"{type(error).__name__}: {error}"})
+        raise
+    finally:
+        conn.close()
+
+
+def _prerequisites(work, n, res, seed, stages):
+    """Download and pack the cube outside the timings when a selected stage needs it and no
+    earlier selected stage will produce it."""
+    needs_cube = any(s not in ("meteomatics_download", "meteomatics_pack") for s in stages)
+    if "meteomatics_pack" in stages or needs_cube:
+        if "meteomatics_download" not in stages and not (Path(work) / "meteomatics" / "sst").is_dir():
+            meteomatics_download(work, n, res, seed)[0]()
+    if needs_cube and "meteomatics_pack" not in stages and not (Path(work) / "cube" / "sst" / "grid.json").exists():
+        meteomatics_pack(work, n, res, seed)[0]()
+    if "predict_grid" in stages:
+        _model(work, seed)
+
+
+def run_stage(name, work, n, res, seed, repeat=1):
+    """Run one stage `repeat` times in a spawned process; returns its fastest and median seconds,
+    points, points/s (at the fastest), memory added by the stage call and peak RSS."""
+    ctx = multiprocessing.get_context("spawn")
+    recv, send = ctx.Pipe(duplex=False)
+    proc = ctx.Process(target=_child, args=(send, name, str(work), n, res, seed, repeat))
+    proc.start()
+    send.close()
+    try:
+        result = recv.recv()
+    except EOFError:
+        result = {"error": "process exited without a result"}
+    proc.join()
+    if "error" in result:
+        raise RuntimeError(f"{name} failed (exit code {proc.exitcode}): {result['error']}")
+    times = sorted(result["times"])
+    return {"seconds": round(times[0], 4), "median_seconds": round(float(np.median(times)), 4),
+            "repeat": len(times), "points": result["points"],
+            "points_per_s": round(result["points"] / times[0], 1),
+            "rss_delta_mb": round(result["rss_delta_mb"], 1), "peak_rss_mb": round(result["peak_rss_mb"], 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark of the model pipeline on synthetic data")
+    parser.add_argument("workdir", help="synthetic inputs go to <workdir>/data_<scale>")
+    parser.add_argument("--scale", choices=SCALES, default="10k")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="results JSON (default <workdir>/results_<scale>.json)")
+    parser.add_argument("--baseline", help="results JSON of an earlier run to compare against")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per stage; the fastest is compared")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="a stage regresses if its time exceeds the baseline by this fraction")
+    parser.add_argument("--min-delta", type=float, default=0.1,
+                        help="... and by at least this many seconds")
+    parser.add_argument("--rss-tolerance", type=float, default=0.25,
+                        help="same for the memory the stage call adds (rss_delta_mb)")
+    parser.add_argument("--min-rss-delta", type=float, default=16.0, help="... and by at least this many MB")
+    args = parser.parse_args()
+
+    n, res = SCALES[args.scale]
+    work = Path(args.workdir).resolve() / f"data_{args.scale}"
+    work.mkdir(parents=True, exist_ok=True)
+    out = Path(args.out) if args.out else work.parent / f"results_{args.scale}.json"
+    baseline = json.loads(Path(args.baseline).read_text()) if args.baseline else None
+    print(f"Scale {args.scale}: {n} points, {res} degree Meteomatics grid, data in {work}")
+    _points(work, n, args.seed)
+    _prerequisites(work, n, res, args.seed, args.stages)
+
+    results = {"scale": args.scale, "n": n, "seed": args.seed,
+               "created": datetime.datetime.now().isoformat(timespec="seconds"),
+               "python": platform.python_version(), "machine": platform.machine(),
+               "cpus": os.cpu_count(), "stages": {}}
+    for name in STAGES:
+        if name not in args.stages:
+            continue
+        r = run_stage(name, work, n, res, args.seed, args.repeat)
+        results["stages"][name] = r
+        print(f"{name}: {r['seconds']:.2f}s (median {r['median_seconds']:.2f}s), {r['points_per_s']:.0f} points/s, "
+              f"+{r['rss_delta_mb']:.0f} MB ({r['peak_rss_mb']:.0f} MB process peak)")
+
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(results, indent=1))
+    print(f"Wrote {out}")
+
+    if baseline is not None:
+        sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "sharks-from-space" / "scripts"))
+        from benchmark import compare
+        regressions = compare(results, baseline, args.tolerance, args.rss_tolerance,
+                              args.min_delta, args.min_rss_delta, memory="rss_delta_mb")
+        if regressions:
+            print(f"{len(regressions)} regressions against {args.baseline}")
+            sys.exit(1)
+        print("No regressions")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Compact, memory-mapped regular grid for the NASA distance-to-coast dataset.
+
+The source `dist2coast.txt` is a tab separated `lon lat km` listing of every node of a
+regular 0.04 degree grid. Parsing it (and nearest-joining against it) takes minutes, so
+it is converted once into a small binary file: a fixed-size header describing the grid
+followed by a float32 (lat, lon) array in metres. Lookups memory-map that array and
+resolve arrays of lon/lat by index arithmetic.
+
+    python -m sdm.dist2coast ../data/environmental/nasa/dist2coast.txt \
+        ../data/environmental/nasa/dist2coast.d2c
+"""
+import argparse
+import struct
+
+import numpy as np
+import pandas as pd
+
+MAGIC = b"D2C1"
+HEADER_FMT = "<4sIIdddd"  # magic, n_lat, n_lon, lon0, lat0, d_lon, d_lat
+HEADER_SIZE = 64  # header is padded so the data block starts aligned
+CHUNK_ROWS = 2_000_000
+
+
+def _read_chunks(txt_path):
+    return pd.read_csv(
+        txt_path, sep=r"\s+", header=None, names=["lon", "lat", "value"],
+        dtype=np.float64, chunksize=CHUNK_ROWS, engine="c",
+    )
+
+
+def _grid_spacing(values):
+    steps = np.diff(np.unique(values))
+    steps = steps[steps > 1e-9]
+    return float(steps.min()) if len(steps) else np.inf
+
+
+def convert_dist2coast(txt_path, out_path):
+    """
+    Stream `dist2coast.txt` into the binary grid format. Two passes over the text: the first
+    finds the extent and spacing, the second writes every node straight into a memmap.
+    Nodes missing from the text stay NaN.
+    """
+    lon_min = lat_min = np.inf
+    lon_max = lat_max = -np.inf
+    d_lon = d_lat = np.inf
+    for chunk in _read_chunks(txt_path):
+        lon_min, lon_max = min(lon_min, chunk["lon"].min()), max(lon_max, chunk["lon"].max())
+        lat_min, lat_max = min(lat_min, chunk["lat"].min()), max(lat_max, chunk["lat"].max())
+        d_lon = min(d_lon, _grid_spacing(chunk["lon"].values))
+        d_lat = min(d_lat, _grid_spacing(chunk["lat"].values))
+
+    n_lon = int(round((lon_max - lon_min) / d_lon)) + 1
+    n_lat = int(round((lat_max - lat_min) / d_lat)) + 1
+
+    header = struct.pack(HEADER_FMT, MAGIC, n_lat, n_lon, lon_min, lat_min, d_lon, d_lat)
+    with open(out_path, "wb") as f:
+        f.write(header.ljust(HEADER_SIZE, b"\0"))
+    grid = np.memmap(out_path, dtype="<f4", mode="r+", offset=HEADER_SIZE, shape=(n_lat, n_lon))
+    grid[:] = np.nan
+
+    for chunk in _read_chunks(txt_path):
+        i = np.rint((chunk["lat"].values - lat_min) / d_lat).astype(np.int64)
+        j = np.rint((chunk["lon"].values - lon_min) / d_lon).astype(np.int64)
+        grid[i, j] = chunk["value"].values * 1000  # km -> metres
+    grid.flush()
+    print(f"Wrote {out_path}: {n_lat} x {n_lon} grid, {d_lat:.4f} x {d_lon:.4f} degrees")
+    return out_path
+
+
+class Dist2Coast:
+    """Distance to shore (metres) looked up from a memory-mapped `.d2c` grid."""
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            magic, n_lat, n_lon, lon0, lat0, d_lon, d_lat = struct.unpack(
+                HEADER_FMT, f.read(struct.calcsize(HEADER_FMT))
+            )
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a dist2coast grid file")
+        self.lon0, self.lat0, self.d_lon, self.d_lat = lon0, lat0, d_lon, d_lat
+        self.grid = np.memmap(path, dtype="<f4", mode="r", offset=HEADER_SIZE, shape=(n_lat, n_lon))
+        self.wraps = abs(n_lon * d_lon - 360) < d_lon / 2
+
+    def indices(self, lons, lats):
+        """Row/column of the nearest grid node for every lon/lat."""
+        n_lat, n_lon = self.grid.shape
+        lons = np.asarray(lons, dtype=float)
+        lats = np.asarray(lats, dtype=float)
+        i = np.clip(np.rint((lats - self.lat0) / self.d_lat), 0, n_lat - 1).astype(np.int64)
+        j = np.rint((lons - self.lon0) / self.d_lon).astype(np.int64)
+        j = j % n_lon if self.wraps else np.clip(j, 0, n_lon - 1)
+        return i, j
+
+    def distance_m(self, lons, lats):
+        """Distance to the nearest coast in metres (NaN where the grid has no value)."""
+        i, j = self.indices(lons, lats)
+        return self.grid[i, j].astype(float)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert NASA dist2coast.txt to a memory-mappable grid")
+    parser.add_argument("txt_path")
+    parser.add_argument("out_path")
+    args = parser.parse_args()
+    convert_dist2coast(args.txt_path, args.out_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+"""
+Suitability maps for a range of dates in one run, appended to a time-indexed store.
+
+Static predictors (distance to shore, ocean depth) are resampled onto the grid once and
+shared by every date; only the dynamic ones (SST, currents, Stokes drift) are read per date
+from their packed Meteomatics cubes. Dates are predicted in parallel with `sdm.inference`
+and each map goes straight into its slot of a `SuitabilityStore`:
+
+    <store>/index.json           dates -> slot, chunk size, grid shape
+    <store>/lat.npy, lon.npy     target grid axes
+    <store>/chunk_00000.npy      float32 (chunk, lat, lon) memory-mapped blocks of maps
+
+Dates already in the store are skipped, so a range can be extended or an interrupted run
+resumed, and `read` hands back any subset of dates as one (time, lat, lon) array.
+
+    static = FeatureStack(lats, lons).add_dist2coast("distance_to_shore_m", dist2coast)
+    static.add_cube("ocean_depth", cube_dir / "ocean_depth", "2025-10-01", invalid=lambda x: x < 0)
+    forecast(final_model, PREDICTOR_COLS, static, {"sst": cube_dir / "sst", ...},
+             accessible_area_mask, forecast_dates("2025-01-01", "2025-12-31"), "../data/predictions/daily")
+"""
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+import numpy as np
+
+from sdm.inference import OUT_DTYPE, TILE, _booster_and_range, predict_into
+from sdm.meteomatics import Datacube
+
+INDEX_FILE = "index.json"
+CHUNK = 32
+FREQS = ("D", "M")
+
+
+def forecast_dates(start, end, freq="D"):
+    """Every day ("D") or every month ("M", as its first day) from `start` to `end` inclusive."""
+    if freq not in FREQS:
+        raise ValueError(f"freq must be one of {FREQS}, got {freq!r}")
+    return np.arange(np.datetime64(start, freq), np.datetime64(end, freq) + 1).astype("datetime64[D]")
+
+
+class SuitabilityStore:
+    """Prediction maps keyed by date, in fixed-size memory-mapped chunks of `chunk` maps."""
+
+    def __init__(self, root, lat_axis=None, lon_axis=None, chunk=CHUNK):
+        self.root = Path(root)
+        self._lock = threading.Lock()
+        self._chunks = {}
+        index_path = self.root / INDEX_FILE
+        if index_path.exists():
+            self.index = json.loads(index_path.read_text())
+            self.lat_axis = np.load(self.root / "lat.npy")
+            self.lon_axis = np.load(self.root / "lon.npy")
+            if lat_axis is not None and (len(lat_axis) != len(self.lat_axis)
+                                         or not np.allclose(lat_axis, self.lat_axis)
+                                         or len(lon_axis) != len(self.lon_axis)
+                                         or not np.allclose(lon_axis, self.lon_axis)):
+                raise ValueError(f"{self.root} holds maps on a different grid")
+        else:
+            if lat_axis is None:
+                raise FileNotFoundError(f"no store at {self.root} (pass the grid axes to create one)")
+            self.root.mkdir(parents=True, exist_ok=True)
+            self.lat_axis = np.asarray(lat_axis, dtype=float)
+            self.lon_axis = np.asarray(lon_axis, dtype=float)
+            np.save(self.root / "lat.npy", self.lat_axis)
+            np.save(self.root / "lon.npy", self.lon_axis)
+            self.index = {"shape": [len(self.lat_axis), len(self.lon_axis)], "chunk": chunk,
+                          "n_chunks": 0, "dates": {}}
+            self._write_index()
+
+    @property
+    def shape(self):
+        return tuple(self.index["shape"])
+
+    @property
+    def dates(self):
+        """Stored dates in time order."""
+        return np.array(sorted(self.index["dates"]), dtype="datetime64[D]")
+
+    def __contains__(self, date):
+        return str(np.datetime64(date, "D")) in self.index["dates"]
+
+    def __len__(self):
+        return len(self.index["dates"])
+
+    def _write_index(self):
+        tmp = self.root / f"{INDEX_FILE}.tmp"
+        tmp.write_text(json.dumps(self.index, indent=1))
+        os.replace(tmp, self.root / INDEX_FILE)
+
+    def _chunk(self, k, mode="r"):
+        key = (k, mode)
+        if key not in self._chunks:
+            path = self.root / f"chunk_{k:05d}.npy"
+            if mode == "r+" and not path.exists():
+                np.lib.format.open_memmap(path, mode="w+", dtype=OUT_DTYPE,
+                                          shape=(self.index["chunk"],) + self.shape).flush()
+            self._chunks[key] = np.load(path, mmap_mode=mode)
+        return self._chunks[key]
+
+    def reserve(self, dates):
+        """Free slots for `dates`: gaps left by interrupted runs first, then new chunks."""
+        with self._lock:
+            used = set(self.index["dates"].values())
+            total = self.index["n_chunks"] * self.index["chunk"]
+            free = (s for s in range(total + len(dates)) if s not in used)
+            slots = [next(free) for _ in dates]
+            self.index["n_chunks"] = max(self.index["n_chunks"], -(-(max(slots, default=-1) + 1)
+                                                                  // self.index["chunk"]))
+            self._write_index()
+        return slots
+
+    def slot_array(self, slot):
+        """Writable (lat, lon) view of a slot."""
+        with self._lock:
+            chunk = self._chunk(slot // self.index["chunk"], "r+")
+        return chunk[slot % self.index["chunk"]]
+
+    def commit(self, date, slot):
+        """Record a fully written slot under its date."""
+        with self._lock:
+            self._chunk(slot // self.index["chunk"], "r+").flush()
+            self.index["dates"][str(np.datetime64(date, "D"))] = int(slot)
+            self._write_index()
+
+    def __getitem__(self, date):
+        slot = self.index["dates"][str(np.datetime64(date, "D"))]
+        return self._chunk(slot // self.index["chunk"])[slot % self.index["chunk"]]
+
+    def read(self, dates=None):
+        """(dates, maps[time, lat, lon]) for the given stored dates (all by default), in time order."""
+        dates = self.dates if dates is None else np.sort(np.asarray(dates, dtype="datetime64[D]"))
+        out = np.empty((len(dates),) + self.shape, dtype=OUT_DTYPE)
+        for t, date in enumerate(dates):
+            out[t] = self[date]
+        return dates, out
+
+
+def forecast(model, features, static, dynamic, mask, dates, store, invalid=None, period="D",
+             date_workers=None, tile_workers=1, tile=TILE):
+    """
+    Predict every date in `dates` that is not yet in `store` (a `SuitabilityStore` or a
+    directory) and append the maps to it.
+
+    `static` is a `FeatureStack` on the target grid holding the date-independent layers; it is
+    materialized once and shared. `dynamic` maps a feature name to its packed cube, read for
+    each date (`period="M"` uses the mean of the month). `invalid` maps feature names to the
+    usual `invalid(values)` rules. Returns the store.
+    """
+    mask = np.asarray(mask, dtype=bool)
+    if not isinstance(store, SuitabilityStore):
+        store = SuitabilityStore(store, static.lat_axis, static.lon_axis)
+    if store.shape != static.shape:
+        raise ValueError(f"store grid {store.shape} does not match the stack grid {static.shape}")
+    invalid = invalid or {}
+    booster, iteration_range = _booster_and_range(model)
+    cubes = {name: c if isinstance(c, Datacube) else Datacube(c) for name, c in dynamic.items()}
+
+    static = static.copy().materialize()
+    todo = [d for d in np.asarray(dates, dtype="datetime64[D]") if d not in store]
+    print(f"Forecasting {len(todo)} dates ({len(dates) - len(todo)} already in {store.root})")
+    if not todo:
+        return store
+    slots = store.reserve(todo)
+
+    def run(date, slot):
+        stack = static.copy()
+        for name, cube in cubes.items():
+            stack.add_cube(name, cube, date, invalid.get(name), period)
+        predict_into(booster, iteration_range, stack, mask, features, store.slot_array(slot), tile, tile_workers)
+        store.commit(date, slot)
+        return date
+
+    t0 = time.monotonic()
+    with ThreadPoolExecutor(max_workers=date_workers or os.cpu_count()) as pool:
+        futures = [pool.submit(run, date, slot) for date, slot in zip(todo, slots)]
+        for n, future in enumerate(as_completed(futures), 1):
+            date = future.result()
+            if n % 10 == 0 or n == len(todo):
+                print(f"  {n}/{len(todo)} dates ({date}), {time.monotonic() - t0:.1f}s")
+    return store
@@ -0,0 +1,214 @@
+"""
+Suitability predictions over the whole accessible-area grid, a tile at a time.
+
+Every predictor is a `Layer`: a 2D source grid (a day of a packed Meteomatics `Datacube`,
+the dist2coast grid, or any (lat, lon) array) plus the source row of every target latitude
+and the source column of every target longitude. The target grids are regular, so those
+nearest-node lookups are worked out once per axis instead of once per cell. A tile of the
+`FeatureStack` is then a single `np.ix_` read per layer.
+
+`predict_grid` walks the grid in tiles, keeps the cells inside the mask, scores them with
+xgboost's in-place prediction (no DMatrix, no DataFrame) from a thread pool and writes
+each tile into a float32 raster that can live in a memory-mapped `.npy`. Cells outside the
+mask (land, outside the latitude band) are NaN and tiles without any masked cell are skipped.
+
+    stack = FeatureStack(lats, lons)
+    stack.add_dist2coast("distance_to_shore_m", Dist2Coast("../data/environmental/nasa/dist2coast.d2c"))
+    stack.add_cube("sst", Datacube("../data/environmental/meteomatics_cube/sst"), "2025-10-03",
+                   invalid=lambda v: v <= -50)
+    predictions = predict_grid(final_model, stack, accessible_area_mask, PREDICTOR_COLS,
+                               out_path="../data/predictions/predictions_2025_10_03.npy")
+"""
+import os
+import time
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from sdm.meteomatics import Datacube
+
+TILE = (512, 512)
+OUT_DTYPE = np.float32
+
+
+class Layer:
+    """
+    A (lat, lon) source grid read at `rows` x `cols`; `values=None` is an all-NaN layer and
+    `rows=cols=None` a layer already on the target grid.
+    """
+
+    def __init__(self, values, rows=None, cols=None, invalid=None):
+        self.values = values
+        self.rows = None if rows is None else np.asarray(rows, dtype=np.int64)
+        self.cols = None if cols is None else np.asarray(cols, dtype=np.int64)
+        self.invalid = invalid
+
+    def read(self, rows, cols, out):
+        """Fill `out` (h, w) with the layer on target rows/cols (two slices)."""
+        if self.values is None:
+            out[:] = np.nan
+            return out
+        if self.rows is None:
+            out[:] = self.values[rows, cols]
+        else:
+            out[:] = self.values[np.ix_(self.rows[rows], self.cols[cols])]
+        if self.invalid is not None:
+            out[self.invalid(out)] = np.nan
+        return out
+
+
+class FeatureStack:
+    """Named predictor layers on a common (lat_axis, lon_axis) target grid."""
+
+    def __init__(self, lat_axis, lon_axis):
+        self.lat_axis = np.asarray(lat_axis, dtype=float)
+        self.lon_axis = np.asarray(lon_axis, dtype=float)
+        self.layers = {}
+
+    @property
+    def shape(self):
+        return len(self.lat_axis), len(self.lon_axis)
+
+    def add(self, name, values, rows=None, cols=None, invalid=None):
+        """
+        Add a layer (`rows`/`cols` index `values` for every target row/column; leave them out
+        if `values` is already on the target grid). `invalid(values) -> bool array` marks
+        readings to treat as missing.
+        """
+        self.layers[name] = Layer(values, rows, cols, invalid)
+        return self
+
+    def add_cube(self, name, cube, date, invalid=None, period="D"):
+        """
+        The day `date` of a packed Meteomatics variable, or with `period="M"` the mean of its
+        month (invalid readings dropped before averaging). All NaN if the month was not packed.
+        """
+        cube = cube if isinstance(cube, Datacube) else Datacube(cube)
+        date = np.datetime64(date, "D")
+        month = date.astype("datetime64[M]")
+        m = month.astype(np.int64)
+        chunk = cube.chunk(int(m // 12 + 1970), int(m % 12 + 1))
+        day = int((date - month).astype(np.int64))
+        if chunk is None:
+            values = None
+        elif period == "M":
+            values = np.array(chunk, dtype=np.float32)
+            if invalid is not None:
+                values[invalid(values)] = np.nan
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", RuntimeWarning)  # all-NaN nodes stay NaN
+                values = np.nanmean(values, axis=0)
+        elif period == "D":
+            values = chunk[day] if day < len(chunk) else None
+        else:
+            raise ValueError(f"period must be 'D' or 'M', got {period!r}")
+        rows, cols = cube.indices(self.lat_axis, self.lon_axis)
+        return self.add(name, values, rows, cols, invalid)
+
+    def add_dist2coast(self, name, dist2coast):
+        """Distance to shore in metres from a `Dist2Coast` grid."""
+        rows, cols = dist2coast.indices(self.lon_axis, self.lat_axis)
+        return self.add(name, dist2coast.grid, rows, cols)
+
+    def tile(self, names, rows, cols):
+        """(len(names), h, w) float32 block of the layers over the target rows/cols (slices)."""
+        h = len(range(*rows.indices(self.shape[0])))
+        w = len(range(*cols.indices(self.shape[1])))
+        block = np.empty((len(names), h, w), dtype=np.float32)
+        for k, name in enumerate(names):
+            self.layers[name].read(rows, cols, block[k])
+        return block
+
+    def raster(self, name, mask=None):
+        """One layer over the whole grid (NaN outside `mask`), e.g. for plotting."""
+        out = self.tile([name], slice(None), slice(None))[0]
+        if mask is not None:
+            out[~np.asarray(mask, dtype=bool)] = np.nan
+        return out
+
+    def copy(self):
+        """A new stack sharing the current layers (e.g. static ones) that can be extended."""
+        stack = FeatureStack(self.lat_axis, self.lon_axis)
+        stack.layers.update(self.layers)
+        return stack
+
+    def materialize(self, names=None):
+        """Resample layers onto the target grid once, so later tiles are plain slices."""
+        for name in names if names is not None else list(self.layers):
+            self.layers[name] = Layer(self.raster(name))
+        return self
+
+
+def _booster_and_range(model):
+    """Booster and iteration range `predict_proba` would use (up to the best early-stopping round)."""
+    booster = model.get_booster() if hasattr(model, "get_booster") else model
+    best = getattr(model, "best_iteration", None)
+    if best is None:
+        best = getattr(booster, "best_iteration", None)
+    return booster, (0, best + 1 if best is not None else 0)
+
+
+def _tiles(shape, tile):
+    for r0 in range(0, shape[0], tile[0]):
+        for c0 in range(0, shape[1], tile[1]):
+            yield slice(r0, min(r0 + tile[0], shape[0])), slice(c0, min(c0 + tile[1], shape[1]))
+
+
+def predict_grid(model, stack, mask, features, out_path=None, tile=TILE, workers=None):
+    """
+    Presence probability for every cell of `mask` (a (lat, lon) boolean/0-1 array on the
+    stack's grid), NaN elsewhere. `model` is a fitted `XGBClassifier` or a `Booster`;
+    `features` gives the layer order the model was trained with.
+
+    With `out_path` the raster is written to a memory-mapped `.npy` (swapped in when
+    complete) and returned opened read-only; otherwise it is returned in memory.
+    """
+    mask = np.asarray(mask, dtype=bool)
+    booster, iteration_range = _booster_and_range(model)
+
+    if out_path is None:
+        out = np.full(stack.shape, np.nan, dtype=OUT_DTYPE)
+    else:
+        out_path = str(out_path)
+        tmp = out_path[:-len(".npy")] + ".tmp.npy" if out_path.endswith(".npy") else out_path + ".tmp.npy"
+        out = np.lib.format.open_memmap(tmp, mode="w+", dtype=OUT_DTYPE, shape=stack.shape)
+
+    t0 = time.monotonic()
+    cells = predict_into(booster, iteration_range, stack, mask, features, out, tile, workers)
+    print(f"Predicted {cells} cells of a {stack.shape[0]} x {stack.shape[1]} grid "
+          f"in {time.monotonic() - t0:.1f}s")
+
+    if out_path is None:
+        return out
+    out.flush()
+    del out
+    os.replace(tmp, out_path)
+    return np.load(out_path, mmap_mode="r")
+
+
+def predict_into(booster, iteration_range, stack, mask, features, out, tile=TILE, workers=None):
+    """Fill the (lat, lon) array `out` in place (NaN outside `mask`); returns the number of cells scored."""
+    if mask.shape != stack.shape or out.shape != stack.shape:
+        raise ValueError(f"mask {mask.shape} and output {out.shape} must match the stack grid {stack.shape}")
+    missing = [name for name in features if name not in stack.layers]
+    if missing:
+        raise KeyError(f"no layer for features {missing}")
+    out[:] = np.nan
+
+    def run(rows, cols):
+        inside = mask[rows, cols]
+        n = int(inside.sum())
+        if n == 0:
+            return 0
+        X = np.ascontiguousarray(stack.tile(features, rows, cols)[:, inside].T)
+        probs = booster.inplace_predict(X, iteration_range=iteration_range, missing=np.nan)
+        block = out[rows, cols]
+        block[inside] = probs
+        return n
+
+    tiles = list(_tiles(stack.shape, tile))
+    if workers == 1:
+        return sum(run(*rc) for rc in tiles)
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        return sum(pool.map(lambda rc: run(*rc), tiles))
@@ -0,0 +1,446 @@
+"""
+Meteomatics monthly grids: bulk download and memory-mapped datacubes.
+
+`download_months` fetches one CSV per (variable, year, month) over the accessible-area
+bounding box with a bounded worker pool. It retries with backoff, streams each response
+straight to disk and keeps a `manifest.json` of completed files, so a re-run only fetches
+what is missing. `serve` is a local stand-in for the API (same URL scheme, synthetic values,
+optional failures) for trying the downloader without credentials or quota.
+
+The notebook downloads one CSV per variable and month (`meteomatics/<var>/<year>_<month>.csv`,
+columns `lat, lon, validdate, <parameter>`) on a regular 1 degree grid at daily steps.
+`pack_variable` converts each CSV once into a float32 `(day, lat, lon)` chunk
+(`<cube>/<var>/<year>_<month>.npy`) next to a `grid.json` describing the shared axes. Months
+whose CSV has not changed since they were packed are skipped.
+
+`extract` then resolves arrays of (date, lat, lon) for several variables at once. The
+nearest grid node comes from index arithmetic on the regular axes, the same node
+`sjoin_nearest` picked in degrees, and each monthly chunk is memory-mapped and indexed
+once for all of its points.
+
+    python -m sdm.meteomatics download ../data/environmental/meteomatics \
+        --credentials ../data/environmental/meteomatics/api_key.json \
+        --variable t_sea_sfc:C=sst --start 2010-01 --end 2019-12
+    python -m sdm.meteomatics pack ../data/environmental/meteomatics \
+        ../data/environmental/meteomatics_cube sst ocean_depth
+"""
+import argparse
+import calendar
+import json
+import os
+import random
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import unquote
+
+import numpy as np
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+from requests.auth import HTTPBasicAuth
+
+BASE_URL = "https://api.meteomatics.com"
+BBOX = {"lat_min": -39, "lat_max": 46, "lon_min": -180, "lon_max": 180}
+RETRY_STATUS = {408, 429, 500, 502, 503, 504}
+MANIFEST_FILE = "manifest.json"
+GRID_FILE = "grid.json"
+MONTH_FILE = re.compile(r"^(\d{4})_(\d{2})\.csv$")
+CHUNK_DTYPE = np.float32
+
+
+def month_url(year, month, parameter, lat_min, lat_max, lon_min, lon_max,
+              res_deg=1.0, interval="PT24H", fmt="csv", base_url=BASE_URL):
+    """API URL for a whole month of `parameter` over a latitude/longitude bounding box."""
+    days_in_month = calendar.monthrange(year, month)[1]
+    start_iso = f"{year}-{month:02d}-01T00:00:00Z"
+    end_iso = f"{year}-{month:02d}-{days_in_month}T23:00:00Z"
+    bbox = f"{lat_max},{lon_min}_{lat_min},{lon_max}:{res_deg},{res_deg}"
+    return f"{base_url}/{start_iso}--{end_iso}:{interval}/{parameter}/{bbox}/{fmt}"
+
+
+class Manifest:
+    """Completed downloads (`<save_name>/<year>_<month>`), rewritten atomically after each one."""
+
+    def __init__(self, root):
+        self.path = Path(root) / MANIFEST_FILE
+        self.entries = json.loads(self.path.read_text()) if self.path.exists() else {}
+        self._lock = threading.Lock()
+
+    def done(self, key, path):
+        return key in self.entries and Path(path).exists()
+
+    def add(self, key, entry):
+        with self._lock:
+            self.entries[key] = entry
+            tmp = self.path.with_suffix(".tmp")
+            tmp.write_text(json.dumps(self.entries, indent=1, sort_keys=True))
+            os.replace(tmp, self.path)
+
+
+def _stream_csv(session, url, dest, timeout):
+    """
+    GET `url` and write the semicolon separated response to `dest` as comma separated CSV
+    (the format the notebook used to save), line by line. Returns the number of rows.
+    """
+    tmp = Path(str(dest) + ".part")
+    rows = -1
+    with session.get(url, stream=True, timeout=timeout) as response:
+        if response.status_code != 200:
+            raise requests.HTTPError(f"{response.status_code}: {response.text[:200]}", response=response)
+        response.encoding = response.encoding or "utf-8"
+        with open(tmp, "w", encoding="utf-8") as f:
+            for line in response.iter_lines(chunk_size=1 << 16, decode_unicode=True):
+                if line:
+                    f.write(line.replace(";", ",") + "\n")
+                    rows += 1
+    os.replace(tmp, dest)
+    return rows
+
+
+def _expected_rows(year, month, bbox, res_deg, interval):
+    """Data rows of a complete month file (grid nodes x time steps), or None for intervals other than PT<n>H."""
+    step = re.fullmatch(r"PT(\d+)H", interval)
+    if step is None:
+        return None
+    n_lat = len(np.arange(bbox["lat_max"], bbox["lat_min"] - res_deg / 2, -res_deg))
+    n_lon = len(np.arange(bbox["lon_min"], bbox["lon_max"] + res_deg / 2, res_deg))
+    hours = calendar.monthrange(year, month)[1] * 24
+    return n_lat * n_lon * -(-hours // int(step.group(1)))
+
+
+def _complete_csv(path, expected_rows):
+    """
+    Whether a month CSV written by the old in-place downloader is whole: its last line has as
+    many fields as the header and ends in a number, and (when known) the row count is right.
+    """
+    with open(path, "rb") as f:
+        header = f.readline().rstrip(b"\r\n")
+        lines, last = 0, b""
+        for block in iter(lambda: f.read(1 << 20), b""):
+            lines += block.count(b"\n")
+            last = (last + block)[-4096:]
+    if not header or not last.endswith(b"\n"):
+        return False
+    fields = last.rstrip(b"\r\n").rsplit(b"\n", 1)[-1].split(b",")
+    if len(fields) != len(header.split(b",")):
+        return False
+    try:
+        float(fields[-1])
+    except ValueError:
+        return False
+    return expected_rows is None or lines == expected_rows
+
+
+def _retryable(error):
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        return error.response.status_code in RETRY_STATUS
+    return isinstance(error, (requests.ConnectionError, requests.Timeout,
+                              requests.exceptions.ChunkedEncodingError))
+
+
+def download_months(jobs, out_root, username=None, password=None, base_url=BASE_URL, bbox=BBOX,
+                    res_deg=1.0, interval="PT24H", workers=4, retries=4, backoff=2.0,
+                    max_backoff=60.0, timeout=300):
+    """
+    Download `jobs`, an iterable of (parameter, save_name, year, month), to
+    `<out_root>/<save_name>/<year>_<month>.csv`. Jobs already in the manifest (with their file
+    present) are skipped. Files downloaded before the manifest existed are added to it if they
+    are complete (see `_complete_csv`) and downloaded again otherwise. Failed jobs are reported
+    and left out of the manifest, so the next call retries them. Returns a summary dict.
+    """
+    out_root = Path(out_root)
+    manifest = Manifest(out_root)
+    session = requests.Session()
+    session.mount("http://", HTTPAdapter(pool_maxsize=workers))
+    session.mount("https://", HTTPAdapter(pool_maxsize=workers))
+    if username is not None:
+        session.auth = HTTPBasicAuth(username, password)
+
+    summary = {"skipped": 0, "downloaded": 0, "failed": [], "retried": 0}
+    pending = []
+    for parameter, save_name, year, month in jobs:
+        key = f"{save_name}/{year}_{month:02d}"
+        dest = out_root / save_name / f"{year}_{month:02d}.csv"
+        if not manifest.done(key, dest) and dest.exists():
+            # saved before the manifest existed, possibly by the old downloader that wrote in
+            # place and could leave a truncated file; only _stream_csv's files appear whole
+            if _complete_csv(dest, _expected_rows(year, month, bbox, res_deg, interval)):
+                manifest.add(key, {"parameter": parameter, "bytes": dest.stat().st_size, "adopted": True})
+            else:
+                print(f"Incomplete {dest}, downloading it again")
+        if manifest.done(key, dest):
+            summary["skipped"] += 1
+        else:
+            pending.append((key, parameter, year, month, dest))
+
+    def run(job):
+        key, parameter, year, month, dest = job
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        url = month_url(year, month, parameter, res_deg=res_deg, interval=interval, base_url=base_url, **bbox)
+        for attempt in range(retries + 1):
+            try:
+                t0 = time.monotonic()
+                rows = _stream_csv(session, url, dest, timeout)
+                manifest.add(key, {"parameter": parameter, "rows": rows, "bytes": dest.stat().st_size,
+                                   "seconds": round(time.monotonic() - t0, 2)})
+                return key, None, attempt
+            except (requests.RequestException, OSError) as error:
+                if attempt == retries or not _retryable(error):
+                    return key, error, attempt
+                time.sleep(random.uniform(0, min(max_backoff, backoff * 2 ** attempt)))
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(run, job) for job in pending]
+        for n, future in enumerate(as_completed(futures), 1):
+            key, error, attempts = future.result()
+            summary["retried"] += attempts
+            if error is None:
+                summary["downloaded"] += 1
+            else:
+                summary["failed"].append(key)
+                print(f"Failed {key}: {error}")
+            print(f"[{n}/{len(pending)}] {key}{' (failed)' if error else ''}")
+    return summary
+
+
+def _month_range(start, end):
+    months = pd.period_range(start, end, freq="M")
+    return [(p.year, p.month) for p in months]
+
+
+class _StandInHandler(BaseHTTPRequestHandler):
+    """GET /<start>--<end>:<step>/<parameter>/<lat_max>,<lon_min>_<lat_min>,<lon_max>:<res>,<res>/csv"""
+
+    fail_rate = 0.0
+
+    def do_GET(self):
+        parts = unquote(self.path).strip("/").split("/")
+        try:
+            period, parameter, bbox, fmt = parts
+            start, end = period.rsplit(":", 1)[0].split("--")
+            corners, res = bbox.split(":")
+            (lat_max, lon_min), (lat_min, lon_max) = (map(float, c.split(",")) for c in corners.split("_"))
+            res = float(res.split(",")[0])
+        except ValueError:
+            self.send_error(400, "unexpected URL")
+            return
+        if random.random() < self.fail_rate:
+            self.send_error(503, "stand-in failure")
+            return
+
+        days = pd.date_range(start[:10], end[:10], freq="D")
+        lats = np.arange(lat_max, lat_min - res / 2, -res)
+        lons = np.arange(lon_min, lon_max + res / 2, res)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/csv")
+        self.end_headers()
+        self.wfile.write(f"lat;lon;validdate;{parameter}\n".encode())
+        for day in days:
+            stamp = day.strftime("%Y-%m-%dT%H:%M:%SZ")
+            value = np.add.outer(lats, lons / 1000.0) + day.day / 100.0
+            lines = (f"{lat:g};{lon:g};{stamp};{v:.3f}\n"
+                     for lat, row in zip(lats, value) for lon, v in zip(lons, row))
+            self.wfile.write("".join(lines).encode())
+
+    def log_message(self, *args):
+        pass
+
+
+def serve(port=8000, fail_rate=0.0):
+    """Run the local stand-in API on http://127.0.0.1:<port> until interrupted."""
+    handler = type("Handler", (_StandInHandler,), {"fail_rate": fail_rate})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    print(f"Meteomatics stand-in on http://127.0.0.1:{port} (fail rate {fail_rate})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def _regular_axis(values, name):
+    axis = np.unique(values)
+    if len(axis) == 1:
+        return float(axis[0]), 1.0, 1
+    steps = np.diff(axis)
+    if not np.allclose(steps, steps[0], rtol=1e-6, atol=1e-9):
+        raise ValueError(f"{name} axis is not a regular grid")
+    return float(axis[0]), float(steps[0]), len(axis)
+
+
+def read_month_csv(path):
+    """Parse one monthly CSV into (grid, year, month, values[day, lat, lon]) with NaN for missing nodes."""
+    year, month = (int(v) for v in MONTH_FILE.match(Path(path).name).groups())
+    df = pd.read_csv(path)
+    value_col = next(c for c in df.columns if c not in ("lat", "lon", "validdate"))
+    lat0, d_lat, n_lat = _regular_axis(df["lat"].to_numpy(dtype=float), "lat")
+    lon0, d_lon, n_lon = _regular_axis(df["lon"].to_numpy(dtype=float), "lon")
+    grid = {"lat0": lat0, "d_lat": d_lat, "n_lat": n_lat, "lon0": lon0, "d_lon": d_lon, "n_lon": n_lon}
+
+    days = pd.to_datetime(df["validdate"], utc=True).dt.day.to_numpy() - 1
+    i = np.rint((df["lat"].to_numpy(dtype=float) - lat0) / d_lat).astype(np.int64)
+    j = np.rint((df["lon"].to_numpy(dtype=float) - lon0) / d_lon).astype(np.int64)
+    values = np.full((calendar.monthrange(year, month)[1], n_lat, n_lon), np.nan, dtype=CHUNK_DTYPE)
+    values[days, i, j] = pd.to_numeric(df[value_col], errors="coerce").to_numpy(dtype=float)
+    return grid, year, month, values
+
+
+def _fingerprint(path):
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns]
+
+
+def pack_variable(csv_dir, cube_dir):
+    """
+    Pack every `<year>_<month>.csv` in `csv_dir` into `cube_dir`. Returns the number of months
+    (re)written; months already packed from the same file are left alone.
+    """
+    csv_dir, cube_dir = Path(csv_dir), Path(cube_dir)
+    cube_dir.mkdir(parents=True, exist_ok=True)
+    index_path = cube_dir / GRID_FILE
+    index = json.loads(index_path.read_text()) if index_path.exists() else {"grid": None, "months": {}}
+
+    written = 0
+    for path in sorted(csv_dir.glob("*.csv")):
+        if not MONTH_FILE.match(path.name):
+            continue
+        key = path.stem
+        fingerprint = _fingerprint(path)
+        if index["months"].get(key) == fingerprint and (cube_dir / f"{key}.npy").exists():
+            continue
+
+        grid, _, _, values = read_month_csv(path)
+        if index["grid"] is None:
+            index["grid"] = grid
+        elif any(not np.isclose(index["grid"][k], grid[k]) for k in grid):
+            raise ValueError(f"{path} is on a different grid from the rest of {csv_dir}")
+
+        tmp = cube_dir / f"{key}.tmp.npy"
+        np.save(tmp, values)
+        os.replace(tmp, cube_dir / f"{key}.npy")
+        index["months"][key] = fingerprint
+        # written after each month so an interrupted run keeps what it packed
+        index_path.write_text(json.dumps(index, indent=1))
+        written += 1
+    return written
+
+
+class Datacube:
+    """One packed variable: monthly (day, lat, lon) chunks on a shared regular grid."""
+
+    def __init__(self, cube_dir):
+        self.dir = Path(cube_dir)
+        index = json.loads((self.dir / GRID_FILE).read_text())
+        self.grid = index["grid"]
+        self.months = set(index["months"])
+        self._chunks = {}
+
+    def indices(self, lats, lons):
+        """Row/column of the nearest grid node for every point (clamped to the grid edge)."""
+        g = self.grid
+        i = np.rint((np.asarray(lats, dtype=float) - g["lat0"]) / g["d_lat"])
+        j = np.rint((np.asarray(lons, dtype=float) - g["lon0"]) / g["d_lon"])
+        return (np.clip(i, 0, g["n_lat"] - 1).astype(np.int64),
+                np.clip(j, 0, g["n_lon"] - 1).astype(np.int64))
+
+    def chunk(self, year, month):
+        """Memory-mapped (day, lat, lon) array of a month, or None if it was not packed."""
+        key = f"{year:04d}_{month:02d}"
+        if key not in self.months:
+            return None
+        if key not in self._chunks:
+            self._chunks[key] = np.load(self.dir / f"{key}.npy", mmap_mode="r")
+        return self._chunks[key]
+
+
+def _month_groups(dates):
+    dates = np.asarray(dates, dtype="datetime64[D]")
+    months = dates.astype("datetime64[M]")
+    days = (dates - months).astype(np.int64)
+    order = np.argsort(months, kind="stable")
+    bounds = np.flatnonzero(np.diff(months[order].astype(np.int64))) + 1
+    for idx in np.split(order, bounds):
+        if len(idx) == 0:
+            continue
+        m = months[idx[0]].astype(np.int64)
+        yield int(m // 12 + 1970), int(m % 12 + 1), idx, days[idx]
+
+
+def extract(cubes, dates, lats, lons):
+    """
+    Values of several variables at arrays of (date, lat, lon). `cubes` maps an output name to
+    a `Datacube` (or a packed directory). Points are grouped by month once; grid indices are
+    computed once per distinct grid. Dates without packed data come back as NaN.
+    """
+    cubes = {name: c if isinstance(c, Datacube) else Datacube(c) for name, c in cubes.items()}
+    lats = np.asarray(lats, dtype=float)
+    lons = np.asarray(lons, dtype=float)
+    out = {name: np.full(len(lats), np.nan) for name in cubes}
+
+    grid_idx = {}
+    for cube in cubes.values():
+        key = json.dumps(cube.grid, sort_keys=True)
+        if key not in grid_idx:
+            grid_idx[key] = cube.indices(lats, lons)
+
+    for year, month, idx, days in _month_groups(dates):
+        for name, cube in cubes.items():
+            chunk = cube.chunk(year, month)
+            if chunk is None:
+                continue
+            i, j = grid_idx[json.dumps(cube.grid, sort_keys=True)]
+            out[name][idx] = chunk[days, i[idx], j[idx]]
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Meteomatics monthly CSVs <-> memory-mapped datacubes")
+    sub = parser.add_subparsers(dest="command", required=True)
+    dl = sub.add_parser("download", help="fetch missing monthly CSVs into <out>/<var>/")
+    dl.add_argument("out")
+    dl.add_argument("--variable", action="append", required=True, metavar="PARAMETER=SAVE_NAME",
+                    help="e.g. t_sea_sfc:C=sst (repeatable)")
+    dl.add_argument("--start", required=True, help="first month, YYYY-MM")
+    dl.add_argument("--end", required=True, help="last month, YYYY-MM")
+    dl.add_argument("--credentials", help="JSON file with username and password")
+    dl.add_argument("--base-url", default=BASE_URL)
+    dl.add_argument("--workers", type=int, default=4)
+    dl.add_argument("--retries", type=int, default=4)
+    sv = sub.add_parser("serve", help="local stand-in for the Meteomatics API")
+    sv.add_argument("--port", type=int, default=8000)
+    sv.add_argument("--fail-rate", type=float, default=0.0, help="fraction of requests answered with 503")
+    pack = sub.add_parser("pack", help="pack <src>/<var>/<year>_<month>.csv into <dst>/<var>/")
+    pack.add_argument("src")
+    pack.add_argument("dst")
+    pack.add_argument("variables", nargs="+")
+    args = parser.parse_args()
+
+    if args.command == "download":
+        username = password = None
+        if args.credentials:
+            with open(args.credentials) as f:
+                creds = json.load(f)
+            username, password = creds["username"], creds["password"]
+        variables = [v.split("=", 1) for v in args.variable]
+        jobs = [(parameter, save_name, year, month)
+                for parameter, save_name in variables
+                for year, month in _month_range(args.start, args.end)]
+        summary = download_months(jobs, args.out, username, password, base_url=args.base_url,
+                                  workers=args.workers, retries=args.retries)
+        print(f"downloaded {summary['downloaded']}, skipped {summary['skipped']}, "
+              f"retries {summary['retried']}, failed {len(summary['failed'])}")
+    elif args.command == "serve":
+        serve(args.port, args.fail_rate)
+    elif args.command == "pack":
+        for var in args.variables:
+            n = pack_variable(Path(args.src) / var, Path(args.dst) / var)
+            print(f"{var}: packed {n} new or changed months into {Path(args.dst) / var}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,404 @@
+"""
+Local HTTP service answering suitability queries from the saved XGBoost model.
+
+The model is loaded once. Every query point is snapped to a cell of the dist2coast grid
+(the finest of the local grids) and its predictors are read at that cell's node for the
+query date: distance to shore from the `.d2c` grid, the Meteomatics variables from their
+packed cubes, cleaned with the same rules as the training points. A point whose date has
+no data in any of the cubes (a month that was never packed) is not scored: its probability
+and label come back as null. Results are kept in an LRU cache keyed by (date, cell), and
+cache misses from concurrent requests are coalesced by a micro-batching queue into a single
+`inplace_predict` call.
+
+    python -m sdm.service --model ../models/scalloped_hammerhead_xgb_model.json \
+        --dist2coast ../data/environmental/nasa/dist2coast.d2c \
+        --cubes ../data/environmental/meteomatics_cube --port 8200
+
+    POST /predict  {"points": [{"lat": 25.1, "lon": -80.2, "date": "2025-10-03"}, ...]}
+    GET  /predict?lat=25.1&lon=-80.2&date=2025-10-03
+    GET  /stats    request latency percentiles, cache and batch counters
+
+`--engine numpy` scores with `sdm.trees` instead of xgboost, for a faster cold start.
+The decision threshold is read from the model's `best_threshold` attribute (set by the
+notebook before saving) unless `--threshold` is given; a model without the attribute is
+refused rather than labelled at an arbitrary 0.5.
+"""
+import argparse
+import json
+import queue
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+from sdm.dist2coast import Dist2Coast
+from sdm.inference import _booster_and_range
+from sdm.meteomatics import GRID_FILE, Datacube, extract
+from sdm.trees import TreeEnsemble
+
+PREDICTOR_COLS = [
+    "distance_to_shore_m",
+    "sst",
+    "ocean_depth",
+    "current_speed",
+    "stokes_drift_speed",
+    "stokes_drift_dir",
+]
+# readings on land come back as large negative values (same cleaning as the notebook)
+INVALID_READINGS = {
+    "sst": lambda x: x <= -50,
+    "ocean_depth": lambda x: x < 0,
+    "current_speed": lambda x: x < 0,
+    "stokes_drift_speed": lambda x: x < 0,
+    "stokes_drift_dir": lambda x: x < 0,
+}
+MAX_POINTS = 100_000
+
+
+class FeatureSource:
+    """Predictors at (date, dist2coast cell) keys, read from the local gridded stores."""
+
+    def __init__(self, dist2coast_path, cube_root, features=PREDICTOR_COLS):
+        self.features = list(features)
+        self.dist2coast = Dist2Coast(dist2coast_path)
+        self.cubes = {}
+        for name in self.features:
+            if name == "distance_to_shore_m":
+                continue
+            cube_dir = Path(cube_root) / name
+            if (cube_dir / GRID_FILE).exists():
+                self.cubes[name] = Datacube(cube_dir)
+            else:
+                print(f"No packed cube for {name} in {cube_root}, it will be NaN")
+
+    def cells(self, lons, lats):
+        """(row, col) of the dist2coast cell of every point."""
+        return self.dist2coast.indices(lons, lats)
+
+    def __call__(self, dates, rows, cols):
+        """(n, len(features)) float32 predictors at the nodes of the given cells."""
+        d = self.dist2coast
+        lats = d.lat0 + rows * d.d_lat
+        lons = d.lon0 + cols * d.d_lon
+        values = extract(self.cubes, dates, lats, lons)
+        values["distance_to_shore_m"] = d.grid[rows, cols].astype(float)
+        X = np.full((len(rows), len(self.features)), np.nan, dtype=np.float32)
+        for k, name in enumerate(self.features):
+            if name not in values:
+                continue
+            column = values[name]
+            if name in INVALID_READINGS:
+                column[INVALID_READINGS[name](column)] = np.nan
+            X[:, k] = column
+        return X
+
+    def available(self, X):
+        """Rows of `X` with at least one cube-backed predictor (all NaN when the month was never packed)."""
+        cube_cols = [k for k, name in enumerate(self.features) if name != "distance_to_shore_m"]
+        return ~np.all(np.isnan(X[:, cube_cols]), axis=1)
+
+
+class LRUCache:
+    """Thread-safe least-recently-used mapping with hit/miss counters."""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def get_many(self, keys):
+        """Cached value or None for every key."""
+        out = []
+        with self._lock:
+            for key in keys:
+                value = self._items.get(key)
+                if value is None:
+                    self.misses += 1
+                else:
+                    self._items.move_to_end(key)
+                    self.hits += 1
+                out.append(value)
+        return out
+
+    def put_many(self, keys, values):
+        with self._lock:
+            for key, value in zip(keys, values):
+                self._items[key] = value
+                self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def __len__(self):
+        return len(self._items)
+
+
+class MicroBatcher:
+    """
+    Coalesces feature rows submitted from many threads into one `predict` call: the worker
+    takes the first waiting request, then whatever else arrives within `max_wait` seconds
+    (up to `max_batch` rows), and hands each request back its slice of the result.
+    """
+
+    def __init__(self, predict, max_batch=8192, max_wait=0.002):
+        self.predict = predict
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.batches = self.rows = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, X):
+        future = Future()
+        self._queue.put((X, future))
+        return future
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch, n = [item], len(item[0])
+            deadline = time.monotonic() + self.max_wait
+            while n < self.max_batch:
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._queue.put(None)
+                    break
+                batch.append(item)
+                n += len(item[0])
+            try:
+                probs = self.predict(np.concatenate([X for X, _ in batch]))
+            except Exception as error:
+                for _, future in batch:
+                    future.set_exception(error)
+                continue
+            self.batches += 1
+            self.rows += n
+            start = 0
+            for X, future in batch:
+                future.set_result(probs[start:start + len(X)])
+                start += len(X)
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+
+class LatencyStats:
+    """Rolling window of request latencies."""
+
+    def __init__(self, window=10_000):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+            self.count += 1
+
+    def summary(self):
+        with self._lock:
+            samples = np.array(self._samples)
+        if len(samples) == 0:
+            return {"count": self.count}
+        p50, p90, p99 = np.percentile(samples, [50, 90, 99]) * 1000
+        return {"count": self.count, "window": len(samples), "p50_ms": round(p50, 3),
+                "p90_ms": round(p90, 3), "p99_ms": round(p99, 3),
+                "max_ms": round(samples.max() * 1000, 3)}
+
+
+class SuitabilityService:
+    """Model, feature stores, cache and batcher behind the HTTP handler."""
+
+    def __init__(self, model_path, dist2coast_path, cube_root, threshold=None, cache_size=200_000,
+                 max_batch=8192, max_wait=0.002, engine="xgboost"):
+        if engine == "numpy":
+            booster = TreeEnsemble.load(model_path)
+        else:
+            import xgboost as xgb
+            booster = xgb.Booster(model_file=str(model_path))
+        booster, iteration_range = _booster_and_range(booster)
+        if threshold is None:
+            stored = booster.attr("best_threshold")
+            if stored is None:
+                raise ValueError(f"{model_path} has no best_threshold attribute; pass the threshold "
+                                 "tuned in the notebook explicitly (--threshold)")
+            threshold = float(stored)
+        self.threshold = threshold
+        self.source = FeatureSource(dist2coast_path, cube_root)
+        self.cache = LRUCache(cache_size)
+        self.batcher = MicroBatcher(
+            lambda X: booster.inplace_predict(X, iteration_range=iteration_range, missing=np.nan),
+            max_batch, max_wait,
+        )
+        self.latency = LatencyStats()
+
+    def query(self, lats, lons, dates):
+        """
+        (probabilities, labels) for arrays of points; dates as anything `datetime64[D]` accepts.
+        Points without any cube data for their date get a NaN probability (and a False label).
+        """
+        dates = np.asarray(dates, dtype="datetime64[D]")
+        rows, cols = self.source.cells(lons, lats)
+        keys = list(zip(dates.astype(np.int64).tolist(), rows.tolist(), cols.tolist()))
+        probs = np.array([np.nan if v is None else v for v in self.cache.get_many(keys)])
+
+        missing = np.flatnonzero(np.isnan(probs))
+        if len(missing):
+            # each distinct (date, cell) is predicted once, however often it was asked for
+            wanted = {}
+            for k in missing:
+                wanted.setdefault(keys[k], []).append(k)
+            unique = list(wanted)
+            u_dates = np.array([k[0] for k in unique], dtype="datetime64[D]")
+            u_rows = np.array([k[1] for k in unique], dtype=np.int64)
+            u_cols = np.array([k[2] for k in unique], dtype=np.int64)
+            X = self.source(u_dates, u_rows, u_cols)
+            scored = np.flatnonzero(self.source.available(X))
+            if len(scored):
+                fresh = self.batcher.submit(X[scored]).result()
+                keys_scored = [unique[i] for i in scored]
+                self.cache.put_many(keys_scored, fresh.tolist())
+                for key, p in zip(keys_scored, fresh):
+                    probs[wanted[key]] = p
+        return probs, probs >= self.threshold
+
+    def stats(self):
+        return {
+            "latency": self.latency.summary(),
+            "cache": {"size": len(self.cache), "hits": self.cache.hits, "misses": self.cache.misses},
+            "batches": {"calls": self.batcher.batches, "rows": self.batcher.rows},
+            "threshold": self.threshold,
+        }
+
+
+def _parse_points(payload):
+    points = payload.get("points")
+    if not isinstance(points, list) or not points:
+        raise ValueError("expected a non-empty 'points' list")
+    if len(points) > MAX_POINTS:
+        raise ValueError(f"at most {MAX_POINTS} points per request")
+    lats = np.array([float(p["lat"]) for p in points])
+    lons = np.array([float(p["lon"]) for p in points])
+    if not all(isinstance(p["date"], str) for p in points):
+        raise ValueError("date must be a 'YYYY-MM-DD' string")
+    dates = np.array([p["date"] for p in points], dtype="datetime64[D]")
+    if np.any(np.isnat(dates)):
+        raise ValueError("date must be a 'YYYY-MM-DD' string, not NaT")
+    if not (np.all(np.abs(lats) <= 90) and np.all(np.abs(lons) <= 180)):
+        raise ValueError("lat must be within [-90, 90] and lon within [-180, 180]")
+    return lats, lons, dates
+
+
+class _Handler(BaseHTTPRequestHandler):
+    service = None
+
+    def _send_json(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _predict(self, payload):
+        t0 = time.monotonic()
+        try:
+            lats, lons, dates = _parse_points(payload)
+        except (KeyError, TypeError, ValueError) as error:
+            self._send_json(400, {"error": str(error)})
+            return
+        try:
+            probs, labels = self.service.query(lats, lons, dates)
+        except Exception as error:
+            self._send_json(500, {"error": f"{type(error).__name__}: {error}"})
+            return
+        results = [
+            {"lat": lat, "lon": lon, "date": str(date),
+             "probability": None if np.isnan(p) else round(float(p), 6),
+             "label": None if np.isnan(p) else int(label)}
+            for lat, lon, date, p, label in zip(lats.tolist(), lons.tolist(), dates, probs, labels)
+        ]
+        self._send_json(200, {"results": results})
+        self.service.latency.record(time.monotonic() - t0)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/stats":
+            self._send_json(200, self.service.stats())
+        elif url.path == "/health":
+            self._send_json(200, {"ok": True})
+        elif url.path == "/predict":
+            query = {k: v[0] for k, v in parse_qs(url.query).items()}
+            self._predict({"points": [query]})
+        else:
+            self._send_json(404, {"error": "unknown path"})
+
+    def do_POST(self):
+        if urlparse(self.path).path != "/predict":
+            self._send_json(404, {"error": "unknown path"})
+            return
+        try:
+            payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        except (ValueError, json.JSONDecodeError):
+            self._send_json(400, {"error": "body must be JSON"})
+            return
+        self._predict(payload if isinstance(payload, dict) else {})
+
+    def log_message(self, *args):
+        pass
+
+
+def serve(service, port=8200, host="127.0.0.1"):
+    """Serve `service` on http://<host>:<port> until interrupted."""
+    handler = type("Handler", (_Handler,), {"service": service})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    print(f"Suitability service on http://{host}:{port} (threshold {service.threshold:.4f})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.batcher.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local HTTP suitability queries from the saved model")
+    parser.add_argument("--model", default="../models/scalloped_hammerhead_xgb_model.json")
+    parser.add_argument("--dist2coast", default="../data/environmental/nasa/dist2coast.d2c")
+    parser.add_argument("--cubes", default="../data/environmental/meteomatics_cube",
+                        help="directory with one packed cube per predictor")
+    parser.add_argument("--threshold", type=float, default=None,
+                        help="label threshold (default: the model's best_threshold attribute, required without it)")
+    parser.add_argument("--engine", choices=["xgboost", "numpy"], default="xgboost",
+                        help="numpy: score with sdm.trees, without importing xgboost")
+    parser.add_argument("--port", type=int, default=8200)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--cache-size", type=int, default=200_000, help="(date, cell) entries kept")
+    parser.add_argument("--max-batch", type=int, default=8192, help="rows per coalesced predict call")
+    parser.add_argument("--max-wait-ms", type=float, default=2.0,
+                        help="how long a batch waits for more requests to join")
+    args = parser.parse_args()
+    try:
+        service = SuitabilityService(args.model, args.dist2coast, args.cubes, args.threshold,
+                                     args.cache_size, args.max_batch, args.max_wait_ms / 1000, args.engine)
+    except ValueError as error:
+        parser.error(str(error))
+    serve(service, args.port, args.host)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Spatial thinning and spatial fold assignment for occurrence points.
+
+Distances are measured on the sphere by default ("geodesic": points become 3D unit-sphere
+vectors scaled to the Earth's mean radius, and a great-circle radius maps to an exact chord
+length), or on an equal-area projection. "mercator" reproduces the old EPSG:3857 metres,
+which stretch distances by 1/cos(lat) (about 30-40% at the latitudes of the accessible area).
+
+Thinning is the same greedy rule as before: walk the points in input order and keep a point
+unless an earlier kept point lies within the distance. It is resolved by halving the index
+range: the kept points of the first half remove everything they cover in the second half in
+one bulk KD-tree query, so only small leaves are walked in Python and the output is fully
+determined by the input order. Points with no neighbour within the distance are always
+kept and are set aside up front with a single k=2 query.
+"""
+import numpy as np
+from pyproj import Transformer
+from scipy.spatial import cKDTree
+
+EARTH_RADIUS_M = 6_371_008.8
+METRICS = ("geodesic", "equal_area", "mercator")
+LEAF_SIZE = 64
+
+_PROJECTIONS = {
+    "equal_area": Transformer.from_crs("EPSG:4326", "EPSG:6933", always_xy=True),  # EASE-Grid 2.0
+    "mercator": Transformer.from_crs("EPSG:4326", "EPSG:3857", always_xy=True),
+}
+
+
+def to_metric_space(lons, lats, distance_m, metric="geodesic"):
+    """Coordinates and radius in which Euclidean distance <= radius means `metric` distance <= distance_m."""
+    if metric not in METRICS:
+        raise ValueError(f"metric must be one of {METRICS}, got {metric!r}")
+    lons = np.asarray(lons, dtype=float)
+    lats = np.asarray(lats, dtype=float)
+    if metric == "geodesic":
+        lon, lat = np.radians(lons), np.radians(lats)
+        coords = EARTH_RADIUS_M * np.column_stack(
+            [np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)]
+        )
+        angle = min(distance_m / EARTH_RADIUS_M, np.pi)
+        return coords, 2 * EARTH_RADIUS_M * np.sin(angle / 2)
+    return np.column_stack(_PROJECTIONS[metric].transform(lons, lats)), float(distance_m)
+
+
+def _greedy(coords, idx, radius):
+    """Kept indices (in order) among `idx`: no two kept points within `radius`."""
+    if len(idx) == 0:
+        return idx
+    if len(idx) <= LEAF_SIZE:
+        pts = coords[idx]
+        close = ((pts[:, None, :] - pts[None, :, :]) ** 2).sum(-1) <= radius * radius
+        keep = np.ones(len(idx), dtype=bool)
+        for i in range(len(idx)):
+            if keep[i]:
+                keep[i + 1:] &= ~close[i, i + 1:]
+        return idx[keep]
+
+    mid = len(idx) // 2
+    first = _greedy(coords, idx[:mid], radius)
+    rest = idx[mid:]
+    if len(first):
+        dist, _ = cKDTree(coords[first]).query(coords[rest], k=1, distance_upper_bound=radius * (1 + 1e-12))
+        rest = rest[~(dist <= radius)]
+    if len(rest) == 0:
+        return first
+    return np.concatenate([first, _greedy(coords, rest, radius)])
+
+
+def _greedy_all(coords, radius):
+    """`_greedy` over every point, after setting aside the ones with no neighbour at all."""
+    if len(coords) < 2:
+        return np.arange(len(coords))
+    dist, _ = cKDTree(coords).query(coords, k=2, distance_upper_bound=radius * (1 + 1e-12))
+    isolated = ~(dist[:, 1] <= radius)
+    crowded = _greedy(coords, np.flatnonzero(~isolated), radius)
+    return np.sort(np.concatenate([np.flatnonzero(isolated), crowded]))
+
+
+def thin(lons, lats, min_distance_m, metric="geodesic"):
+    """
+    Boolean mask of the points kept by greedy spatial thinning: every kept point is at least
+    `min_distance_m` from the other kept points, and each dropped one is within
+    `min_distance_m` of an earlier kept point.
+    """
+    coords, radius = to_metric_space(lons, lats, min_distance_m, metric)
+    keep = np.zeros(len(coords), dtype=bool)
+    keep[_greedy_all(coords, radius)] = True
+    return keep
+
+
+def spatial_blocks(lons, lats, block_distance_m, metric="geodesic"):
+    """
+    Block id of every point. Block centres are the points kept by `thin` at
+    `block_distance_m` (numbered in input order) and every point joins its nearest centre,
+    so each point is within `block_distance_m` of its block centre.
+    """
+    coords, radius = to_metric_space(lons, lats, block_distance_m, metric)
+    if len(coords) == 0:
+        return np.zeros(0, dtype=int)
+    centres = _greedy_all(coords, radius)
+    _, block = cKDTree(coords[centres]).query(coords, k=1)
+    return block
+
+
+def spatial_folds(lons, lats, num_folds, min_distance_m, metric="geodesic"):
+    """
+    Fold id (0..num_folds-1) of every point. Points are grouped into blocks of radius
+    `min_distance_m` (see `spatial_blocks`) and whole blocks are dealt to the folds in
+    turn, so each fold is spread across the map and nearby points share a fold.
+    """
+    return spatial_blocks(lons, lats, min_distance_m, metric) % num_folds
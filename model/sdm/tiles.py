@@ -0,0 +1,292 @@
+"""
+XYZ (Web Mercator) tile pyramid of colour-mapped suitability maps, for interactive maps.
+
+A map is a (lat, lon) float array with its axes: a single `predictions_<date>.npy` or every
+date of a `SuitabilityStore`. Each 256 x 256 tile is sampled from the nearest grid node of
+every pixel centre (the axes are looked up once per tile row and column), coloured through
+a matplotlib colormap with NaN transparent, and written as PNG or WebP:
+
+    <root>/index.json                  style, zoom range and, per date, a hash per tile
+    <root>/<date>/<z>/<x>/<y>.png
+
+Tiles whose pixels are all NaN (land, outside the accessible area) are not written. Every
+tile's sampled values are hashed together with the style, so re-running only encodes the
+tiles whose input changed; a date whose whole map is unchanged is skipped outright.
+
+    pyramid = TilePyramid("../outputs/tiles", cmap="cividis")
+    pyramid.add("2025-10-03", predictions, lats, lons)
+    tile_store("../data/predictions/suitability_daily", "../outputs/tiles/daily")
+
+    python -m sdm.tiles store ../data/predictions/suitability_daily ../outputs/tiles/daily
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from pathlib import Path
+
+import matplotlib
+import numpy as np
+from PIL import Image
+
+from sdm.forecast import SuitabilityStore
+
+INDEX_FILE = "index.json"
+TILE_SIZE = 256
+MAX_LAT = 85.0511287798
+FORMATS = ("png", "webp")
+CMAP = "cividis"
+
+
+def max_zoom_for(lat_axis, lon_axis, tile_size=TILE_SIZE):
+    """Smallest zoom at which a pixel is no larger than a grid cell at the equator."""
+    step = min(np.abs(np.diff(lon_axis)).min(initial=360.0), np.abs(np.diff(lat_axis)).min(initial=180.0))
+    return max(0, int(np.ceil(np.log2(360.0 / (tile_size * step)))))
+
+
+def _pixel_lons(x, z, size):
+    return (x * size + np.arange(size) + 0.5) / (size * 2 ** z) * 360.0 - 180.0
+
+
+def _pixel_lats(y, z, size):
+    t = (y * size + np.arange(size) + 0.5) / (size * 2 ** z)
+    return np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * t))))
+
+
+def _tile_range(west, south, east, north, z):
+    """Inclusive (x0, x1, y0, y1) of the tiles covering a lon/lat box at zoom z."""
+    n = 2 ** z
+    tx = lambda lon: min(n - 1, max(0, int((lon + 180.0) / 360.0 * n)))
+    ty = lambda lat: min(n - 1, max(0, int((1 - np.arcsinh(np.tan(np.radians(
+        np.clip(lat, -MAX_LAT, MAX_LAT)))) / np.pi) / 2 * n)))
+    return tx(west), tx(east), ty(north), ty(south)
+
+
+class Axis:
+    """Nearest-node lookup on a 1D grid axis (ascending or descending)."""
+
+    def __init__(self, values):
+        values = np.asarray(values, dtype=float)
+        self.order = np.argsort(values)
+        self.sorted = values[self.order]
+        half = np.diff(self.sorted).min(initial=0.0) / 2
+        self.lo, self.hi = self.sorted[0] - half, self.sorted[-1] + half
+
+    def nearest(self, coords):
+        """(index into the original axis, inside the grid) for every coordinate."""
+        k = np.clip(np.searchsorted(self.sorted, coords), 1, max(1, len(self.sorted) - 1))
+        if len(self.sorted) > 1:
+            k -= (coords - self.sorted[k - 1]) < (self.sorted[k] - coords)
+        else:
+            k[:] = 0
+        return self.order[k], (coords >= self.lo) & (coords <= self.hi)
+
+
+class TilePyramid:
+    """
+    A directory of tile pyramids, one per date label, sharing a style (colormap, value range,
+    format) and an index of per-tile hashes used to rebuild incrementally.
+    """
+
+    def __init__(self, root, cmap=CMAP, vmin=0.0, vmax=1.0, fmt="png", minzoom=0, maxzoom=None,
+                 tile_size=TILE_SIZE):
+        if fmt not in FORMATS:
+            raise ValueError(f"fmt must be one of {FORMATS}, got {fmt!r}")
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.style = {"cmap": cmap, "vmin": float(vmin), "vmax": float(vmax), "format": fmt,
+                      "tile_size": tile_size}
+        self.minzoom, self.maxzoom = minzoom, maxzoom
+        colours = matplotlib.colormaps[cmap](np.linspace(0, 1, 256))
+        self.lut = np.zeros((257, 4), dtype=np.uint8)  # the last entry (transparent) is NaN
+        self.lut[:256] = np.round(colours * 255)
+        self._lock = threading.Lock()
+        index_path = self.root / INDEX_FILE
+        self.index = json.loads(index_path.read_text()) if index_path.exists() else {}
+        if self.index.get("style") != self.style:
+            self.index["style"] = self.style  # stale tile hashes no longer match and get redrawn
+        self.index.setdefault("dates", {})
+        self.index["path"] = "{date}/{z}/{x}/{y}." + fmt
+
+    def _write_index(self):
+        with self._lock:
+            tmp = self.root / f"{INDEX_FILE}.tmp"
+            tmp.write_text(json.dumps(self.index, indent=1))
+            os.replace(tmp, self.root / INDEX_FILE)
+
+    @property
+    def dates(self):
+        return sorted(self.index["dates"])
+
+    def _style_key(self):
+        return json.dumps(self.style, sort_keys=True).encode()
+
+    def _sample(self, values, lat, lon, z, x, y):
+        size = self.style["tile_size"]
+        rows, row_in = lat.nearest(_pixel_lats(y, z, size))
+        cols, col_in = lon.nearest(_pixel_lons(x, z, size))
+        tile = np.full((size, size), np.nan, dtype=np.float32)
+        if row_in.any() and col_in.any():
+            tile[np.ix_(row_in, col_in)] = values[np.ix_(rows[row_in], cols[col_in])]
+        return tile
+
+    def _encode(self, tile):
+        lo, hi = self.style["vmin"], self.style["vmax"]
+        scaled = np.clip((tile - lo) / (hi - lo), 0, 1) * 255
+        codes = np.where(np.isnan(tile), 256, np.nan_to_num(scaled)).astype(np.uint16)
+        buf = BytesIO()
+        image = Image.fromarray(self.lut[codes], "RGBA")
+        if self.style["format"] == "png":
+            image.save(buf, "PNG", optimize=False, compress_level=6)
+        else:
+            image.save(buf, "WEBP", lossless=True, method=4)
+        return buf.getvalue()
+
+    def add(self, label, values, lat_axis, lon_axis, workers=None):
+        """
+        Write (or refresh) the pyramid of one map under `label`. Returns the number of tiles
+        (written, unchanged, removed), or None if the map is unchanged since the last run.
+        """
+        values = np.asarray(values, dtype=np.float32)
+        if values.shape != (len(lat_axis), len(lon_axis)):
+            raise ValueError(f"map {values.shape} does not match the axes ({len(lat_axis)}, {len(lon_axis)})")
+        label = str(label)
+        digest = hashlib.blake2b(self._style_key(), digest_size=16)
+        for axis in (lat_axis, lon_axis, values):
+            digest.update(np.ascontiguousarray(axis, dtype=np.float32).tobytes())
+        map_hash = digest.hexdigest()
+        old = self.index["dates"].get(label, {})
+        ext = self.style["format"]
+        base = self.root / label
+        maxzoom = self.maxzoom if self.maxzoom is not None else max_zoom_for(lat_axis, lon_axis,
+                                                                             self.style["tile_size"])
+        if (old.get("hash") == map_hash and (old["minzoom"], old["maxzoom"]) == (self.minzoom, maxzoom)
+                and all((base / f"{key}.{ext}").exists() for key in old["tiles"])):
+            return None
+
+        lat, lon = Axis(lat_axis), Axis(lon_axis)
+        valid = ~np.isnan(values)
+        if not valid.any():
+            jobs = []
+        else:
+            rows, cols = np.flatnonzero(valid.any(axis=1)), np.flatnonzero(valid.any(axis=0))
+            half_lat, half_lon = (lat.hi - lat.sorted[-1]), (lon.hi - lon.sorted[-1])
+            lats = np.asarray(lat_axis, dtype=float)[rows]
+            lons = np.asarray(lon_axis, dtype=float)[cols]
+            box = (lons.min() - half_lon, lats.min() - half_lat, lons.max() + half_lon, lats.max() + half_lat)
+            jobs = [(z, x, y) for z in range(self.minzoom, maxzoom + 1)
+                    for x0, x1, y0, y1 in [_tile_range(*box, z)]
+                    for x in range(x0, x1 + 1) for y in range(y0, y1 + 1)]
+
+        old_tiles = old.get("tiles", {})
+        style_key = self._style_key()
+
+        def run(job):
+            z, x, y = job
+            key = f"{z}/{x}/{y}"
+            tile = self._sample(values, lat, lon, z, x, y)
+            if np.isnan(tile).all():
+                return key, None, False
+            tile_hash = hashlib.blake2b(style_key + tile.tobytes(), digest_size=16).hexdigest()
+            path = base / f"{key}.{ext}"
+            if old_tiles.get(key) == tile_hash and old.get("format") == ext and path.exists():
+                return key, tile_hash, False
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_name(path.name + ".tmp")
+            tmp.write_bytes(self._encode(tile))
+            os.replace(tmp, path)
+            return key, tile_hash, True
+
+        with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+            results = list(pool.map(run, jobs))
+
+        tiles = {key: h for key, h, _ in results if h is not None}
+        written = sum(w for _, _, w in results)
+        # tiles that are now empty, and every old tile if the format changed
+        old_ext = old.get("format", ext)
+        removed = 0
+        for key in old_tiles:
+            path = base / f"{key}.{old_ext}"
+            if (key not in tiles or old_ext != ext) and path.exists():
+                path.unlink()
+                removed += 1
+        with self._lock:
+            self.index["dates"][label] = {"hash": map_hash, "format": ext, "minzoom": self.minzoom,
+                                          "maxzoom": maxzoom, "tiles": tiles}
+        self._write_index()
+        return written, len(tiles) - written, removed
+
+
+def tile_store(store, root, dates=None, workers=None, **style):
+    """Tile every date of a `SuitabilityStore` (or its directory), skipping unchanged ones."""
+    if not isinstance(store, SuitabilityStore):
+        store = SuitabilityStore(store)
+    pyramid = TilePyramid(root, **style)
+    dates = store.dates if dates is None else np.asarray(dates, dtype="datetime64[D]")
+    t0 = time.monotonic()
+    for date in dates:
+        result = pyramid.add(str(date), store[date], store.lat_axis, store.lon_axis, workers)
+        if result is None:
+            print(f"  {date}: unchanged")
+        else:
+            print(f"  {date}: {result[0]} tiles written, {result[1]} unchanged, {result[2]} removed")
+    print(f"Tiled {len(dates)} dates into {pyramid.root} in {time.monotonic() - t0:.1f}s")
+    return pyramid
+
+
+def _label_from_path(path):
+    """"predictions_2025_10_03.npy" -> "2025-10-03" (otherwise the file stem)."""
+    match = re.search(r"(\d{4})[_-](\d{2})[_-](\d{2})", Path(path).stem)
+    return "-".join(match.groups()) if match else Path(path).stem
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build XYZ tile pyramids of suitability maps")
+    sub = parser.add_subparsers(dest="command", required=True)
+    npy = sub.add_parser("npy", help="tile a single (lat, lon) predictions .npy")
+    npy.add_argument("predictions")
+    npy.add_argument("out")
+    npy.add_argument("--lat", required=True, help=".npy latitude axis")
+    npy.add_argument("--lon", required=True, help=".npy longitude axis")
+    npy.add_argument("--label", help="date label (default: taken from the file name)")
+    store = sub.add_parser("store", help="tile every date of a SuitabilityStore")
+    store.add_argument("store")
+    store.add_argument("out")
+    store.add_argument("--start")
+    store.add_argument("--end")
+    for p in (npy, store):
+        p.add_argument("--cmap", default=CMAP)
+        p.add_argument("--vmin", type=float, default=0.0)
+        p.add_argument("--vmax", type=float, default=1.0)
+        p.add_argument("--format", choices=FORMATS, default="png")
+        p.add_argument("--minzoom", type=int, default=0)
+        p.add_argument("--maxzoom", type=int, help="default: the grid resolution")
+        p.add_argument("--workers", type=int)
+    args = parser.parse_args()
+    style = dict(cmap=args.cmap, vmin=args.vmin, vmax=args.vmax, fmt=args.format,
+                 minzoom=args.minzoom, maxzoom=args.maxzoom)
+
+    if args.command == "npy":
+        label = args.label or _label_from_path(args.predictions)
+        pyramid = TilePyramid(args.out, **style)
+        result = pyramid.add(label, np.load(args.predictions, mmap_mode="r"), np.load(args.lat),
+                             np.load(args.lon), args.workers)
+        print(f"{label}: unchanged" if result is None else
+              f"{label}: {result[0]} tiles written, {result[1]} unchanged, {result[2]} removed")
+    else:
+        s = SuitabilityStore(args.store)
+        dates = s.dates
+        if args.start:
+            dates = dates[dates >= np.datetime64(args.start, "D")]
+        if args.end:
+            dates = dates[dates <= np.datetime64(args.end, "D")]
+        tile_store(s, args.out, dates, args.workers, **style)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,304 @@
+"""
+Spatial cross-validation and hyperparameter search for the XGBoost presence/absence model.
+
+A fold is the notebook's recipe: hold out one spatial fold as the test set, split the rest
+80/20 (stratified, seed 0) into train and validation, weight positives by the class ratio,
+train with early stopping on validation AUC-PR, pick the threshold that maximises the
+class-balanced F1 on validation and score the held-out fold with it.
+
+Folds run in a process pool. Each worker gets the data once and builds the quantized
+training matrix of a fold (`QuantileDMatrix`, hist trees) the first time it needs it, keeping
+it for every later configuration evaluated on that fold with the same `max_bin`. The
+validation and test sets are scored with in-place prediction. Cores are split between
+processes and xgboost threads (`nthread = cores // workers`, recomputed at every rung of the
+search as fewer fits remain).
+
+`successive_halving` searches the parameters. Random configurations from `SPACE` (plus the
+notebook's defaults) are cross-validated with a small boosting budget. Only the best
+1/`eta` go on to the next rung, with `eta` times the budget, until the full budget is reached.
+Early stopping still applies within each run, so weak configurations also stop early.
+Every evaluation reports the per-fold F1, threshold and best iteration, plus its time.
+
+    cv = cross_validate(X, y, fold_ids)
+    search = successive_halving(X, y, fold_ids, n_configs=27)
+    print_results(search)
+    final_params = search[0]["params"]
+
+    python -m sdm.training search ../data/modelling/folds.npz --configs 27 --workers 5
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import xgboost as xgb
+from sklearn.metrics import f1_score, precision_recall_curve, precision_score, recall_score
+from sklearn.model_selection import train_test_split
+
+DEFAULT_PARAMS = {
+    "objective": "binary:logistic",
+    "eval_metric": "aucpr",
+    "tree_method": "hist",
+    "max_depth": 5,
+    "learning_rate": 0.03,
+    "subsample": 0.8,
+    "colsample_bytree": 0.8,
+    "reg_lambda": 1.0,
+    "reg_alpha": 0.0,
+    "min_child_weight": 1,
+    "max_bin": 256,
+}
+NUM_BOOST_ROUND = 2000
+EARLY_STOPPING_ROUNDS = 50
+SPACE = {
+    "max_depth": [3, 4, 5, 6, 8],
+    "learning_rate": [0.01, 0.03, 0.05, 0.1],
+    "subsample": [0.6, 0.8, 1.0],
+    "colsample_bytree": [0.6, 0.8, 1.0],
+    "min_child_weight": [1, 3, 5, 10],
+    "reg_lambda": [0.5, 1.0, 2.0, 5.0],
+    "reg_alpha": [0.0, 0.1, 1.0],
+    "max_bin": [64, 128, 256],
+}
+
+
+# --------- one fold (the notebook's functions, on arrays) ----------
+def split_fold(X, y, fold_ids, test_fold, val_size=0.2, seed=0):
+    """(X_train, X_val, X_test, y_train, y_val, y_test) with `test_fold` held out."""
+    test = fold_ids == test_fold
+    X_train, X_val, y_train, y_val = train_test_split(
+        X[~test], y[~test], test_size=val_size, random_state=seed, stratify=y[~test])
+    return X_train, X_val, X[test], y_train, y_val, y[test]
+
+
+def class_weight(y_train):
+    return (y_train == 0).sum() / max((y_train == 1).sum(), 1)
+
+
+def _balanced_weights(y):
+    return np.where(y == 1, 0.5 / max((y == 1).sum(), 1), 0.5 / max((y == 0).sum(), 1))
+
+
+def best_threshold(y_val, probs):
+    """Threshold with the highest class-balanced F1 on the validation set."""
+    precision, recall, thresholds = precision_recall_curve(y_val, probs, sample_weight=_balanced_weights(y_val))
+    f1 = 2 * (precision * recall) / (precision + recall + 1e-12)
+    best = np.nanargmax(f1)
+    return float(thresholds[best - 1]) if best > 0 else 0.5
+
+
+def evaluate(y_test, probs, threshold):
+    """(precision, recall, F1) at `threshold`, precision and F1 class-balanced as in the notebook."""
+    y_pred = (probs >= threshold).astype(int)
+    weights = _balanced_weights(y_test)
+    return (float(precision_score(y_test, y_pred, sample_weight=weights, zero_division=0)),
+            float(recall_score(y_test, y_pred, zero_division=0)),
+            float(f1_score(y_test, y_pred, sample_weight=weights, zero_division=0)))
+
+
+# --------- worker processes ----------
+_DATA = None      # (X, y, fold_ids), sent once per worker
+_FOLDS = {}       # (fold, max_bin) -> (dtrain, dval, X_val, y_val, X_test, y_test, pos_weight)
+
+
+def _init_worker(X, y, fold_ids):
+    global _DATA
+    _DATA = (X, y, fold_ids)
+    _FOLDS.clear()
+
+
+def _fold_data(fold, max_bin):
+    key = (fold, max_bin)
+    if key not in _FOLDS:
+        X, y, fold_ids = _DATA
+        X_train, X_val, X_test, y_train, y_val, y_test = split_fold(X, y, fold_ids, fold)
+        dtrain = xgb.QuantileDMatrix(X_train, y_train, max_bin=max_bin)
+        dval = xgb.QuantileDMatrix(X_val, y_val, ref=dtrain, max_bin=max_bin)
+        _FOLDS[key] = (dtrain, dval, X_val, y_val, X_test, y_test, class_weight(y_train))
+    return _FOLDS[key]
+
+
+def _run_fold(params, fold, num_boost_round, nthread):
+    t0 = time.perf_counter()
+    params = {**DEFAULT_PARAMS, **params}
+    dtrain, dval, X_val, y_val, X_test, y_test, pos_weight = _fold_data(fold, params["max_bin"])
+    prepared = time.perf_counter() - t0
+    booster = xgb.train({**params, "scale_pos_weight": pos_weight, "nthread": nthread, "verbosity": 0},
+                        dtrain, num_boost_round=num_boost_round, evals=[(dval, "val")],
+                        early_stopping_rounds=EARLY_STOPPING_ROUNDS, verbose_eval=False)
+    best = getattr(booster, "best_iteration", num_boost_round - 1)
+    iteration_range = (0, best + 1)
+    threshold = best_threshold(y_val, booster.inplace_predict(X_val, iteration_range=iteration_range))
+    precision, recall, f1 = evaluate(y_test, booster.inplace_predict(X_test, iteration_range=iteration_range),
+                                     threshold)
+    return {"fold": int(fold), "f1": f1, "precision": precision, "recall": recall, "threshold": threshold,
+            "best_iteration": int(best), "seconds": round(time.perf_counter() - t0, 3),
+            "prepare_seconds": round(prepared, 3)}
+
+
+def _pool(X, y, fold_ids, workers):
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                               initializer=_init_worker, initargs=(X, y, fold_ids))
+
+
+def _split_cores(n_tasks, workers=None, cores=None):
+    """(processes, xgboost threads per process) for `n_tasks` concurrent fold fits."""
+    cores = cores or os.cpu_count() or 1
+    workers = max(1, min(workers or cores, n_tasks, cores))
+    return workers, max(1, cores // workers)
+
+
+def _evaluate_all(pool, configs, folds, num_boost_round, nthread, log=None):
+    """Cross-validate every (config index, params) on `folds`; returns one result dict per config."""
+    t0 = time.perf_counter()
+    futures = {pool.submit(_run_fold, params, fold, num_boost_round, nthread): (i, fold)
+               for i, params in configs for fold in folds}
+    per_config = {i: [] for i, _ in configs}
+    done_at = {}
+    for future in as_completed(futures):
+        i, _ = futures[future]
+        per_config[i].append(future.result())
+        if len(per_config[i]) == len(folds):
+            done_at[i] = time.perf_counter() - t0
+            if log is not None:
+                log(i, per_config[i])
+    results = []
+    for i, params in configs:
+        folds_out = sorted(per_config[i], key=lambda r: r["fold"])
+        f1 = np.array([r["f1"] for r in folds_out])
+        results.append({
+            "config": i, "params": params, "num_boost_round": num_boost_round, "folds": folds_out,
+            "mean_f1": float(f1.mean()), "std_f1": float(f1.std()),
+            "thresholds": [r["threshold"] for r in folds_out],
+            "fit_seconds": round(sum(r["seconds"] for r in folds_out), 3),
+            "wall_seconds": round(done_at[i], 3),
+        })
+    return results
+
+
+# --------- public API ----------
+def cross_validate(X, y, fold_ids, params=None, num_boost_round=NUM_BOOST_ROUND, workers=None, cores=None):
+    """Cross-validate one parameter set (defaults: the notebook's model) with the folds in parallel."""
+    X, y, fold_ids = np.asarray(X, dtype=np.float32), np.asarray(y), np.asarray(fold_ids)
+    folds = sorted(int(f) for f in np.unique(fold_ids))
+    workers, nthread = _split_cores(len(folds), workers, cores)
+    with _pool(X, y, fold_ids, workers) as pool:
+        return _evaluate_all(pool, [(0, dict(params or {}))], folds, num_boost_round, nthread)[0]
+
+
+def sample_configs(n, space=SPACE, seed=0, include_default=True):
+    """`n` distinct random parameter sets from `space` (the notebook's defaults first)."""
+    rng = np.random.default_rng(seed)
+    configs, seen = [], set()
+    if include_default:
+        default = {k: DEFAULT_PARAMS[k] for k in space if k in DEFAULT_PARAMS}
+        configs.append(default)
+        seen.add(json.dumps(default, sort_keys=True))
+    for _ in range(n * 50):
+        if len(configs) >= n:
+            break
+        params = {k: values[rng.integers(len(values))] for k, values in space.items()}
+        params = {k: v.item() if hasattr(v, "item") else v for k, v in params.items()}
+        key = json.dumps(params, sort_keys=True)
+        if key not in seen:
+            seen.add(key)
+            configs.append(params)
+    return configs
+
+
+def successive_halving(X, y, fold_ids, configs=None, n_configs=27, eta=3, min_rounds=200,
+                       max_rounds=NUM_BOOST_ROUND, workers=None, cores=None, seed=0, verbose=True):
+    """
+    Successive-halving search over `configs` (or `n_configs` sampled from SPACE). Rung r trains
+    with min(min_rounds * eta**r, max_rounds) boosting rounds and keeps the best 1/eta by mean
+    F1. Returns the evaluations of every rung, best first (last rung, then by mean F1).
+    """
+    X, y, fold_ids = np.asarray(X, dtype=np.float32), np.asarray(y), np.asarray(fold_ids)
+    folds = sorted(int(f) for f in np.unique(fold_ids))
+    configs = list(enumerate(configs if configs is not None else sample_configs(n_configs, seed=seed)))
+    cores = cores or os.cpu_count() or 1
+    workers, _ = _split_cores(len(configs) * len(folds), workers, cores)
+    if verbose:
+        print(f"Searching {len(configs)} configurations on {len(folds)} folds with {workers} processes")
+
+    def log(i, fold_results):
+        if verbose:
+            f1 = [r["f1"] for r in fold_results]
+            print(f"  config {i}: F1 {np.mean(f1):.3f} ± {np.std(f1):.3f} "
+                  f"({sum(r['seconds'] for r in fold_results):.1f}s)")
+
+    history = []
+    rung, rounds = 0, min(min_rounds, max_rounds)
+    t0 = time.perf_counter()
+    with _pool(X, y, fold_ids, workers) as pool:
+        while True:
+            # later rungs have fewer fits than processes: give the idle cores to their threads
+            nthread = max(1, cores // min(workers, len(configs) * len(folds)))
+            if verbose:
+                print(f"Rung {rung}: {len(configs)} configurations, {rounds} rounds, {nthread} threads per fit")
+            results = _evaluate_all(pool, configs, folds, rounds, nthread, log)
+            for r in results:
+                r["rung"] = rung
+            history.extend(results)
+            if rounds >= max_rounds or len(configs) == 1:
+                break
+            keep = {r["config"] for r in sorted(results, key=lambda r: -r["mean_f1"])[:max(1, len(configs) // eta)]}
+            configs = [(i, p) for i, p in configs if i in keep]
+            rung, rounds = rung + 1, min(rounds * eta, max_rounds)
+    if verbose:
+        print(f"Search finished in {time.perf_counter() - t0:.1f}s")
+    return sorted(history, key=lambda r: (-r["rung"], -r["mean_f1"]))
+
+
+def print_results(results, top=10):
+    """Table of evaluations: mean/std F1, per-fold F1 and thresholds, rounds used and time."""
+    for r in results[:top]:
+        folds = " ".join(f"{f['f1']:.3f}" for f in r["folds"])
+        thresholds = " ".join(f"{t:.3g}" for t in r["thresholds"])
+        trees = " ".join(str(f["best_iteration"] + 1) for f in r["folds"])
+        print(f"config {r['config']:>3} rung {r.get('rung', 0)} ({r['num_boost_round']} rounds): "
+              f"F1 {r['mean_f1']:.3f} ± {r['std_f1']:.3f}  {r['fit_seconds']:.1f}s fit, "
+              f"{r['wall_seconds']:.1f}s wall")
+        print(f"    folds F1 [{folds}]  thresholds [{thresholds}]  trees [{trees}]")
+        print(f"    {json.dumps(r['params'], sort_keys=True)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Spatial cross-validation and hyperparameter search")
+    sub = parser.add_subparsers(dest="command", required=True)
+    for name, help_text in (("cv", "cross-validate the default (or given) parameters"),
+                            ("search", "successive-halving search over SPACE")):
+        p = sub.add_parser(name, help=help_text)
+        p.add_argument("data", help=".npz with X, y and fold_ids arrays")
+        p.add_argument("--workers", type=int, default=None, help="processes (default: one per task, up to the cores)")
+        p.add_argument("--out", help="write the results to this JSON file")
+    cv = sub.choices["cv"]
+    cv.add_argument("--params", default="{}", help="JSON overrides of DEFAULT_PARAMS")
+    cv.add_argument("--rounds", type=int, default=NUM_BOOST_ROUND)
+    search = sub.choices["search"]
+    search.add_argument("--configs", type=int, default=27)
+    search.add_argument("--eta", type=int, default=3)
+    search.add_argument("--min-rounds", type=int, default=200)
+    search.add_argument("--max-rounds", type=int, default=NUM_BOOST_ROUND)
+    search.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    data = np.load(args.data)
+    X, y, fold_ids = data["X"], data["y"], data["fold_ids"]
+    if args.command == "cv":
+        results = [cross_validate(X, y, fold_ids, json.loads(args.params), args.rounds, args.workers)]
+    else:
+        results = successive_halving(X, y, fold_ids, n_configs=args.configs, eta=args.eta,
+                                     min_rounds=args.min_rounds, max_rounds=args.max_rounds,
+                                     workers=args.workers, seed=args.seed)
+    print_results(results)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+"""
+NumPy evaluator for the exported XGBoost model JSON, without importing xgboost.
+
+`TreeEnsemble.load` parses `scalloped_hammerhead_xgb_model.json` into flat arrays, with every
+tree padded to a complete binary tree of the ensemble's depth: per internal slot a column
+and a float32 threshold, per bottom slot a leaf value. A shallower leaf fills its slots
+below with splits that always go left. Node `p` has children `2p + 1` and `2p + 2`, so
+scoring is `depth` vectorized steps over all (row, tree) pairs at once with no child lookups.
+
+Missing values follow each split's default direction as in xgboost. The rows are widened
+once to `[X with NaN -> +inf, X with NaN -> -inf, 0]` and a split reads the first copy
+when it defaults right and the second when it defaults left, so NaN needs no special case
+while walking. Leaf values are added to the base margin and passed through the objective's
+link, matching `predict_proba` within float32 rounding.
+
+By default only the trees up to `best_iteration` are used, as `predict_proba` does for a
+model trained with early stopping.
+
+    python -m sdm.trees ../models/scalloped_hammerhead_xgb_model.json features.npy probs.npy
+"""
+import argparse
+import json
+
+import numpy as np
+
+ROWS_PER_BLOCK = 256  # (rows, trees) work arrays stay cache-sized
+MAX_DEPTH = 16
+LOGISTIC = ("binary:logistic", "reg:logistic")
+IDENTITY = ("binary:logitraw", "reg:squarederror", "reg:linear")
+
+
+class TreeEnsemble:
+    """Gradient-boosted trees padded to complete binary trees of a common depth."""
+
+    def __init__(self, column, threshold, leaf_value, leaf_node, depth, base_margin, objective,
+                 num_feature, best_iteration=None, attributes=None):
+        self.column = column          # (trees, 2**depth - 1) int32, into the widened rows
+        self.threshold = threshold    # (trees, 2**depth - 1) float32
+        self.leaf_value = leaf_value  # (trees, 2**depth) float32
+        self.leaf_node = leaf_node    # (trees, 2**depth) int32, original xgboost node id
+        self.depth = depth
+        self.base_margin = base_margin
+        self.objective = objective
+        self.num_feature = num_feature
+        self.best_iteration = best_iteration
+        self.attributes = attributes or {}
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            model = json.load(f)
+        learner = model["learner"]
+        objective = learner["objective"]["name"]
+        if objective not in LOGISTIC + IDENTITY:
+            raise ValueError(f"unsupported objective {objective!r}")
+        booster = learner["gradient_booster"]
+        if booster["name"] != "gbtree":
+            raise ValueError(f"only gbtree models are supported, got {booster['name']!r}")
+        params = learner["learner_model_param"]
+        if int(params.get("num_class", 0)) > 1 or int(params.get("num_target", 1)) > 1:
+            raise ValueError("only single-output models are supported")
+        num_feature = int(params["num_feature"])
+
+        trees = booster["model"]["trees"]
+        if any(any(t["split_type"]) for t in trees):
+            raise ValueError("categorical splits are not supported")
+        depth = max((_tree_depth(t["left_children"], t["right_children"]) for t in trees), default=0)
+        if depth > MAX_DEPTH:
+            raise ValueError(f"trees of depth {depth} are too deep to pad (max {MAX_DEPTH})")
+
+        n_inner = 2 ** depth - 1
+        always_left = 2 * num_feature  # the zero column, against threshold 1
+        column = np.full((len(trees), n_inner), always_left, dtype=np.int32)
+        threshold = np.ones((len(trees), n_inner), dtype=np.float32)
+        leaf_value = np.zeros((len(trees), n_inner + 1), dtype=np.float32)
+        leaf_node = np.zeros((len(trees), n_inner + 1), dtype=np.int32)
+        for t, tree in enumerate(trees):
+            left, right = tree["left_children"], tree["right_children"]
+            feature, cond, default_left = tree["split_indices"], tree["split_conditions"], tree["default_left"]
+            stack = [(0, 0, 0)]  # (node, slot, level)
+            while stack:
+                node, slot, level = stack.pop()
+                if level == depth:
+                    # split_conditions holds the leaf value on leaf nodes
+                    leaf_value[t, slot - n_inner] = cond[node]
+                    leaf_node[t, slot - n_inner] = node
+                elif left[node] == -1:
+                    stack.append((node, 2 * slot + 1, level + 1))  # padding: always left
+                else:
+                    column[t, slot] = feature[node] + num_feature * bool(default_left[node])
+                    threshold[t, slot] = cond[node]
+                    stack += [(left[node], 2 * slot + 1, level + 1), (right[node], 2 * slot + 2, level + 1)]
+
+        base_score = float(params["base_score"].strip("[]"))  # newer xgboost writes "[5E-1]"
+        base_margin = np.log(base_score / (1 - base_score)) if objective in LOGISTIC else base_score
+        attributes = dict(learner.get("attributes", {}))
+        best = attributes.get("best_iteration")
+        return cls(column, threshold, leaf_value, leaf_node, depth, np.float32(base_margin), objective,
+                   num_feature, int(best) if best is not None else None, attributes)
+
+    def __len__(self):
+        return len(self.column)
+
+    def n_trees(self, iteration_range=None):
+        """Trees used for `iteration_range` (default: up to best_iteration, (0, 0): all)."""
+        if iteration_range is None:
+            return len(self) if self.best_iteration is None else min(self.best_iteration + 1, len(self))
+        start, end = iteration_range
+        if start != 0:
+            raise ValueError("iteration ranges must start at 0")
+        return len(self) if end == 0 else min(end, len(self))
+
+    def _widen(self, X):
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim != 2 or X.shape[1] != self.num_feature:
+            raise ValueError(f"expected an (n, {self.num_feature}) array, got shape {X.shape}")
+        missing = np.isnan(X)
+        return np.concatenate([np.where(missing, np.inf, X), np.where(missing, -np.inf, X),
+                               np.zeros((len(X), 1), dtype=np.float32)], axis=1)
+
+    def _slots(self, wide, n_trees):
+        """(rows, trees) bottom slot every row reaches in each tree."""
+        flat = wide.ravel()
+        row_offset = (np.arange(len(wide), dtype=np.int32) * wide.shape[1])[:, None]
+        tree_offset = np.arange(n_trees, dtype=np.int32) * self.column.shape[1]
+        column, threshold = self.column[:n_trees].ravel(), self.threshold[:n_trees].ravel()
+        slot = np.zeros((len(wide), n_trees), dtype=np.int32)
+        node = np.empty_like(slot)
+        x = np.empty(slot.shape, dtype=np.float32)
+        go_left = np.empty(slot.shape, dtype=bool)
+        for _ in range(self.depth):
+            np.add(tree_offset, slot, out=node)
+            index = np.take(column, node)
+            index += row_offset
+            np.take(flat, index, out=x)
+            np.less(x, np.take(threshold, node), out=go_left)
+            slot *= 2
+            slot += 2
+            slot -= go_left  # 2p + 1 on the left, 2p + 2 on the right
+        return slot - self.column.shape[1]
+
+    def leaves(self, X, iteration_range=None):
+        """(rows, trees) xgboost node id of the leaf every row lands in (like `pred_leaf=True`)."""
+        n_trees = self.n_trees(iteration_range)
+        slots = self._slots(self._widen(X), n_trees)
+        return self.leaf_node[np.arange(n_trees), slots]
+
+    def predict_margin(self, X, iteration_range=None, block=ROWS_PER_BLOCK):
+        """Raw scores (base margin + sum of leaf values), evaluated `block` rows at a time."""
+        n_trees = self.n_trees(iteration_range)
+        values = self.leaf_value[:n_trees].ravel()
+        tree_offset = np.arange(n_trees, dtype=np.int32) * self.leaf_value.shape[1]
+        out = np.empty(len(X), dtype=np.float32)
+        for start in range(0, len(X), block):
+            slots = self._slots(self._widen(X[start:start + block]), n_trees)
+            out[start:start + block] = self.base_margin + values[tree_offset + slots].sum(axis=1, dtype=np.float64)
+        return out
+
+    def predict(self, X, iteration_range=None, block=ROWS_PER_BLOCK):
+        """Transformed prediction: the positive-class probability for logistic objectives."""
+        margin = self.predict_margin(X, iteration_range, block)
+        if self.objective in LOGISTIC:
+            return (1 / (1 + np.exp(-margin.astype(np.float64)))).astype(np.float32)
+        return margin
+
+    def inplace_predict(self, X, iteration_range=(0, 0), missing=np.nan):
+        """
+        Same call as `xgboost.Booster.inplace_predict` ((0, 0) meaning every tree), so
+        `sdm.inference` and `sdm.service` can score with either.
+        """
+        if not np.isnan(missing):
+            raise ValueError("only NaN is supported as the missing value")
+        return self.predict(X, iteration_range)
+
+    def attr(self, key):
+        """Model attribute (e.g. "best_threshold") or None, like `xgboost.Booster.attr`."""
+        return self.attributes.get(key)
+
+    def predict_proba(self, X, iteration_range=None, block=ROWS_PER_BLOCK):
+        """(n, 2) class probabilities, like `XGBClassifier.predict_proba`."""
+        p = self.predict(X, iteration_range, block)
+        return np.column_stack([1 - p, p])
+
+
+def _tree_depth(left, right):
+    """Number of splits on the longest root-to-leaf path."""
+    deepest, stack = 0, [(0, 0)]
+    while stack:
+        node, depth = stack.pop()
+        if left[node] == -1:
+            deepest = max(deepest, depth)
+        else:
+            stack += [(left[node], depth + 1), (right[node], depth + 1)]
+    return deepest
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Score a (rows, features) .npy array with an XGBoost JSON model")
+    parser.add_argument("model")
+    parser.add_argument("features", help=".npy float array, columns in training order")
+    parser.add_argument("out", help="where to save the probabilities (.npy)")
+    parser.add_argument("--all-trees", action="store_true", help="ignore best_iteration")
+    args = parser.parse_args()
+    ensemble = TreeEnsemble.load(args.model)
+    iteration_range = (0, 0) if args.all_trees else None
+    X = np.load(args.features, mmap_mode="r")
+    probs = ensemble.predict(X, iteration_range)
+    np.save(args.out, probs)
+    print(f"Scored {len(probs)} rows with {ensemble.n_trees(iteration_range)} trees -> {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,46 +2,56 @@
 # Lee tus puntos GeoJSON y añade SST (°C) consultando ERDDAP para cada (fecha, celda lat/lon redondeada).
 # Salida: public/data/sphyrna_points_enriched.geojson
 
+import io
 import json
+import sys
 import time
-import math
 import pandas as pd
 from pathlib import Path
 
+sys.path.insert(0, str(Path(__file__).resolve().parent / "scripts"))
+from erddap_client import ErddapClient
+from sst_local import LocalSst
+
 # ------------ Ajustes ------------
 IN_GEOJSON  = Path("public/data/sphyrna_points.geojson")
 OUT_GEOJSON = Path("public/data/sphyrna_points_enriched.geojson")
 ROUND_DEG   = 0.05   # redondeo de lat/lon para agrupar por “celda”
-SLEEP_SEC   = 0.15   # pausa entre llamadas (evitar rate-limit)
+RATE_PER_S  = 6.0    # ritmo máximo de peticiones (token bucket, evitar rate-limit)
+WORKERS     = 8      # peticiones simultáneas
 DATASET     = "jplMURSST41mday_Lon0360"  # GHRSST MUR diario (longitudes 0–360)
+LOCAL_DIR   = None   # carpeta con granulos NetCDF de MUR/GHRSST: si se indica, no se llama a ERDDAP
 # ---------------------------------
 
 def to_0360(lon_deg: float) -> float:
     """Convierte longitudes [-180,180] a [0,360] para datasets 0–360."""
     return lon_deg if lon_deg >= 0 else lon_deg + 360
 
-def erddap_sst_point(date_iso: str, lat: float, lon: float) -> float | None:
-    """
-    Devuelve SST (°C) para (fecha YYYY-MM-DD, lat, lon en [-180,180]).
-    Usa ERDDAP csv con subsetting exacto a un punto.
-    """
+def erddap_sst_url(client: ErddapClient, date_iso: str, lat: float, lon: float) -> str:
+    """URL ERDDAP csv con subsetting exacto a un punto (fecha YYYY-MM-DD, lat, lon en [-180,180])."""
     lon0360 = to_0360(lon)
-    url = (
-        f"https://coastwatch.pfeg.noaa.gov/erddap/griddap/{DATASET}.csv?"
+    return client.griddap_url(
+        DATASET,
         f"sst[({date_iso}):1:({date_iso})]"
         f"[({lat}):1:({lat})]"
         f"[({lon0360}):1:({lon0360})]"
     )
+
+def parse_sst_csv(text: str | None) -> float | None:
+    """Devuelve SST (°C) de la respuesta csv de un punto, o None."""
+    if text is None:
+        return None
     try:
-        df = pd.read_csv(url)
+        df = pd.read_csv(io.StringIO(text))
         # Buscar columna sst (puede venir como 'sst (degree_C)')
         sst_col = next((c for c in df.columns if c.startswith("sst")), None)
         if not sst_col:
             return None
-        val = df[sst_col].iloc[0]
-        if pd.isna(val):
+        # la primera fila del csv de ERDDAP son las unidades
+        vals = pd.to_numeric(df[sst_col], errors="coerce").dropna()
+        if vals.empty:
             return None
-        return float(val)  # °C
+        return float(vals.iloc[0])  # °C
     except Exception:
         return None
 
@@ -85,14 +95,26 @@ def main():
     # Deduplicar para no repetir consultas
     keys = valid[["date", "lat_cell", "lon_cell"]].drop_duplicates()
 
-    print(f"Consultas únicas a ERDDAP: {len(keys)}")
-
+    key_list = [(r["date"], float(r["lat_cell"]), float(r["lon_cell"])) for _, r in keys.iterrows()]
     cache = {}  # (date,lat_cell,lon_cell) -> sst_c
-    for _, r in keys.iterrows():
-        k = (r["date"], float(r["lat_cell"]), float(r["lon_cell"]))
-        sst_c = erddap_sst_point(k[0], k[1], k[2])
-        cache[k] = sst_c
-        time.sleep(SLEEP_SEC)
+    t0 = time.monotonic()
+
+    if LOCAL_DIR:
+        # Todas las celdas de cada fecha de una vez, leyendo los granulos locales
+        print(f"Celdas únicas (SST local): {len(key_list)}")
+        local = LocalSst(Path(LOCAL_DIR))
+        dates, lats, lons = zip(*key_list) if key_list else ((), (), ())
+        for k, v in zip(key_list, local.sample_many(dates, lats, lons)):
+            cache[k] = None if v != v else float(v)
+        local.close()
+        print(f"SST local: {local.summary()} en {time.monotonic() - t0:.1f}s")
+    else:
+        print(f"Consultas únicas a ERDDAP: {len(keys)}")
+        client = ErddapClient(workers=WORKERS, rate=RATE_PER_S)
+        urls = [erddap_sst_url(client, *k) for k in key_list]
+        for i, text in client.fetch_many(urls):
+            cache[key_list[i]] = parse_sst_csv(text)
+        print(f"ERDDAP: {client.summary()} en {time.monotonic() - t0:.1f}s")
 
     # Asignar sst_c a cada feature
     sst_list = []
@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+# scripts/benchmark.py
+# Banco de pruebas offline de los scripts de datos. Genera datos sintéticos con semilla
+# (puntos, polígonos de tierra, raster de batimetría) a escala 10k / 100k / 1M, levanta un
+# ERDDAP local de mentira y ejecuta cada script como proceso aparte, midiendo su tiempo,
+# puntos/s y pico de memoria (VmHWM del propio proceso). Los resultados van a un
+# JSON que puede servir de línea base para la siguiente ejecución: si una etapa tarda o
+# consume más que la base por encima del umbral relativo *y* del mínimo absoluto
+# (--min-delta s, --min-rss-delta MB), se marca como regresión (código de salida 1). Con
+# --repeat cada etapa se ejecuta varias veces y se compara la más rápida.
+# model/sdm/benchmark.py importa compare() de aquí para comparar sus etapas con la misma regla.
+#
+#   python scripts/benchmark.py --scale 10k --out bench/baseline_10k.json
+#   python scripts/benchmark.py --scale 10k --baseline bench/baseline_10k.json --tolerance 0.2
+#
+# Los datos generados se guardan en --workdir (por defecto bench/data_<escala>) y se reutilizan.
+import argparse, datetime, json, os, platform, re, subprocess, sys, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from pathlib import Path
+from urllib.parse import unquote
+
+import numpy as np
+import shapely
+from shapely.geometry import mapping
+
+from enrich_sst_real import DATASET, GRID_RES_DEG
+from feature_io import FeatureWriter
+
+SCRIPTS = Path(__file__).resolve().parent
+SCALES = {"10k": 10_000, "100k": 100_000, "1M": 1_000_000}
+BOUNDS = (8.0, -98.0, 34.0, -60.0)   # minLat minLon maxLat maxLon (Caribe/Florida, como los scripts)
+GLOBAL_BOUNDS = (-60.0, -180.0, 60.0, 180.0)   # puntos en mar abierto, lejos de la costa
+YEARS = (2010, 2011)                 # pocas fechas: el ERDDAP local genera una caja por mes
+ISLANDS = 300                        # polígonos de tierra (no depende de la escala)
+RASTER_RES = 0.01                    # grados por píxel del raster de batimetría
+SPECIES = ("Sphyrna lewini", "Sphyrna mokarran", "Sphyrna tiburo")
+STAGES = ("make_background_points", "enrich_bathymetry", "enrich_distance_to_coast",
+          "enrich_distance_to_coast_global", "enrich_sst_real", "enrich_pipeline", "build_pa_dataset", "pa_to_table")
+
+
+# --------- generadores ----------
+def random_dates(rng, n):
+    days = (np.datetime64(f"{YEARS[1] + 1}-01-01") - np.datetime64(f"{YEARS[0]}-01-01")).astype(int)
+    return (np.datetime64(f"{YEARS[0]}-01-01") + rng.integers(0, days, n)).astype(str)
+
+
+def gen_points(path: Path, n: int, rng, sst: bool = False, chunk: int = 100_000, bounds=BOUNDS):
+    """n puntos al azar en `bounds` con eventDate y especie (y sst_c si `sst`), en NDJSON/GeoJSON."""
+    min_lat, min_lon, max_lat, max_lon = bounds
+    with FeatureWriter(path) as out:
+        for start in range(0, n, chunk):
+            m = min(chunk, n - start)
+            lons = np.round(rng.uniform(min_lon, max_lon, m), 5)
+            lats = np.round(rng.uniform(min_lat, max_lat, m), 5)
+            dates = random_dates(rng, m)
+            species = rng.integers(0, len(SPECIES), m)
+            ssts = np.round(rng.normal(27, 1.5, m), 3)
+            out.write_many({
+                "type": "Feature",
+                "geometry": {"type": "Point", "coordinates": [float(lon), float(lat)]},
+                "properties": {"eventDate": d, "species": SPECIES[s], **({"sst_c": float(t)} if sst else {})},
+            } for lon, lat, d, s, t in zip(lons, lats, dates, species, ssts))
+
+
+def gen_land(path: Path, rng, islands: int = ISLANDS, bounds=BOUNDS, max_radius: float = 0.8):
+    """Islas (círculos deformados) y una franja de costa continental al norte de `bounds`."""
+    min_lat, min_lon, max_lat, max_lon = bounds
+    polys = [shapely.box(min_lon - 1, max_lat - 3, max_lon + 1, max_lat + 1)]
+    for _ in range(islands):
+        x, y = rng.uniform(min_lon, max_lon), rng.uniform(min_lat, max_lat - 3)
+        ring = np.linspace(0, 2 * np.pi, 48, endpoint=False)
+        r = rng.uniform(0.05, max_radius) * (1 + 0.3 * rng.uniform(-1, 1, len(ring)))
+        polys.append(shapely.Polygon(np.column_stack([x + r * np.cos(ring), y + r * np.sin(ring)])))
+    with FeatureWriter(path) as out:
+        out.write_many({"type": "Feature", "geometry": mapping(p), "properties": {}} for p in polys)
+
+
+def gen_raster(path: Path, res: float = RASTER_RES):
+    """GeoTIFF int16 teselado y comprimido con una batimetría suave sobre BOUNDS (+1° de margen)."""
+    import rasterio
+    from rasterio.transform import from_origin
+
+    min_lat, min_lon, max_lat, max_lon = BOUNDS
+    west, north = min_lon - 1, max_lat + 1
+    width = int(round((max_lon - min_lon + 2) / res))
+    height = int(round((max_lat - min_lat + 2) / res))
+    profile = dict(driver="GTiff", width=width, height=height, count=1, dtype="int16", crs="EPSG:4326",
+                   transform=from_origin(west, north, res, res), tiled=True, blockxsize=512,
+                   blockysize=512, compress="deflate", nodata=-32768)
+    lons = west + (np.arange(width) + 0.5) * res
+    with rasterio.open(path, "w", **profile) as dst:
+        for r0 in range(0, height, 512):
+            lats = north - (np.arange(r0, min(r0 + 512, height)) + 0.5) * res
+            depth = -4000 * np.abs(np.sin(np.radians(lats[:, None] * 7)) * np.cos(np.radians(lons[None, :] * 5)))
+            dst.write(depth.astype(np.int16)[None], window=((r0, r0 + len(lats)), (0, width)))
+
+
+def generate(work: Path, n: int, seed: int):
+    """Crea (si faltan) los ficheros de entrada de todas las etapas en `work`."""
+    work.mkdir(parents=True, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    files = {
+        "points.ndjson": lambda p: gen_points(p, n, rng),
+        "presence_sst.ndjson": lambda p: gen_points(p, n // 2, rng, sst=True),
+        "background_sst.ndjson": lambda p: gen_points(p, n - n // 2, rng, sst=True),
+        "land.geojson": lambda p: gen_land(p, rng),
+        # extensión global: radios de búsqueda grandes en enrich_distance_to_coast
+        "points_global.ndjson": lambda p: gen_points(p, n, rng, bounds=GLOBAL_BOUNDS),
+        "land_global.geojson": lambda p: gen_land(p, rng, bounds=GLOBAL_BOUNDS, max_radius=3.0),
+        "bathy.tif": gen_raster,
+    }
+    for name, make in files.items():
+        path = work / name
+        if not path.exists():
+            t0 = time.monotonic()
+            make(path)
+            print(f"[info] generado {path} en {time.monotonic() - t0:.1f}s")
+
+
+# --------- ERDDAP de mentira ----------
+QUERY_RE = re.compile(r"\[\((.*?)\):(\d+):\((.*?)\)\]")
+
+
+class _ErddapHandler(BaseHTTPRequestHandler):
+    """GET /<dataset>.csv?sst[(t):1:(t)][(lat0):s:(lat1)][(lon0):s:(lon1)] con una SST sintética."""
+
+    def do_GET(self):
+        path, _, query = unquote(self.path).partition("?")
+        dims = QUERY_RE.findall(query)
+        if not path.endswith(f"/{DATASET}.csv") or len(dims) != 3:
+            self.send_error(400, "unexpected URL")
+            return
+        (t, _, _), (lat0, s_lat, lat1), (lon0, s_lon, lon1) = dims
+        step_lat, step_lon = GRID_RES_DEG * int(s_lat), GRID_RES_DEG * int(s_lon)
+        lats = np.arange(float(lat0), float(lat1) + step_lat / 2, step_lat)
+        lons = np.arange(float(lon0), float(lon1) + step_lon / 2, step_lon)
+        lat, lon = (a.ravel() for a in np.meshgrid(lats, lons, indexing="ij"))
+        sst = 28 - 0.25 * np.abs(lat) + 0.5 * np.sin(np.radians(lon))
+        buf = BytesIO()
+        buf.write(b"time,latitude,longitude,sst\nUTC,degrees_north,degrees_east,degree_C\n")
+        np.savetxt(buf, np.column_stack([lat, lon, sst]), fmt=f"{t[:10]}T00:00:00Z,%.4f,%.4f,%.3f")
+        body = buf.getvalue()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/csv")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_erddap():
+    """Arranca el ERDDAP local en un puerto libre; devuelve (servidor, URL base griddap)."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _ErddapHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/erddap/griddap"
+
+
+# --------- etapas ----------
+def commands(n: int, erddap: str) -> dict:
+    """etapa -> (argumentos del script, puntos procesados)."""
+    py = [sys.executable]
+    s = lambda name: str(SCRIPTS / f"{name}.py")
+    return {
+        "make_background_points": (py + [s("make_background_points"), "--bounds", *map(str, BOUNDS),
+                                         "--n", str(n), "--land", "land.geojson", "--presence", "points.ndjson",
+                                         "--out", "background.ndjson", "--seed", "0"], n),
+        "enrich_bathymetry": (py + [s("enrich_bathymetry"), "--src", "points.ndjson", "--raster", "bathy.tif",
+                                    "--dst", "out_bathy.ndjson"], n),
+        "enrich_distance_to_coast": (py + [s("enrich_distance_to_coast"), "--src", "points.ndjson",
+                                           "--dst", "out_dist.ndjson", "--land", "land.geojson"], n),
+        "enrich_distance_to_coast_global": (py + [s("enrich_distance_to_coast"), "--src", "points_global.ndjson",
+                                                  "--dst", "out_dist_global.ndjson",
+                                                  "--land", "land_global.geojson"], n),
+        "enrich_sst_real": (py + [s("enrich_sst_real"), "--src", "points.ndjson", "--dst", "out_sst.ndjson",
+                                  "--limit", "0", "--batch", "--throttle", "0", "--erddap", erddap], n),
+        "enrich_pipeline": (py + [s("enrich_pipeline"), "--src", "points.ndjson", "--dst", "out_pipeline.ndjson",
+                                  "--stages", "bathy", "dist", "--raster", "bathy.tif", "--land", "land.geojson"], n),
+        "build_pa_dataset": (py + [s("build_pa_dataset"), "--pres", "presence_sst.ndjson",
+                                   "--back", "background_sst.ndjson", "--out", "pa.ndjson"], n),
+        "pa_to_table": (py + [s("pa_to_table"), "--src", "pa.ndjson", "--csv", "pa.csv",
+                              "--parquet", "pa.parquet"], n),
+    }
+
+
+# Lanzador de cada etapa: ejecuta el script como __main__ y al salir apunta su pico de RSS.
+# Con fork+exec el ru_maxrss que devuelve wait4 arrastra el del proceso padre (aquí, el del
+# benchmark con el ERDDAP local dentro), así que el hijo lo mide él mismo: VmHWM solo cuenta
+# la memoria del programa actual.
+_LAUNCHER = """
+import atexit, resource, runpy, sys
+def _rss(path=sys.argv[1]):
+    try:
+        kb = next(int(l.split()[1]) for l in open('/proc/self/status') if l.startswith('VmHWM:'))
+    except OSError:
+        kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // (1024 if sys.platform == 'darwin' else 1)
+    open(path, 'w').write(str(kb))
+atexit.register(_rss)
+script = sys.argv[2]
+sys.argv = sys.argv[2:]
+sys.path.insert(0, script.rsplit('/', 1)[0])
+runpy.run_path(script, run_name='__main__')
+"""
+
+
+def run_stage(name: str, cmd: list, points: int, work: Path, repeat: int = 1) -> dict:
+    """
+    Ejecuta un script como proceso hijo `repeat` veces; tiempo de pared (el mínimo y la
+    mediana) y pico de RSS de ese proceso (el mayor).
+    """
+    rss_file = work / f"{name}.rss"
+    times, rss = [], []
+    for _ in range(repeat):
+        for stale in work.glob(".cache_sst.sqlite*"):
+            stale.unlink()       # la caché SST haría que la segunda ejecución no midiera nada
+        with open(work / f"{name}.log", "w") as log:
+            t0 = time.perf_counter()
+            code = subprocess.call([cmd[0], "-c", _LAUNCHER, str(rss_file), *cmd[1:]], cwd=work,
+                                   stdout=log, stderr=subprocess.STDOUT)
+            times.append(time.perf_counter() - t0)
+        if code != 0:
+            raise RuntimeError(f"{name} terminó con código {code} (ver {work / f'{name}.log'})")
+        rss.append(int(rss_file.read_text()) / 1024)
+    seconds = min(times)
+    return {"seconds": round(seconds, 3), "median_seconds": round(float(np.median(times)), 3),
+            "repeat": repeat, "points": points, "points_per_s": round(points / seconds, 1),
+            "peak_rss_mb": round(max(rss), 1)}
+
+
+# --------- resultados ----------
+def regressed(value: float, base: float, tolerance: float, floor: float):
+    """Ratio valor/base si supera a la vez 1 + `tolerance` y base + `floor`; si no, None."""
+    ratio = value / max(base, 1e-4)
+    return ratio if ratio > 1 + tolerance and value - base > floor else None
+
+
+def compare(results: dict, baseline: dict, tolerance: float, rss_tolerance: float,
+            min_delta: float = 0.5, min_rss_delta: float = 16.0, memory: str = "peak_rss_mb") -> list:
+    """
+    Imprime la comparación con la base y devuelve las regresiones (etapa, métrica, ratio).
+    Una etapa solo empeora si lo hace en proporción y en valor absoluto: una de 0.04 s que
+    pasa a 0.05 s es ruido, no una regresión. `memory` es la métrica de memoria a comparar;
+    si la base no la tiene (una base anterior a esa métrica) se avisa y solo se compara el tiempo.
+    """
+    if baseline.get("scale") != results["scale"]:
+        print(f"[warn] la base es de escala {baseline.get('scale')} y esta ejecución de {results['scale']}")
+    regressions = []
+    print(f"{'etapa':<33}{'s':>9}{'base':>9}{'ratio':>7}{'MB':>9}{'base':>9}{'ratio':>7}")
+    for name, r in results["stages"].items():
+        b = baseline.get("stages", {}).get(name)
+        if b is None:
+            print(f"{name:<33}{r['seconds']:>9.2f}{'-':>9}{'':>7}{r[memory]:>9.1f}")
+            continue
+        flags = ""
+        if regressed(r["seconds"], b["seconds"], tolerance, min_delta) is not None:
+            regressions.append((name, "seconds", r["seconds"] / max(b["seconds"], 1e-4)))
+            flags += "  <- tiempo"
+        line = f"{name:<33}{r['seconds']:>9.2f}{b['seconds']:>9.2f}{r['seconds'] / max(b['seconds'], 1e-4):>7.2f}"
+        if memory not in b:
+            print(f"[warn] la base de {name} no tiene {memory}; no se compara la memoria")
+            print(f"{line}{r[memory]:>9.1f}{'-':>9}{'':>7}{flags}")
+            continue
+        if regressed(r[memory], b[memory], rss_tolerance, min_rss_delta) is not None:
+            regressions.append((name, memory, r[memory] / max(b[memory], 1e-4)))
+            flags += "  <- memoria"
+        print(f"{line}{r[memory]:>9.1f}{b[memory]:>9.1f}{r[memory] / max(b[memory], 1e-4):>7.2f}{flags}")
+    return regressions
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark offline de los scripts con datos sintéticos")
+    ap.add_argument("--scale", choices=SCALES, default="10k")
+    ap.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES))
+    ap.add_argument("--workdir", type=Path, default=None, help="datos generados (por defecto bench/data_<escala>)")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--out", type=Path, default=None, help="JSON de resultados (por defecto bench/results_<escala>.json)")
+    ap.add_argument("--baseline", type=Path, default=None, help="JSON de una ejecución anterior con la que comparar")
+    ap.add_argument("--repeat", type=int, default=1, help="ejecuciones por etapa; se compara la más rápida")
+    ap.add_argument("--tolerance", type=float, default=0.25, help="regresión si el tiempo supera la base en esta fracción")
+    ap.add_argument("--min-delta", type=float, default=0.5,
+                    help="… y en al menos estos segundos (cubre el arranque del intérprete)")
+    ap.add_argument("--rss-tolerance", type=float, default=0.25, help="ídem para el pico de memoria")
+    ap.add_argument("--min-rss-delta", type=float, default=16.0, help="… y en al menos estos MB")
+    args = ap.parse_args()
+
+    n = SCALES[args.scale]
+    work = (args.workdir or Path("bench") / f"data_{args.scale}").resolve()
+    out = args.out or Path("bench") / f"results_{args.scale}.json"
+    print(f"[run] escala={args.scale} ({n} puntos)  workdir={work}  etapas={' '.join(args.stages)}")
+    baseline = json.loads(args.baseline.read_text()) if args.baseline else None   # puede ser el mismo --out
+    generate(work, n, args.seed)
+
+    server, erddap = start_erddap()
+    results = {"scale": args.scale, "n": n, "seed": args.seed,
+               "created": datetime.datetime.now().isoformat(timespec="seconds"),
+               "python": platform.python_version(), "machine": platform.machine(),
+               "cpus": os.cpu_count(), "stages": {}}
+    try:
+        cmds = commands(n, erddap)
+        for name in args.stages:
+            cmd, points = cmds[name]
+            r = run_stage(name, cmd, points, work, args.repeat)
+            results["stages"][name] = r
+            print(f"[ok] {name}: {r['seconds']:.2f}s  {r['points_per_s']:.0f} puntos/s  {r['peak_rss_mb']:.0f} MB")
+    finally:
+        server.shutdown()
+
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(results, indent=1))
+    print(f"[ok] resultados: {out}")
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.tolerance, args.rss_tolerance,
+                              args.min_delta, args.min_rss_delta)
+        if regressions:
+            print(f"[warn] {len(regressions)} regresiones respecto a {args.baseline}")
+            sys.exit(1)
+        print("[ok] sin regresiones")
+
+
+if __name__ == "__main__":
+    main()
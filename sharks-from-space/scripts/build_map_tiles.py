@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+# scripts/build_map_tiles.py
+# Prepara las capas de la página Map para que se descarguen por teselas según el viewport:
+#
+#  - cada capa de puntos se parte en teselas XYZ (Web Mercator, z = minzoom..maxzoom) en un
+#    binario por columnas: lon/lat cuantizadas a uint16 dentro de la tesela y sst_c,
+#    bathy_m, dist_coast_km y fecha como enteros escalados (ver "columns" en el manifest);
+#    por debajo de maxzoom se queda como mucho un punto por celda de --cell-px píxeles;
+#  - los puntos que caen en tierra se quitan aquí (antes lo hacía el navegador con Turf);
+#  - la tierra se simplifica en varios niveles de detalle (LOD), uno por rango de zoom;
+#  - cada fichero se escribe también precomprimido (.gz y, si está instalado brotli, .br);
+#  - manifest.json describe capas, columnas, teselas existentes y LODs.
+#
+#   python scripts/build_map_tiles.py \
+#       --layer hammerheads=public/data/sphyrna_points_enriched_0_5000_with_dist.geojson \
+#       --land public/data/land.geojson --out public/tiles
+import argparse, gzip, json, math, shutil, struct
+from pathlib import Path
+
+import numpy as np
+import shapely
+from shapely.geometry import mapping, shape
+
+from enrich_pipeline import PointTable
+from feature_io import iter_features
+from make_background_points import load_land
+
+try:
+    import brotli
+except ImportError:  # opcional: sin brotli solo se generan .gz
+    brotli = None
+
+MAGIC = b"SPT1"
+HEADER = "<4sI4d"            # magic, n puntos, west, south, east, north (bounds de la tesela)
+MAX_LAT = 85.0511287798      # límite de Web Mercator
+Q = 65535                    # pasos de cuantización por eje dentro de una tesela
+TILE_PX = 256
+EPOCH = np.datetime64("1970-01-01", "D")
+
+# columnas opcionales: (propiedad, tipo, escala) -> valor = entero / escala; nodata = mínimo/máximo del tipo
+VALUE_COLUMNS = [
+    ("sst_c", "int16", 100),         # centésimas de °C
+    ("bathy_m", "int16", 1),         # metros
+    ("dist_coast_km", "uint16", 10), # décimas de km (hasta 6553 km)
+]
+NODATA = {"int16": -32768, "uint16": 65535}
+# (zoom mínimo, zoom máximo, tolerancia en grados) de cada LOD de tierra
+LAND_LODS = [(0, 2, 0.2), (3, 4, 0.05), (5, 6, 0.01), (7, 22, 0.002)]
+
+
+# --------- Web Mercator ----------
+def tile_xy(lon, lat, z):
+    """Tesela (x, y) y posición fraccionaria dentro del mundo en [0, 1) para arrays de lon/lat."""
+    n = 2 ** z
+    lat = np.clip(lat, -MAX_LAT, MAX_LAT)
+    fx = (lon + 180.0) / 360.0
+    rad = np.radians(lat)
+    fy = (1.0 - np.log(np.tan(rad) + 1.0 / np.cos(rad)) / math.pi) / 2.0
+    fx, fy = np.clip(fx, 0, 1 - 1e-12), np.clip(fy, 0, 1 - 1e-12)
+    return (fx * n).astype(np.int64), (fy * n).astype(np.int64), fx, fy
+
+
+def tile_bounds(z, x, y):
+    """(west, south, east, north) en grados."""
+    n = 2 ** z
+    lat = lambda t: math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * t / n))))
+    return x / n * 360.0 - 180.0, lat(y + 1), (x + 1) / n * 360.0 - 180.0, lat(y)
+
+
+# --------- puntos ----------
+def species_codes(props):
+    names = [(p.get("species") or p.get("scientificName") or "") for p in props]
+    table = sorted(set(names))
+    index = {s: i for i, s in enumerate(table)}
+    return np.array([index[s] for s in names], dtype=np.uint8 if len(table) < 256 else np.uint16), table
+
+
+def source_codes(props):
+    names = [(p.get("datasetName") or p.get("publisher") or "") for p in props]
+    table = sorted(set(names))
+    index = {s: i for i, s in enumerate(table)}
+    return np.array([index[s] for s in names], dtype=np.uint16), table
+
+
+def quantize_values(values, dtype, scale):
+    info = np.iinfo(dtype)
+    nodata = NODATA[dtype]
+    lo, hi = (info.min + 1, info.max) if nodata == info.min else (info.min, info.max - 1)
+    q = np.round(np.asarray(values, dtype=float) * scale)
+    out = np.clip(np.nan_to_num(q, nan=nodata), lo, hi).astype(dtype)
+    out[np.isnan(q)] = nodata
+    return out
+
+
+def date_days(dates):
+    """Días desde 1970-01-01 (int16: de 1880 a 2059; -32768 = sin fecha)."""
+    out = np.full(len(dates), NODATA["int16"], dtype=np.int16)
+    for i, d in enumerate(dates):
+        if d:
+            try:
+                days = int((np.datetime64(d, "D") - EPOCH).astype(np.int64))
+                if NODATA["int16"] < days <= np.iinfo(np.int16).max:
+                    out[i] = days
+            except ValueError:
+                pass
+    return out
+
+
+def thin_per_cell(fx, fy, z, cell_px, order):
+    """Índices (según `order`) del primer punto de cada celda de cell_px píxeles a zoom z."""
+    cells = TILE_PX * 2 ** z // cell_px
+    cx = (fx[order] * cells).astype(np.int64)
+    cy = (fy[order] * cells).astype(np.int64)
+    _, first = np.unique(cy * cells + cx, return_index=True)
+    return order[np.sort(first)]
+
+
+def encode_tile(z, x, y, lon, lat, columns):
+    """Binario de una tesela: cabecera + lon/lat uint16 + columnas (de más ancha a más estrecha)."""
+    west, south, east, north = tile_bounds(z, x, y)
+    qx = np.round((lon - west) / (east - west) * Q).clip(0, Q).astype("<u2")
+    qy = np.round((lat - south) / (north - south) * Q).clip(0, Q).astype("<u2")
+    parts = [struct.pack(HEADER, MAGIC, len(lon), west, south, east, north), qx.tobytes(), qy.tobytes()]
+    # las columnas de 2 bytes van antes que las de 1 para que todas queden alineadas
+    for arr in sorted(columns, key=lambda a: -a.dtype.itemsize):
+        parts.append(arr.astype(arr.dtype.newbyteorder("<")).tobytes())
+    return b"".join(parts)
+
+
+def write_asset(path: Path, data: bytes, stats: dict):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+    gz = gzip.compress(data, compresslevel=9, mtime=0)
+    Path(str(path) + ".gz").write_bytes(gz)
+    stats["raw"] += len(data)
+    stats["gzip"] += len(gz)
+    if brotli is not None:
+        br = brotli.compress(data, quality=11)
+        Path(str(path) + ".br").write_bytes(br)
+        stats["br"] += len(br)
+
+
+def build_point_layer(name, src, out: Path, land, minzoom, maxzoom, cell_px, seed=0):
+    t = PointTable.read(src)
+    keep = t.has_coords & (np.abs(t.lat) <= 90) & (np.abs(t.lon) <= 180)
+    keep &= ~((t.lat == 0) & (t.lon == 0))   # (0, 0) = coordenadas por defecto, no un avistamiento
+    if land is not None:
+        keep[keep] &= ~shapely.contains_xy(land, t.lon[keep], t.lat[keep])
+    idx = np.flatnonzero(keep)
+    lon, lat = t.lon[idx], t.lat[idx]
+    props = [t.props[i] for i in idx]
+    print(f"[load] {name}: {len(t)} puntos, {len(idx)} en mar con coordenadas válidas")
+
+    species, species_table = species_codes(props)
+    source, source_table = source_codes(props)
+    present = [(p, dt, sc) for p, dt, sc in VALUE_COLUMNS if any(p in q for q in props)]
+    values = {p: quantize_values([q.get(p) if q.get(p) is not None else np.nan for q in props], dt, sc)
+              for p, dt, sc in present}
+    columns = {"date": date_days([t.date[i] for i in idx]), **values, "source": source, "species": species}
+    if source_table == [""]:   # sin datasetName/publisher no merece la pena la columna
+        del columns["source"]
+
+    layer_dir = out / name
+    if layer_dir.exists():
+        shutil.rmtree(layer_dir)
+    stats = {"raw": 0, "gzip": 0, "br": 0}
+    order = np.random.default_rng(seed).permutation(len(idx))   # prioridad estable al aclarar
+    tiles = {}
+    for z in range(minzoom, maxzoom + 1):
+        sel = np.arange(len(idx)) if z == maxzoom else None
+        tx, ty, fx, fy = tile_xy(lon, lat, z)
+        if sel is None:
+            sel = thin_per_cell(fx, fy, z, cell_px, order)
+        sel = sel[np.lexsort((ty[sel], tx[sel]))]
+        keys = tx[sel] * 2 ** z + ty[sel]
+        bounds = np.flatnonzero(np.diff(keys)) + 1
+        tiles[z] = []
+        for group in np.split(sel, bounds):
+            if len(group) == 0:
+                continue
+            x, y = int(tx[group[0]]), int(ty[group[0]])
+            data = encode_tile(z, x, y, lon[group], lat[group], [c[group] for c in columns.values()])
+            write_asset(layer_dir / str(z) / str(x) / f"{y}.bin", data, stats)
+            tiles[z].append([x, y, len(group)])
+        print(f"[ok] {name} z{z}: {len(tiles[z])} teselas, {len(sel)} puntos")
+
+    # orden en el binario: lon, lat y luego columnas de 2 bytes antes que las de 1 (estable)
+    ordered = sorted(columns.items(), key=lambda kv: -kv[1].dtype.itemsize)
+    col_meta = []
+    for col, arr in ordered:
+        meta = {"name": col, "type": arr.dtype.name}
+        if col == "date":
+            meta.update({"unit": "days since 1970-01-01", "nodata": NODATA["int16"]})
+        elif col in values:
+            scale = next(sc for p, _, sc in VALUE_COLUMNS if p == col)
+            meta.update({"scale": scale, "nodata": NODATA[arr.dtype.name]})
+        elif col == "species":
+            meta["values"] = species_table
+        elif col == "source":
+            meta["values"] = source_table
+        col_meta.append(meta)
+
+    return {
+        "path": f"{name}/{{z}}/{{x}}/{{y}}.bin",
+        "minzoom": minzoom, "maxzoom": maxzoom, "cell_px": cell_px,
+        "count": int(len(idx)),
+        "header": {"format": HEADER, "bytes": struct.calcsize(HEADER), "magic": MAGIC.decode()},
+        "quantization": Q,
+        "columns": col_meta,
+        "tiles": {str(z): v for z, v in tiles.items()},
+        "bytes": stats,
+    }
+
+
+# --------- tierra ----------
+def _round_coords(coords, ndigits):
+    if isinstance(coords[0], (float, int)):
+        return [round(c, ndigits) for c in coords]
+    return [_round_coords(c, ndigits) for c in coords]
+
+
+def build_land_lods(land_path: Path, out: Path, lods=LAND_LODS):
+    geoms = [shape(f["geometry"]) for f in iter_features(land_path) if f.get("geometry")]
+    land_dir = out / "land"
+    if land_dir.exists():
+        shutil.rmtree(land_dir)
+    entries = []
+    for zmin, zmax, tol in lods:
+        # decimales suficientes para la tolerancia (una décima de ella)
+        ndigits = max(0, math.ceil(-math.log10(tol / 10)))
+        feats = []
+        for g in shapely.simplify(np.array(geoms, dtype=object), tol, preserve_topology=True):
+            if g is None or g.is_empty or g.area < tol * tol:
+                continue
+            m = mapping(g)
+            feats.append({"type": "Feature", "properties": {},
+                          "geometry": {"type": m["type"], "coordinates": _round_coords(m["coordinates"], ndigits)}})
+        data = json.dumps({"type": "FeatureCollection", "features": feats}, separators=(",", ":")).encode()
+        stats = {"raw": 0, "gzip": 0, "br": 0}
+        name = f"land_z{zmin}-{zmax}.geojson"
+        write_asset(land_dir / name, data, stats)
+        entries.append({"minzoom": zmin, "maxzoom": zmax, "tolerance_deg": tol,
+                        "path": f"land/{name}", "features": len(feats), "bytes": stats})
+        print(f"[ok] tierra z{zmin}-{zmax} (tol {tol}°): {len(feats)} polígonos, "
+              f"{stats['raw'] / 1e3:.0f} kB ({stats['gzip'] / 1e3:.0f} kB gzip)")
+    return entries
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Teselas binarias de puntos y LODs de tierra para la página Map")
+    ap.add_argument("--layer", action="append", metavar="NOMBRE=GEOJSON",
+                    help="capa de puntos (repetible)")
+    ap.add_argument("--land", type=Path, default=Path("public/data/land.geojson"))
+    ap.add_argument("--out", type=Path, default=Path("public/tiles"))
+    ap.add_argument("--minzoom", type=int, default=0)
+    ap.add_argument("--maxzoom", type=int, default=7,
+                    help="a partir de aquí las teselas llevan todos los puntos (el mapa las reutiliza al acercarse)")
+    ap.add_argument("--cell-px", type=int, default=4,
+                    help="por debajo de maxzoom, como mucho un punto por celda de N píxeles")
+    ap.add_argument("--keep-land", action="store_true", help="no quitar los puntos que caen en tierra")
+    args = ap.parse_args()
+
+    layers = args.layer or ["hammerheads=public/data/sphyrna_points_enriched_0_5000_with_dist.geojson"]
+    args.out.mkdir(parents=True, exist_ok=True)
+    land = None if args.keep_land else load_land(args.land)
+    if brotli is None:
+        print("[warn] módulo brotli no instalado: solo se generan .gz")
+
+    manifest = {"version": 1, "tile_size": TILE_PX, "encodings": ["br", "gzip"] if brotli else ["gzip"],
+                "layers": {}, "land": []}
+    for spec in layers:
+        name, src = spec.split("=", 1)
+        manifest["layers"][name] = build_point_layer(name, Path(src), args.out, land,
+                                                     args.minzoom, args.maxzoom, args.cell_px)
+    manifest["land"] = build_land_lods(args.land, args.out)
+
+    tmp = args.out / "manifest.json.tmp"
+    tmp.write_text(json.dumps(manifest, separators=(",", ":")))
+    tmp.replace(args.out / "manifest.json")
+    print(f"[ok] manifest: {args.out / 'manifest.json'}")
+
+
+if __name__ == "__main__":
+    main()
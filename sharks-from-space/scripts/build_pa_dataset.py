@@ -1,14 +1,14 @@
 #!/usr/bin/env python3
-import json, argparse, pathlib
+import argparse, pathlib
+
+from feature_io import iter_features, FeatureWriter
 
 def tag(features, presence):
-    out = []
     for f in features:
         props = f.get("properties") or {}
         props["presence"] = presence
         f["properties"] = props
-        out.append(f)
-    return out
+        yield f
 
 def main():
     ap = argparse.ArgumentParser()
@@ -17,25 +17,20 @@ def main():
     ap.add_argument("--out", default="data/processed/pa_dataset.geojson")
     args = ap.parse_args()
 
-    # cargar
-    pres = json.load(open(args.pres))["features"]
-    back = json.load(open(args.back))["features"]
-
-    # etiquetar
-    pres = tag(pres, 1)
-    back = tag(back, 0)
+    # cargar + etiquetar (en streaming)
+    pres = tag(iter_features(args.pres), 1)
+    back = tag(iter_features(args.back), 0)
 
     # opcional: filtrar background sin sst
-    back = [f for f in back if f.get("properties", {}).get("sst_c") is not None]
+    back = (f for f in back if f.get("properties", {}).get("sst_c") is not None)
 
     # unir
-    all_feats = pres + back
-    out = {"type": "FeatureCollection", "features": all_feats}
-
     pathlib.Path(args.out).parent.mkdir(parents=True, exist_ok=True)
-    json.dump(out, open(args.out, "w"), ensure_ascii=False)
+    with FeatureWriter(args.out) as out:
+        out.write_many(pres)
+        out.write_many(back)
 
-    print(f"[ok] dataset P/A -> {args.out} ({len(all_feats)} puntos)")
+    print(f"[ok] dataset P/A -> {args.out} ({out.count} puntos)")
 
 if __name__ == "__main__":
     main()
@@ -1,44 +1,191 @@
 #!/usr/bin/env python3
-import json, argparse, rasterio
+import argparse, rasterio
+from pathlib import Path
 
-def enrich(src_geojson, raster_path, dst_geojson, prop_name="bathy_m"):
-    gj = json.load(open(src_geojson))
-    feats = gj.get("features", [])
-    out = []
+import numpy as np
+from rasterio.windows import Window
+
+from feature_io import FeatureReader, FeatureWriter, iter_chunks
+from incremental import add_arguments as add_incremental_arguments, file_signature, open_state
+from metrics import METRICS, add_arguments as add_metrics_arguments, instrument
+
+WINDOW = 1024    # lado (px) de las ventanas en que se agrupan los puntos antes de leer
+CHUNK = 100_000  # features por bloque al leer/escribir
+
+def to_pixel(transform, lons, lats):
+    """Coordenadas -> (fila, columna) fraccionarias de todos los puntos a la vez."""
+    cols, rows = ~transform * (np.asarray(lons, dtype=float), np.asarray(lats, dtype=float))
+    return rows, cols
+
+def mmap_sidecar(src, raster_path):
+    """
+    Copia (una sola vez) las bandas del raster a un .npy sin comprimir junto a él y lo abre
+    como memmap. Sirve para rasters comprimidos/teselados que se muestrean muchas veces.
+    """
+    path = Path(str(raster_path) + ".mmap.npy")
+    if not path.exists() or path.stat().st_mtime < Path(raster_path).stat().st_mtime:
+        print(f"[info] creando memmap {path}…")
+        out = np.lib.format.open_memmap(path.with_suffix(".tmp.npy"), mode="w+",
+                                        dtype=src.dtypes[0], shape=(src.count, src.height, src.width))
+        step = max(src.block_shapes[0][0], WINDOW)
+        for r0 in range(0, src.height, step):
+            h = min(step, src.height - r0)
+            out[:, r0:r0 + h, :] = src.read(window=Window(0, r0, src.width, h))
+        out.flush()
+        del out
+        path.with_suffix(".tmp.npy").replace(path)
+    return np.load(path, mmap_mode="r")
+
+def gather(src, bands, rows, cols, window=WINDOW, mm=None):
+    """
+    Valores (n, n_bandas) de los píxeles (rows, cols), ya dentro del raster.
+    Agrupa los píxeles por ventana alineada a los bloques del raster y lee cada ventana
+    una sola vez (solo el rectángulo que ocupan sus puntos); con `mm` indexa el memmap.
+    """
+    out = np.empty((len(rows), len(bands)), dtype=float)
+    if len(rows) == 0:
+        return out
+    if mm is not None:
+        for j, b in enumerate(bands):
+            out[:, j] = mm[b - 1][rows, cols]
+        return out
+
+    bh, bw = src.block_shapes[0]
+    wh = -(-max(window, bh) // bh) * bh
+    ww = -(-max(window, bw) // bw) * bw
+    win_id = (rows // wh) * (-(-src.width // ww)) + cols // ww
+
+    order = np.argsort(win_id, kind="stable")
+    bounds = np.flatnonzero(np.diff(win_id[order])) + 1
+    for idx in np.split(order, bounds):
+        r, c = rows[idx], cols[idx]
+        r0, c0 = int(r.min()), int(c.min())
+        win = Window(c0, r0, int(c.max()) - c0 + 1, int(r.max()) - r0 + 1)
+        data = src.read(bands, window=win)
+        out[idx] = data[:, r - r0, c - c0].T
+    return out
+
+def sample_raster(src, lons, lats, bands=(1,), bilinear=False, window=WINDOW, mm=None):
+    """
+    Muestrea todas las coordenadas de golpe. Devuelve (n, n_bandas) float con NaN donde el
+    punto cae fuera del raster o en nodata. Con `bilinear` interpola entre los 4 píxeles
+    vecinos, repartiendo el peso solo entre los que tienen dato.
+    """
+    bands = list(bands)
+    rows_f, cols_f = to_pixel(src.transform, lons, lats)
+    n = len(rows_f)
+    nodata = np.array([src.nodatavals[b - 1] for b in bands], dtype=float)
+
+    if bilinear:
+        y, x = rows_f - 0.5, cols_f - 0.5
+        r0, c0 = np.floor(y).astype(int), np.floor(x).astype(int)
+        wy, wx = y - r0, x - c0
+        rr = np.stack([r0, r0, r0 + 1, r0 + 1])
+        cc = np.stack([c0, c0 + 1, c0, c0 + 1])
+        ww = np.stack([(1 - wy) * (1 - wx), (1 - wy) * wx, wy * (1 - wx), wy * wx])
+        rr, cc = rr.clip(0, src.height - 1), cc.clip(0, src.width - 1)
+        inside = (rows_f >= 0) & (rows_f < src.height) & (cols_f >= 0) & (cols_f < src.width)
+    else:
+        rr = np.floor(rows_f).astype(int)[None]
+        cc = np.floor(cols_f).astype(int)[None]
+        ww = np.ones((1, n))
+        inside = (rr[0] >= 0) & (rr[0] < src.height) & (cc[0] >= 0) & (cc[0] < src.width)
+
+    k = rr.shape[0]
+    vals = np.full((k, n, len(bands)), np.nan)
+    sel = np.broadcast_to(inside, (k, n))
+    vals[sel] = gather(src, bands, rr[sel], cc[sel], window, mm)
+
+    bad = np.isnan(vals) | (vals == nodata)
+    w = np.where(bad, 0.0, ww[:, :, None])
+    wsum = w.sum(axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        res = (np.where(bad, 0.0, vals) * w).sum(axis=0) / wsum
+    res[wsum == 0] = np.nan
+    return res
+
+def enrich_features(src, feats, props_out, bands, bilinear=False, mm=None):
+    """Añade las propiedades muestreadas a una lista de features; devuelve cuántos tienen valor."""
+    # solo los puntos con coordenadas se muestrean; el resto se copia tal cual
+    idx, lons, lats = [], [], []
+    for i, f in enumerate(feats):
+        coords = (f.get("geometry") or {}).get("coordinates") or []
+        if len(coords) < 2:
+            continue
+        idx.append(i)
+        lons.append(float(coords[0]))
+        lats.append(float(coords[1]))
+
+    vals = sample_raster(src, lons, lats, bands, bilinear=bilinear, mm=mm)
+
+    METRICS.count("skip_no_coords", len(feats) - len(idx))
     added = 0
+    for i, row in zip(idx, vals):
+        f = feats[i]
+        props = f.get("properties") or {}
+        for name, v in zip(props_out, row):
+            props[name] = None if np.isnan(v) else float(v)
+        f["properties"] = props
+        if not np.isnan(row[0]):
+            added += 1
+    METRICS.count("nodata", len(idx) - added)
+    return added
+
+def enrich(src_geojson, raster_path, dst_geojson, prop_name="bathy_m", bands=None,
+           bilinear=False, use_mmap=False, chunk=CHUNK, state=None):
+    """Con `state` (IncrementalState) solo se muestrean los features que no estaban ya en él."""
+    props_out = [prop_name] if isinstance(prop_name, str) else list(prop_name)
+    bands = list(bands) if bands else list(range(1, len(props_out) + 1))
+    if len(bands) != len(props_out):
+        raise ValueError(f"{len(bands)} bandas para {len(props_out)} propiedades")
+
+    total = added = 0
+    with rasterio.open(raster_path) as src, FeatureReader(src_geojson) as reader, \
+            FeatureWriter(dst_geojson, reader.meta) as writer:
+        mm = mmap_sidecar(src, raster_path) if use_mmap else None
+        # por bloques: memoria acotada y salida progresiva
+        for feats in METRICS.timed(iter_chunks(reader, chunk), "load"):
+            todo = state.split(feats) if state else feats
+            with METRICS.timer("lookup"):
+                n = enrich_features(src, todo, props_out, bands, bilinear, mm)
+            with METRICS.timer("serialize"):
+                writer.write_many(feats)
+            if state:
+                state.record(todo)
+                state.checkpoint()
+                n = sum((f.get("properties") or {}).get(props_out[0]) is not None for f in feats)
+            added += n
+            total += len(feats)
+            METRICS.progress(total, bathy=added)
 
-    with rasterio.open(raster_path) as src:
-        for f in feats:
-            geom = f.get("geometry") or {}
-            coords = geom.get("coordinates") or []
-            if len(coords) < 2:
-                out.append(f); continue
-            lon, lat = float(coords[0]), float(coords[1])
-
-            vals = list(src.sample([(lon, lat)]))
-            v = None
-            if vals and vals[0] is not None:
-                v = float(vals[0][0])
-
-            props = f.get("properties") or {}
-            props[prop_name] = v
-            f["properties"] = props
-            out.append(f)
-            if v is not None:
-                added += 1
-
-    gj["features"] = out
-    json.dump(gj, open(dst_geojson, "w"), ensure_ascii=False)
-    print(f"[ok] Guardado: {dst_geojson}  (+{prop_name} en {added}/{len(out)} puntos)")
+    print(f"[ok] Guardado: {dst_geojson}  (+{','.join(props_out)} en {added}/{total} puntos)")
+    if state:
+        print(f"[info] incremental: {state.summary()}")
 
 def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("--src", required=True, help="GeoJSON de entrada")
     ap.add_argument("--raster", default="data/env/gebco_bathymetry.tif")
     ap.add_argument("--dst", required=True, help="GeoJSON de salida")
-    ap.add_argument("--prop", default="bathy_m")
+    ap.add_argument("--prop", nargs="+", default=["bathy_m"], help="una propiedad por banda")
+    ap.add_argument("--bands", type=int, nargs="+", default=None, help="bandas a muestrear (1..N)")
+    ap.add_argument("--bilinear", action="store_true", help="interpolación bilineal en vez de vecino")
+    ap.add_argument("--mmap", action="store_true",
+                    help="usar (y crear la 1ª vez) una copia .npy memory-mapped del raster")
+    ap.add_argument("--chunk", type=int, default=CHUNK, help="features por bloque")
+    add_incremental_arguments(ap)
+    add_metrics_arguments(ap)
     args = ap.parse_args()
-    enrich(args.src, args.raster, args.dst, args.prop)
+    with instrument(args, "enrich_bathymetry"):
+        config = {"raster": file_signature(args.raster), "props": args.prop, "bands": args.bands,
+                  "bilinear": args.bilinear}
+        state = open_state(args, args.dst, config, args.prop)
+        try:
+            enrich(args.src, args.raster, args.dst, args.prop, args.bands, args.bilinear, args.mmap,
+                   args.chunk, state)
+        finally:
+            if state:
+                state.close()
 
 if __name__ == "__main__":
     main()
@@ -1,14 +1,28 @@
 # scripts/enrich_distance_to_coast.py
-import json
+import time
 import argparse
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
 
-from shapely.geometry import shape, Point, LineString
+import numpy as np
+import shapely
+from shapely.geometry import shape, LineString
 from shapely.strtree import STRtree
-from shapely.ops import nearest_points
 from pyproj import Geod
 
+from feature_io import FeatureReader, FeatureWriter, iter_chunks, iter_features
+from incremental import add_arguments as add_incremental_arguments, file_signature, open_state
+from metrics import METRICS, add_arguments as add_metrics_arguments, instrument
+
 GEOD = Geod(ellps="WGS84")
+K_NEAREST = 8        # segmentos candidatos por punto
+MAX_LAT_DEG = 89.0   # tope para cos(lat) al ampliar la caja de búsqueda
+KM_PER_DEG = 110.5   # km por grado de latitud (por debajo del mínimo del elipsoide, 110.57)
+BOX_MARGIN = 0.01    # holgura relativa de la caja de búsqueda
+FAR_DEG = 2.0        # puntos con caja más ancha que esto (en longitud) van en grupos pequeños
+FAR_PART = 2_000     # puntos por grupo lejos de la costa
+PART = 50_000        # puntos por tarea (y por lote en un solo proceso)
+CHUNK = 500_000      # features por bloque al leer/escribir
 
 def _as_linestring(g):
     if g is None or g.is_empty:
@@ -20,11 +34,8 @@ def _as_linestring(g):
     return None
 
 def load_coast_segments(land_path: Path):
-    with open(land_path, "r", encoding="utf-8") as f:
-        gj = json.load(f)
-
     segments = []
-    for feat in gj.get("features", []):
+    for feat in iter_features(land_path):
         geom = shape(feat.get("geometry"))
 
         if geom.geom_type == "Polygon":
@@ -50,71 +61,207 @@ def load_coast_segments(land_path: Path):
 
     return [s for s in segments if s is not None and not s.is_empty]
 
-def geodesic_km(lon1, lat1, lon2, lat2) -> float:
-    _, _, dist_m = GEOD.inv(lon1, lat1, lon2, lat2)
-    return dist_m / 1000.0
+def explode_segments(lines):
+    """Parte las líneas de costa en segmentos de 2 vértices: arrays (m,2) de extremos A y B."""
+    coords, owner = shapely.get_coordinates(lines, return_index=True)
+    same = owner[1:] == owner[:-1]
+    return coords[:-1][same], coords[1:][same]
 
-def enrich_dist(src: Path, dst: Path, land_path: Path):
-    print("[load] land…", land_path)
-    segments = load_coast_segments(land_path)
-    print(f"[info] segmentos de costa cargados: {len(segments)}")
-    tree = STRtree(segments)
+def build_index(land_path: Path):
+    """(STRtree de segmentos, extremos A, extremos B) para las consultas en bloque."""
+    a, b = explode_segments(load_coast_segments(land_path))
+    tree = STRtree(shapely.linestrings(np.stack([a, b], axis=1)))
+    return tree, a, b
 
-    print("[load] points…", src)
-    with open(src, "r", encoding="utf-8") as f:
-        gj = json.load(f)
+def _project(lons, lats, seg_a, seg_b, si):
+    """Punto más cercano de cada segmento `si` a (lons, lats), en la métrica equirectangular local."""
+    c = np.cos(np.radians(lats))
+    ax, ay = seg_a[si, 0], seg_a[si, 1]
+    dx, dy = (seg_b[si, 0] - ax) * c, seg_b[si, 1] - ay
+    px, py = (lons - ax) * c, lats - ay
+    den = dx * dx + dy * dy
+    t = np.clip(np.divide(px * dx + py * dy, den, out=np.zeros_like(den), where=den > 0), 0, 1)
+    return ax + t * (seg_b[si, 0] - ax), ay + t * (seg_b[si, 1] - ay), np.hypot(px - t * dx, py - t * dy)
 
-    feats = gj.get("features", [])
-    out = []
-    added = 0
+def nearest_coast_km(lons, lats, index, k=K_NEAREST):
+    """
+    Distancia geodésica (km) de cada punto al segmento de costa más cercano, en bloque.
+    1) query_nearest da el segmento más cercano en grados planos y Geod.inv la distancia D
+       hasta él: cota superior de la distancia buscada;
+    2) cualquier segmento más cercano corta la caja de ±D en latitud y ±D/cos(lat) en longitud
+       (en grados); se buscan los que la cortan y se quedan los k más cercanos en la métrica
+       equirectangular local;
+    3) se proyecta el punto sobre cada candidato y se elige el mínimo con Geod.inv en array.
+    Lejos de la costa la caja abarca muchos segmentos, así que esos puntos van en grupos de
+    FAR_PART para acotar la memoria de los pares (punto, candidato).
+    """
+    tree, seg_a, seg_b = index
+    lons = np.asarray(lons, dtype=float)
+    lats = np.asarray(lats, dtype=float)
+    out = np.full(len(lons), np.nan)
+    if not len(lons):
+        return out
 
-    for i, f in enumerate(feats, 1):
-        geom = f.get("geometry") or {}
-        coords = geom.get("coordinates") or []
-        if len(coords) < 2:
-            out.append(f); continue
+    (pi, si), _ = tree.query_nearest(shapely.points(lons, lats), return_distance=True, all_matches=False)
+    qx, qy, _ = _project(lons[pi], lats[pi], seg_a, seg_b, si)
+    _, _, dist_m = GEOD.inv(lons[pi], lats[pi], qx, qy)
+    np.fmin.at(out, pi, dist_m / 1000.0)
 
-        lon, lat = float(coords[0]), float(coords[1])
-        pt = Point(lon, lat)
+    dlat = out / KM_PER_DEG * (1 + BOX_MARGIN)
+    dlon = np.minimum(dlat / np.cos(np.radians(np.minimum(np.abs(lats) + dlat, MAX_LAT_DEG))), 180.0)
+    boxes = shapely.box(lons - dlon, lats - dlat, lons + dlon, lats + dlat)
+    far = np.flatnonzero(dlon > FAR_DEG)
+    near = np.flatnonzero(dlon <= FAR_DEG)
+    groups = [near] + [far[i:i + FAR_PART] for i in range(0, len(far), FAR_PART)]
+    for group in groups:
+        if len(group):
+            _refine(out, group, lons, lats, boxes, index, k)
+    return out
 
-        # --- aquí puede devolver índice o geometría ---
-        candidate = tree.nearest(pt)
-        try:
-            # si ya es geometría tendrá .is_empty
-            _ = candidate.is_empty  # no usamos, solo comprobación de tipo
-            cand_geom = candidate
-        except Exception:
-            # si es índice (numpy.int64), recupera la geometría real
-            cand_geom = tree.geometries[int(candidate)]
+def _refine(out, group, lons, lats, boxes, index, k):
+    """Mínimo geodésico sobre los k mejores segmentos que cortan la caja de cada punto de `group`."""
+    tree, seg_a, seg_b = index
+    gi, si = tree.query(boxes[group], predicate="intersects")
+    pi = group[gi]
+    qx, qy, local = _project(lons[pi], lats[pi], seg_a, seg_b, si)
+
+    # k mejores candidatos por punto
+    order = np.lexsort((local, pi))
+    pi, qx, qy = pi[order], qx[order], qy[order]
+    first = np.r_[0, np.flatnonzero(np.diff(pi)) + 1]
+    rank = np.arange(len(pi)) - np.repeat(first, np.diff(np.r_[first, len(pi)]))
+    keep = rank < k
+    pi, qx, qy = pi[keep], qx[keep], qy[keep]
+
+    _, _, dist_m = GEOD.inv(lons[pi], lats[pi], qx, qy)
+    np.fmin.at(out, pi, dist_m / 1000.0)
+
+_INDEX = None
+
+def _init_worker(land_path: Path):
+    global _INDEX
+    _INDEX = build_index(land_path)
 
-        if cand_geom is None or cand_geom.is_empty:
-            out.append(f); continue
+def _worker(args):
+    lons, lats, k = args
+    return nearest_coast_km(lons, lats, _INDEX, k)
 
-        coast_pt, _ = nearest_points(cand_geom, pt)
-        d_km = geodesic_km(lon, lat, coast_pt.x, coast_pt.y)
+class CoastDistance:
+    """
+    Calculadora reutilizable: construye el índice una vez (o un pool de procesos, cada uno
+    con su índice) y devuelve distancias en km para arrays de lon/lat.
+    """
 
+    def __init__(self, land_path: Path, workers: int = 1, k: int = K_NEAREST, part: int = PART):
+        self.k, self.part = k, part
+        self.pool = None
+        if workers > 1:
+            self.pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                            initargs=(land_path,))
+        else:
+            self.index = build_index(land_path)
+
+    def __call__(self, lons, lats):
+        lons = np.asarray(lons, dtype=float)
+        lats = np.asarray(lats, dtype=float)
+        parts = [(lons[i:i + self.part], lats[i:i + self.part], self.k)
+                 for i in range(0, len(lons), self.part)]
+        if not parts:
+            return np.empty(0)
+        if self.pool is None:
+            return np.concatenate([nearest_coast_km(lo, la, self.index, k) for lo, la, k in parts])
+        return np.concatenate(list(self.pool.map(_worker, parts)))
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+
+def enrich_features(feats, dist_fn) -> int:
+    """Añade dist_coast_km a una lista de features; devuelve cuántos lo recibieron."""
+    idx, lons, lats = [], [], []
+    for i, f in enumerate(feats):
+        coords = (f.get("geometry") or {}).get("coordinates") or []
+        if len(coords) < 2:
+            continue
+        idx.append(i)
+        lons.append(float(coords[0]))
+        lats.append(float(coords[1]))
+
+    METRICS.count("skip_no_coords", len(feats) - len(idx))
+    added = 0
+    for i, d_km in zip(idx, dist_fn(lons, lats)):
+        if np.isnan(d_km):
+            continue
+        f = feats[i]
         props = dict(f.get("properties") or {})
-        props["dist_coast_km"] = round(d_km, 3)
+        props["dist_coast_km"] = round(float(d_km), 3)
         f["properties"] = props
-        out.append(f)
         added += 1
+    METRICS.count("dist_none", len(idx) - added)
+    return added
 
-        if i % 200 == 0:
-            print(f"[info] {i} procesados… (+dist={added})")
+def enrich_dist(src: Path, dst: Path, land_path: Path, workers: int = 1, k: int = K_NEAREST,
+                chunk: int = CHUNK, state=None):
+    """
+    Con `state` (IncrementalState) solo se calculan los features que no estaban ya en él, y el
+    índice de costa no se construye si no queda ninguno.
+    """
+    dist_fn = None
 
-    gj["features"] = out
-    dst.parent.mkdir(parents=True, exist_ok=True)
-    with open(dst, "w", encoding="utf-8") as f:
-        json.dump(gj, f, ensure_ascii=False)
-    print(f"[ok] Guardado: {dst}  (features: {len(out)} ; con dist={added})")
+    def coast():
+        nonlocal dist_fn
+        if dist_fn is None:
+            print(f"[load] costa: {land_path}  (workers={workers}, k={k})")
+            with METRICS.timer("index"):
+                dist_fn = CoastDistance(land_path, workers, k)
+        return dist_fn
+
+    print("[load] points…", src)
+    t0 = time.monotonic()
+    total = added = 0
+    try:
+        with FeatureReader(src) as reader, FeatureWriter(dst, reader.meta) as writer:
+            for feats in METRICS.timed(iter_chunks(reader, chunk), "load"):
+                todo = state.split(feats) if state else feats
+                n = 0
+                if todo:
+                    with METRICS.timer("lookup"):
+                        n = enrich_features(todo, coast())
+                with METRICS.timer("serialize"):
+                    writer.write_many(feats)
+                if state:
+                    state.record(todo)
+                    state.checkpoint()
+                    n = sum((f.get("properties") or {}).get("dist_coast_km") is not None for f in feats)
+                added += n
+                total += len(feats)
+                METRICS.progress(total, dist=added)
+    finally:
+        if dist_fn is not None:
+            dist_fn.close()
+    print(f"[ok] Guardado: {dst}  (features: {total} ; con dist={added}) en {time.monotonic() - t0:.2f}s")
+    if state:
+        print(f"[info] incremental: {state.summary()}")
 
 def main():
     ap = argparse.ArgumentParser(description="Añade dist_coast_km a un GeoJSON de puntos")
     ap.add_argument("--src", type=Path, required=True)
     ap.add_argument("--dst", type=Path, required=True)
     ap.add_argument("--land", type=Path, default=Path("public/data/land.geojson"))
+    ap.add_argument("--workers", type=int, default=1, help="procesos para repartir los puntos")
+    ap.add_argument("--k", type=int, default=K_NEAREST,
+                    help="segmentos candidatos por punto para el mínimo geodésico")
+    ap.add_argument("--chunk", type=int, default=CHUNK, help="features por bloque")
+    add_incremental_arguments(ap)
+    add_metrics_arguments(ap)
     args = ap.parse_args()
-    enrich_dist(args.src, args.dst, args.land)
+    with instrument(args, "enrich_distance_to_coast"):
+        state = open_state(args, args.dst, {"land": file_signature(args.land), "k": args.k}, ["dist_coast_km"])
+        try:
+            enrich_dist(args.src, args.dst, args.land, args.workers, args.k, args.chunk, state)
+        finally:
+            if state:
+                state.close()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
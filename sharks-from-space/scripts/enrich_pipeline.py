@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+# scripts/enrich_pipeline.py
+# Enriquecimiento en una sola pasada: los puntos se leen una vez a una tabla en columnas
+# (lon / lat / fecha + propiedades originales) y cada etapa (SST, batimetría, distancia
+# a costa) añade columnas calculadas sobre arrays completos. Al final se escribe un único
+# fichero: Parquet (.parquet) o GeoJSON (.geojson / .ndjson).
+#
+#   python scripts/enrich_pipeline.py --src public/data/background_raw_with_dates.geojson \
+#       --dst public/data/background_enriched.parquet --stages sst bathy dist --mmap
+#
+# Sustituye a encadenar enrich_sst_real -> enrich_bathymetry -> enrich_distance_to_coast,
+# que reescribían (y volvían a parsear) el GeoJSON completo en cada paso.
+import time, argparse, rasterio
+from itertools import islice
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import enrich_sst_real as sst
+from erddap_client import ERDDAP_BASE
+from enrich_bathymetry import sample_raster, mmap_sidecar
+from enrich_distance_to_coast import CoastDistance, K_NEAREST
+from feature_io import FeatureReader, FeatureWriter, is_ndjson
+from metrics import METRICS, add_arguments as add_metrics_arguments, instrument
+
+STAGES = ("sst", "bathy", "dist")
+
+
+class PointTable:
+    """
+    Tabla de puntos en columnas. `lon`, `lat` (NaN sin coordenadas) y `date` (ISO o None)
+    son arrays; `props` guarda las propiedades originales de cada feature sin tocar y
+    `cols` las columnas que van añadiendo las etapas.
+    """
+
+    def __init__(self, lon, lat, date, props, meta=None):
+        self.lon = np.asarray(lon, dtype=float)
+        self.lat = np.asarray(lat, dtype=float)
+        self.date = np.asarray(date, dtype=object)
+        self.props = props
+        self.meta = meta or {}
+        self.cols = {}
+
+    @classmethod
+    def read(cls, path, limit: int | None = None):
+        lon, lat, date, props = [], [], [], []
+        with FeatureReader(path) as reader:
+            for f in islice(reader, limit or None):
+                coords = (f.get("geometry") or {}).get("coordinates") or []
+                p = f.get("properties") or {}
+                ok = len(coords) >= 2
+                lon.append(float(coords[0]) if ok else np.nan)
+                lat.append(float(coords[1]) if ok else np.nan)
+                date.append(sst.first_date(p))
+                props.append(p)
+            meta = reader.meta
+        return cls(lon, lat, date, props, meta)
+
+    def __len__(self):
+        return len(self.lon)
+
+    @property
+    def has_coords(self) -> np.ndarray:
+        return ~(np.isnan(self.lon) | np.isnan(self.lat))
+
+    def add(self, name: str, values, where=None):
+        """Añade (o completa) una columna; `where` limita a qué filas corresponden los valores."""
+        col = self.cols.setdefault(name, np.full(len(self), np.nan))
+        if where is None:
+            col[:] = values
+        else:
+            col[where] = values
+
+    def count(self, name: str) -> int:
+        return int(np.count_nonzero(~np.isnan(self.cols[name])))
+
+    # --- salida ---
+    def to_frame(self) -> pd.DataFrame:
+        df = pd.DataFrame.from_records(self.props, index=pd.RangeIndex(len(self)))
+        # lon/lat son las de la geometría; propiedades con ese nombre se conservan como prop_lon/prop_lat
+        clash = [c for c in ("lon", "lat") if c in df.columns]
+        if clash:
+            print(f"[warn] propiedades {', '.join(clash)} renombradas a {', '.join('prop_' + c for c in clash)}")
+            df = df.rename(columns={c: f"prop_{c}" for c in clash})
+        for name, col in self.cols.items():
+            df[name] = col
+        df.insert(0, "lat", self.lat)
+        df.insert(0, "lon", self.lon)
+        return df
+
+    def iter_features(self):
+        for i, p in enumerate(self.props):
+            props = dict(p)
+            for name, col in self.cols.items():
+                v = col[i]
+                props[name] = None if np.isnan(v) else float(v)
+            geom = None
+            if not (np.isnan(self.lon[i]) or np.isnan(self.lat[i])):
+                geom = {"type": "Point", "coordinates": [float(self.lon[i]), float(self.lat[i])]}
+            yield {"type": "Feature", "geometry": geom, "properties": props}
+
+    def write(self, path):
+        path = Path(path)
+        if path.suffix.lower() == ".parquet":
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_name(path.name + ".tmp")
+            self.to_frame().to_parquet(tmp, index=False)
+            tmp.replace(path)
+        elif path.suffix.lower() == ".geojson" or is_ndjson(path):
+            with FeatureWriter(path, self.meta) as w:
+                w.write_many(self.iter_features())
+        else:
+            raise ValueError(f"formato de salida no soportado: {path.suffix} (.parquet, .geojson, .ndjson)")
+
+
+# --------- Etapas: tabla -> columnas ----------
+class SstStage:
+    """
+    sst_c (°C) en modo batch: una caja ERDDAP por fecha (o mes) con caché SQLite compartida,
+    o con `local` los granulos NetCDF de esa carpeta, todos los puntos de cada fecha de una vez.
+    """
+
+    def __init__(self, erddap=ERDDAP_BASE, workers=8, throttle=0.2, max_cells=sst.MAX_GRID_CELLS,
+                 cache_max=None, local=None, interp="nearest"):
+        self.max_cells = max_cells
+        sst.setup(erddap, workers, throttle, cache_max, local, interp)
+
+    def queryable(self, t: PointTable) -> np.ndarray:
+        """Mismas reglas que point_for_feature: coordenadas válidas y fecha dentro de la cobertura."""
+        lon, lat = t.lon, t.lat
+        with np.errstate(invalid="ignore"):
+            ok = (np.abs(lat) <= 90) & (np.abs(lon) <= 180) & ~((lat == 0) & (lon == 0))
+        start = pd.Timestamp(sst.COVERAGE_START)
+        dates = pd.to_datetime(pd.Series(t.date), format="%Y-%m-%d", errors="coerce")
+        return ok & (dates >= start).to_numpy()
+
+    def __call__(self, t: PointTable):
+        idx = np.flatnonzero(self.queryable(t))
+        if sst.LOCAL is not None:
+            t.add("sst_c", sst.LOCAL.sample_many(t.date[idx], t.lat[idx], t.lon[idx]), where=idx)
+            print(f"[info] SST local: {sst.LOCAL.summary()}")
+            return
+        points = [(t.lat[i], t.lon[i], t.date[i]) for i in idx]
+        sst.prefetch_batched(points, self.max_cells)
+        sst.save_cache(sst.SST_CACHE)
+        vals = [sst.SST_CACHE.get(sst.cache_key(*p)) for p in points]
+        t.add("sst_c", [np.nan if v is None else v for v in vals], where=idx)
+        print(f"[info] ERDDAP: {sst.CLIENT.summary()} · caché SST: {sst.SST_CACHE.stats()}")
+
+    def close(self):
+        sst.SST_CACHE.close()
+        if sst.LOCAL is not None:
+            sst.LOCAL.close()
+
+
+class BathyStage:
+    """Una columna por banda del raster (por defecto bathy_m), muestreadas de una vez."""
+
+    def __init__(self, raster, props=("bathy_m",), bands=None, bilinear=False, use_mmap=False):
+        self.props = list(props)
+        self.bands = list(bands) if bands else list(range(1, len(self.props) + 1))
+        if len(self.bands) != len(self.props):
+            raise ValueError(f"{len(self.bands)} bandas para {len(self.props)} propiedades")
+        self.bilinear = bilinear
+        self.src = rasterio.open(raster)
+        self.mm = mmap_sidecar(self.src, raster) if use_mmap else None
+
+    def __call__(self, t: PointTable):
+        idx = np.flatnonzero(t.has_coords)
+        vals = sample_raster(self.src, t.lon[idx], t.lat[idx], self.bands, self.bilinear, mm=self.mm)
+        for j, name in enumerate(self.props):
+            t.add(name, vals[:, j], where=idx)
+
+    def close(self):
+        self.src.close()
+
+
+class DistStage:
+    """dist_coast_km: distancia geodésica a la costa, todos los puntos en un solo bloque."""
+
+    def __init__(self, land, workers=1, k=K_NEAREST):
+        print(f"[load] costa: {land}  (workers={workers}, k={k})")
+        self.dist_fn = CoastDistance(land, workers, k)
+
+    def __call__(self, t: PointTable):
+        idx = np.flatnonzero(t.has_coords)
+        t.add("dist_coast_km", np.round(self.dist_fn(t.lon[idx], t.lat[idx]), 3), where=idx)
+
+    def close(self):
+        self.dist_fn.close()
+
+
+def build_stages(args) -> list:
+    stages = []
+    for name in args.stages:
+        if name == "sst":
+            stages.append((name, SstStage(args.erddap, args.workers, args.throttle, args.max_cells,
+                                          args.cache_max, args.sst_local, args.sst_interp)))
+        elif name == "bathy":
+            stages.append((name, BathyStage(args.raster, args.bathy_prop, args.bands, args.bilinear,
+                                            args.mmap)))
+        elif name == "dist":
+            stages.append((name, DistStage(args.land, args.dist_workers, args.k)))
+    return stages
+
+
+def run(src: Path, dst: Path, stages: list, limit: int | None = None):
+    t0 = time.monotonic()
+    with METRICS.timer("load"):
+        table = PointTable.read(src, limit)
+    METRICS.count("skip_no_coords", int((~table.has_coords).sum()))
+    print(f"[load] {src}: {len(table)} puntos ({int(table.has_coords.sum())} con coordenadas)"
+          f" en {time.monotonic() - t0:.2f}s")
+
+    for name, stage in stages:
+        t1 = time.monotonic()
+        before = set(table.cols)
+        with METRICS.timer(name):
+            stage(table)
+        new = [c for c in table.cols if c not in before]
+        for c in new:
+            METRICS.count(f"{c}_none", len(table) - table.count(c))
+        added = ", ".join(f"{c}={table.count(c)}" for c in new)
+        print(f"[ok] etapa {name}: {added}  ({time.monotonic() - t1:.2f}s)")
+
+    t1 = time.monotonic()
+    with METRICS.timer("serialize"):
+        table.write(dst)
+    print(f"[ok] Guardado: {dst}  ({len(table)} puntos, escritura {time.monotonic() - t1:.2f}s,"
+          f" total {time.monotonic() - t0:.2f}s)")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Enriquece puntos (SST, batimetría, distancia a costa) en una pasada")
+    ap.add_argument("--src", type=Path, required=True, help="GeoJSON / NDJSON de entrada")
+    ap.add_argument("--dst", type=Path, required=True, help="salida .parquet, .geojson o .ndjson")
+    ap.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES),
+                    help="etapas a aplicar, en orden")
+    ap.add_argument("--limit", type=int, default=None, help="procesar solo N puntos (prueba)")
+    # SST
+    ap.add_argument("--erddap", default=ERDDAP_BASE, help="URL base griddap")
+    ap.add_argument("--workers", type=int, default=8, help="peticiones simultáneas a ERDDAP")
+    ap.add_argument("--throttle", type=float, default=0.2,
+                    help="intervalo medio mínimo entre peticiones (s); 0 = sin límite de ritmo")
+    ap.add_argument("--max-cells", type=int, default=sst.MAX_GRID_CELLS,
+                    help="máximo de celdas por caja ERDDAP (si se supera se usa stride)")
+    ap.add_argument("--cache-max", type=int, default=None, help="máximo de entradas en la caché SST")
+    ap.add_argument("--sst-local", type=Path, default=None,
+                    help="carpeta con granulos NetCDF de MUR/GHRSST; sustituye a ERDDAP")
+    ap.add_argument("--sst-interp", choices=sst.INTERP_METHODS, default="nearest",
+                    help="interpolación con --sst-local")
+    # batimetría
+    ap.add_argument("--raster", default="data/env/gebco_bathymetry.tif")
+    ap.add_argument("--bathy-prop", nargs="+", default=["bathy_m"], help="una propiedad por banda")
+    ap.add_argument("--bands", type=int, nargs="+", default=None, help="bandas a muestrear (1..N)")
+    ap.add_argument("--bilinear", action="store_true", help="interpolación bilineal en vez de vecino")
+    ap.add_argument("--mmap", action="store_true", help="usar una copia .npy memory-mapped del raster")
+    # distancia a costa
+    ap.add_argument("--land", type=Path, default=Path("public/data/land.geojson"))
+    ap.add_argument("--dist-workers", type=int, default=1, help="procesos para la distancia a costa")
+    ap.add_argument("--k", type=int, default=K_NEAREST, help="segmentos candidatos por punto")
+    add_metrics_arguments(ap)
+    args = ap.parse_args()
+
+    print(f"[run] src={args.src} -> dst={args.dst}  stages={' '.join(args.stages)}")
+    with instrument(args, "enrich_pipeline"):
+        with METRICS.timer("setup"):
+            stages = build_stages(args)
+        try:
+            run(args.src, args.dst, stages, args.limit)
+        finally:
+            for _, stage in stages:
+                stage.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,38 +1,51 @@
 # scripts/enrich_sst_real.py
-import json, time, io, argparse, datetime
+import time, io, argparse, datetime, hashlib, math, sqlite3
+from itertools import islice
 from pathlib import Path
 
-import requests
+import numpy as np
 import pandas as pd
 
+from erddap_client import ErddapClient, ERDDAP_BASE
+from sst_cache import SstCache
+from sst_local import LocalSst, METHODS as INTERP_METHODS
+from feature_io import FeatureReader, FeatureWriter, iter_chunks, iter_features
+from incremental import add_arguments as add_incremental_arguments, open_state
+from metrics import METRICS, add_arguments as add_metrics_arguments, instrument
+
 # --------- Paths por defecto ----------
 DEFAULT_SRC = Path("public/data/sphyrna_points.geojson")
 DEFAULT_DST = Path("public/data/sphyrna_points_enriched.geojson")
-CACHE_PATH = Path(".cache_sst.json")
+CACHE_PATH = Path(".cache_sst.sqlite")
+LEGACY_CACHE_PATH = Path(".cache_sst.json")
 
 # --------- ERDDAP (MUR SST diario, longitudes 0–360) ----------
-ERDDAP_BASE = "https://coastwatch.pfeg.noaa.gov/erddap/griddap"
 DATASET = "jplMURSST41mday_Lon0360"  # MUR daily, lon en [0,360]
 COVERAGE_START = datetime.date(2002, 6, 1)
+GRID_RES_DEG = 0.01          # resolución nativa MUR (0.01°)
+MAX_GRID_CELLS = 250_000     # tope de celdas por petición en modo batch (se aplica stride)
+CHUNK = 5_000                # features por bloque al leer/escribir
 
-session = requests.Session()
-session.headers.update({"User-Agent": "sphyrna-sst-enricher/1.0"})
+CLIENT = None     # ErddapClient compartido, se crea en setup()
+SST_CACHE = None  # SstCache compartida, se abre en setup()
+LOCAL = None      # LocalSst si se usan granulos NetCDF locales en vez de ERDDAP (setup(local=...))
 
 
 # --- util de caché ---
-def load_cache():
-    if CACHE_PATH.exists():
-        try:
-            return json.load(open(CACHE_PATH, "r"))
-        except Exception:
-            return {}
-    return {}
-
-def save_cache(cache):
+def load_cache(max_entries: int | None = None) -> SstCache:
+    """Abre la caché SQLite compartida; la primera vez importa la antigua .cache_sst.json."""
+    cache = SstCache(CACHE_PATH, max_entries=max_entries)
+    n = cache.migrate_json(LEGACY_CACHE_PATH)
+    if n:
+        print(f"[info] caché: migradas {n} entradas desde {LEGACY_CACHE_PATH}")
+    return cache
+
+def save_cache(cache: SstCache):
     try:
-        json.dump(cache, open(CACHE_PATH, "w"))
-    except Exception:
-        pass
+        cache.flush()
+    except sqlite3.Error as e:
+        # las escrituras siguen pendientes en memoria; se reintenta en el próximo volcado
+        print(f"[warn] no se pudo guardar la caché SST: {e}")
 
 
 def _to_0360(lon_deg: float) -> float:
@@ -40,48 +53,108 @@ def _to_0360(lon_deg: float) -> float:
     return (lon_deg % 360 + 360) % 360
 
 
-def fetch_sst_point(lat: float, lon_deg: float, date_iso: str, retries=3, timeout=25):
-    """
-    Devuelve SST (°C) para (lat, lon, fecha YYYY-MM-DD) usando ERDDAP CSV.
-    Usa caché en disco para evitar peticiones repetidas.
-    """
+def sst_point_url(lat: float, lon_deg: float, date_iso: str) -> str:
+    """URL ERDDAP CSV para la SST de un punto (lat, lon, fecha YYYY-MM-DD)."""
     lon = _to_0360(lon_deg)
-    key = f"{date_iso}|{round(lat,2)}|{round(lon,2)}"
+    query = f"sst[({date_iso}):1:({date_iso})][({lat}):1:({lat})][({lon}):1:({lon})]"
+    return CLIENT.griddap_url(DATASET, query)
 
-    if key in SST_CACHE:
-        return SST_CACHE[key]
 
-    query = f"sst[({date_iso}):1:({date_iso})][({lat}):1:({lat})][({lon}):1:({lon})]"
-    url = f"{ERDDAP_BASE}/{DATASET}.csv?{query}"
+def parse_sst_point(text: str | None) -> float | None:
+    """SST (°C) de una respuesta CSV de un solo punto; None si no hay dato."""
+    if text is None:
+        return None
+    try:
+        df = pd.read_csv(io.StringIO(text))
+    except Exception:
+        return None
+    if "sst" not in df.columns:
+        return None
+
+    sst_num = pd.to_numeric(df["sst"], errors="coerce").dropna()
+    if sst_num.empty:
+        return None
+    return float(sst_num.iloc[0])
 
-    last_err = None
-    for _ in range(retries):
-        try:
-            r = session.get(url, timeout=timeout)
-            r.raise_for_status()
 
-            df = pd.read_csv(io.StringIO(r.text))
-            if "sst" not in df.columns:
-                SST_CACHE[key] = None
-                return None
+def _is_monthly(dataset: str) -> bool:
+    """Los productos 'mday' tienen un único paso temporal por mes."""
+    return "mday" in dataset
 
-            sst_num = pd.to_numeric(df["sst"], errors="coerce")
-            df = df[sst_num.notna()]
-            if df.empty:
-                SST_CACHE[key] = None
-                return None
 
-            val = float(df["sst"].iloc[0])
-            SST_CACHE[key] = val
-            return val
+def batch_key(date_iso: str) -> str:
+    """Clave de agrupación: el día, o el mes para productos mensuales."""
+    return date_iso[:7] if _is_monthly(DATASET) else date_iso
 
-        except Exception as e:
-            last_err = e
-            time.sleep(1.2)
 
-    print(f"[warn] SST fallo en {lat:.4f},{lon_deg:.4f} {date_iso}: {last_err}")
-    SST_CACHE[key] = None
-    return None
+def batch_time(key: str) -> str:
+    """Fecha a pedir para un grupo (mitad de mes en productos mensuales, ERDDAP ajusta al más cercano)."""
+    return f"{key}-15" if len(key) == 7 else key
+
+
+def lon_ranges(lons0360) -> list[tuple[float, float]]:
+    """
+    Rangos de longitud (0–360) que cubren los puntos con la menor anchura.
+    Si el hueco más grande entre puntos no es el del meridiano 0, el grupo cruza
+    la costura 360→0 y se divide en dos cajas en vez de pedir casi todo el globo.
+    """
+    v = np.sort(np.asarray(lons0360, dtype=float))
+    if len(v) < 2:
+        return [(float(v[0]), float(v[-1]))]
+    gaps = np.diff(v)
+    k = int(np.argmax(gaps))
+    wrap_gap = v[0] + 360 - v[-1]
+    if wrap_gap >= gaps[k]:
+        return [(float(v[0]), float(v[-1]))]
+    return [(float(v[k + 1]), float(v[-1])), (float(v[0]), float(v[k]))]
+
+
+def grid_stride(lat0: float, lat1: float, lon0: float, lon1: float, max_cells: int) -> int:
+    """Stride mínimo para que la caja no supere max_cells celdas."""
+    n_lat = (lat1 - lat0) / GRID_RES_DEG + 1
+    n_lon = (lon1 - lon0) / GRID_RES_DEG + 1
+    return max(1, math.ceil(math.sqrt(n_lat * n_lon / max(1, max_cells))))
+
+
+def _nearest_index(axis: np.ndarray, values: np.ndarray) -> np.ndarray:
+    """Índice del valor más cercano de un eje ordenado, para todos los valores a la vez."""
+    if len(axis) == 1:
+        return np.zeros(len(values), dtype=int)
+    idx = np.searchsorted(axis, values).clip(1, len(axis) - 1)
+    idx -= (values - axis[idx - 1]) < (axis[idx] - values)
+    return idx
+
+
+def sst_grid_url(date_iso: str, lat0: float, lat1: float, lon0: float, lon1: float,
+                 stride: int = 1) -> str:
+    """URL de la sub-rejilla sst[(t)][(lat0):(lat1)][(lon0):(lon1)] (lon en 0–360)."""
+    query = (f"sst[({date_iso}):1:({date_iso})]"
+             f"[({lat0}):{stride}:({lat1})][({lon0}):{stride}:({lon1})]")
+    return CLIENT.griddap_url(DATASET, query)
+
+
+def parse_sst_grid(text: str | None):
+    """
+    Convierte la respuesta CSV de una caja en (lats, lons, grid) con grid[i_lat, i_lon]
+    en °C (NaN sin dato). None si la respuesta no es válida.
+    """
+    if text is None:
+        return None
+    try:
+        # fila 2 = unidades
+        df = pd.read_csv(io.StringIO(text), skiprows=[1])
+    except Exception:
+        return None
+    if "sst" not in df.columns or df.empty:
+        return None
+
+    lat = df["latitude"].to_numpy(dtype=float)
+    lon = df["longitude"].to_numpy(dtype=float)
+    lats, lons = np.unique(lat), np.unique(lon)
+    grid = np.full((len(lats), len(lons)), np.nan)
+    grid[np.searchsorted(lats, lat), np.searchsorted(lons, lon)] = \
+        pd.to_numeric(df["sst"], errors="coerce").to_numpy(dtype=float)
+    return lats, lons, grid
 
 
 def first_date(props: dict) -> str | None:
@@ -113,63 +186,241 @@ def is_bad_coord(lat: float, lon: float) -> bool:
     return False
 
 
-def enrich_file(src: Path, dst: Path, limit: int | None, throttle: float):
-    with open(src, "r", encoding="utf-8") as f:
-        gj = json.load(f)
+def point_for_feature(f: dict, count: bool = True):
+    """
+    (lat, lon, fecha ISO) si el feature es consultable; None si se deja tal cual. Con `count`
+    el motivo del descarte suma en METRICS (skip_no_coords, skip_bad_coord, skip_no_date, …).
+    """
+    def skip(reason):
+        if count:
+            METRICS.count(reason)
+        return None
 
-    feats = gj.get("features", [])
-    if limit:
-        feats = feats[:limit]
+    geom = f.get("geometry") or {}
+    coords = geom.get("coordinates") or []
+    if len(coords) < 2:
+        return skip("skip_no_coords")
 
-    out, added = [], 0
-    for i, f in enumerate(feats, 1):
-        geom = f.get("geometry") or {}
-        coords = geom.get("coordinates") or []
-        if len(coords) < 2:
-            out.append(f)
-            continue
+    lon, lat = float(coords[0]), float(coords[1])
+    if is_bad_coord(lat, lon):
+        return skip("skip_bad_coord")
 
-        lon, lat = float(coords[0]), float(coords[1])
-        if is_bad_coord(lat, lon):
-            out.append(f)
-            continue
+    date_iso = first_date(f.get("properties") or {})
+    if not date_iso:
+        return skip("skip_no_date")
 
-        props = f.get("properties") or {}
-        date_iso = first_date(props)
-        if not date_iso:
-            out.append(f)
-            continue
+    try:
+        if datetime.date.fromisoformat(date_iso) < COVERAGE_START:
+            return skip("skip_before_coverage")
+    except Exception:
+        return skip("skip_bad_date")
 
-        try:
-            d = datetime.date.fromisoformat(date_iso)
-            if d < COVERAGE_START:
-                out.append(f)
-                continue
-        except Exception:
-            out.append(f)
+    return lat, lon, date_iso
+
+
+def cache_key(lat: float, lon: float, date_iso: str) -> str:
+    return f"{date_iso}|{round(lat,2)}|{round(_to_0360(lon),2)}"
+
+
+def prefetch_batched(points, max_cells: int):
+    """
+    Modo batch (1ª pasada): agrupa los puntos (lat, lon, fecha) sin caché por fecha (o mes en
+    productos mensuales), pide una sola caja lat/lon por grupo y resuelve todos sus puntos en
+    memoria por vecino más cercano. Los resultados quedan en la caché; solo se guardan claves,
+    no features, así que la memoria depende de los puntos distintos y no del fichero.
+    """
+    groups, seen = {}, set()
+    for lat, lon, date_iso in points:
+        key = cache_key(lat, lon, date_iso)
+        if key in seen or key in SST_CACHE:
             continue
+        seen.add(key)
+        groups.setdefault(batch_key(date_iso), []).append((lat, _to_0360(lon), key))
+
+    # una o dos cajas por grupo (dos si cruza la costura 360→0)
+    boxes = []  # (miembros, índices dentro del grupo, lats, lons, url)
+    for gkey, members in sorted(groups.items()):
+        lats = np.array([m[0] for m in members])
+        lons = np.array([m[1] for m in members])
+        for lon0, lon1 in lon_ranges(lons):
+            idx = np.flatnonzero((lons >= lon0) & (lons <= lon1))
+            lat0, lat1 = float(lats[idx].min()), float(lats[idx].max())
+            stride = grid_stride(lat0, lat1, lon0, lon1, max_cells)
+            url = sst_grid_url(batch_time(gkey), lat0, lat1, lon0, lon1, stride=stride)
+            boxes.append((members, idx, lats[idx], lons[idx], url))
+
+    print(f"[info] {len(seen)} puntos sin caché en {len(groups)} grupos ({len(boxes)} cajas)")
+
+    for n, (b, text) in enumerate(CLIENT.fetch_many(box[4] for box in boxes), 1):
+        members, idx, lats, lons, _ = boxes[b]
+        with METRICS.timer("parse"):
+            res = parse_sst_grid(text)
+            if res is None:
+                vals = [None] * len(idx)
+            else:
+                g_lats, g_lons, grid = res
+                v = grid[_nearest_index(g_lats, lats), _nearest_index(g_lons, lons)]
+                vals = [None if np.isnan(x) else float(x) for x in v]
+        METRICS.count("box_failed" if res is None else "box_ok")
+
+        for j, val in zip(idx, vals):
+            SST_CACHE[members[j][2]] = val
+
+        METRICS.progress(n, len(boxes), "cajas")
+        if n % 20 == 0:
+            save_cache(SST_CACHE)
 
-        sst = fetch_sst_point(lat, lon, date_iso)
-        props["sst_c"] = sst
-        f["properties"] = props
-        out.append(f)
 
-        if sst is not None:
+def assign_from_cache(feats: list) -> int:
+    """Modo batch (2ª pasada): copia la SST de la caché a los features; devuelve cuántos tienen SST."""
+    added = queried = 0
+    for f in feats:
+        p = point_for_feature(f)
+        if p is None:
+            continue
+        props = f.get("properties") or {}
+        props["sst_c"] = SST_CACHE.get(cache_key(*p))
+        f["properties"] = props
+        queried += 1
+        if props["sst_c"] is not None:
             added += 1
+    METRICS.count("sst_none", queried - added)
+    return added
 
+
+def enrich_sequential(feats: list) -> int:
+    """
+    Modo punto a punto: una petición ERDDAP por (fecha, lat, lon) distinta, lanzadas en
+    paralelo por el cliente. Escribe props["sst_c"] y devuelve cuántos obtuvieron SST.
+    """
+    pending = {}  # clave de caché -> (url, features que la usan)
+    queried = []
+    for f in feats:
+        p = point_for_feature(f)
+        if p is None:
+            continue
+        queried.append(f)
+        lat, lon, date_iso = p
+        key = cache_key(lat, lon, date_iso)
+        props = f.get("properties") or {}
+        f["properties"] = props
+        if key in SST_CACHE:
+            props["sst_c"] = SST_CACHE[key]
+            continue
+        pending.setdefault(key, (sst_point_url(lat, lon, date_iso), []))[1].append(f)
+
+    keys = list(pending)
+    added = 0
+    for i, (k, text) in enumerate(CLIENT.fetch_many(pending[key][0] for key in keys), 1):
+        key = keys[k]
+        with METRICS.timer("parse"):
+            sst = parse_sst_point(text)
+        SST_CACHE[key] = sst
+        for f in pending[key][1]:
+            f["properties"]["sst_c"] = sst
+            if sst is not None:
+                added += 1
+
+        METRICS.progress(i, len(keys), "peticiones", sst=added)
         if i % 50 == 0:
-            print(f"[info] {i} puntos procesados… (+SST={added})")
             save_cache(SST_CACHE)
 
-        time.sleep(max(0.0, throttle))
+    METRICS.count("sst_none", sum(1 for f in queried if f["properties"].get("sst_c") is None))
+    return sum(1 for f in feats if (f.get("properties") or {}).get("sst_c") is not None)
+
+
+def enrich_local(feats: list) -> int:
+    """
+    Modo local: SST de los granulos NetCDF de LOCAL, todos los puntos de cada fecha (o mes) de
+    una vez y sin caché (leer del disco ya es barato). Mismas reglas que point_for_feature.
+    """
+    queried, points = [], []
+    for f in feats:
+        p = point_for_feature(f)
+        if p is None:
+            continue
+        f["properties"] = f.get("properties") or {}
+        queried.append(f)
+        points.append(p)
+    if not points:
+        return 0
+
+    lats, lons, dates = zip(*points)
+    vals = LOCAL.sample_many(dates, lats, lons)
+    for f, v in zip(queried, vals):
+        f["properties"]["sst_c"] = None if np.isnan(v) else float(v)
+    added = int(np.count_nonzero(~np.isnan(vals)))
+    METRICS.count("sst_none", len(vals) - added)
+    return added
+
+
+def setup(erddap: str = ERDDAP_BASE, workers: int = 8, throttle: float = 0.2,
+          cache_max: int | None = None, local: Path | None = None, interp: str = "nearest"):
+    """
+    Abre la caché y crea el cliente ERDDAP compartidos (también desde otros scripts); con
+    `local` indexa además los granulos NetCDF de esa carpeta, que sustituyen a ERDDAP.
+    """
+    global SST_CACHE, CLIENT, LOCAL
+    SST_CACHE = load_cache(cache_max)
+    CLIENT = ErddapClient(erddap, workers=workers, rate=1.0 / throttle if throttle > 0 else 0)
+    LOCAL = LocalSst(local, method=interp) if local else None
+
+
+def state_config(batch: bool, max_cells: int) -> dict:
+    """Lo que determina el valor de sst_c de un punto: si cambia, el estado incremental no vale."""
+    if LOCAL is not None:
+        files = hashlib.sha1(",".join(sorted(LOCAL.files)).encode()).hexdigest()
+        return {"local": str(LOCAL.root.resolve()), "files": files, "interp": LOCAL.method}
+    return {"dataset": DATASET, "batch": batch,
+            "max_cells": max_cells if batch else None}
 
-    gj["features"] = out
-    dst.parent.mkdir(parents=True, exist_ok=True)
-    with open(dst, "w", encoding="utf-8") as f:
-        json.dump(gj, f, ensure_ascii=False)
 
-    save_cache(SST_CACHE)
-    print(f"[ok] Guardado: {dst} con {len(out)} features. SST añadida en {added} puntos.")
+def enrich_file(src: Path, dst: Path, limit: int | None,
+                batch: bool = False, max_cells: int = MAX_GRID_CELLS, chunk: int = CHUNK, state=None):
+    """
+    Con `state` (IncrementalState) solo se consultan los features que no estaban ya en él. Los
+    puntos consultables que se quedan sin SST no se guardan en el estado, para reintentarlos.
+    """
+    t0 = time.monotonic()
+    if batch and LOCAL is None:
+        with METRICS.timer("prefetch"):
+            feats = islice(iter_features(src), limit or None)
+            if state:
+                feats = (f for part in iter_chunks(feats, chunk)
+                         for f, known in zip(part, state.known(part)) if not known)
+            points = (point_for_feature(f, count=False) for f in feats)
+            prefetch_batched((p for p in points if p is not None), max_cells)
+
+    # por bloques: memoria acotada, salida progresiva y caché volcada tras cada bloque
+    total = added = 0
+    with FeatureReader(src) as reader, FeatureWriter(dst, reader.meta) as writer:
+        for feats in METRICS.timed(iter_chunks(islice(reader, limit or None), chunk), "load"):
+            todo = state.split(feats) if state else feats
+            with METRICS.timer("lookup"):
+                if LOCAL is not None:
+                    n = enrich_local(todo)
+                else:
+                    n = assign_from_cache(todo) if batch else enrich_sequential(todo)
+            with METRICS.timer("serialize"):
+                writer.write_many(feats)
+            if state:
+                state.record([f for f in todo if (f.get("properties") or {}).get("sst_c") is not None
+                              or point_for_feature(f, count=False) is None])
+                state.checkpoint()
+                n = sum((f.get("properties") or {}).get("sst_c") is not None for f in feats)
+            added += n
+            total += len(feats)
+            save_cache(SST_CACHE)
+            METRICS.progress(total, sst=added)
+    if LOCAL is not None:
+        print(f"[info] SST local: {LOCAL.summary()} (total {time.monotonic() - t0:.1f}s)")
+    else:
+        print(f"[info] ERDDAP: {CLIENT.summary()} en {time.monotonic() - t0:.1f}s")
+
+    print(f"[info] caché SST: {SST_CACHE.stats()}")
+    print(f"[ok] Guardado: {dst} con {total} features. SST añadida en {added} puntos.")
+    if state:
+        print(f"[info] incremental: {state.summary()}")
 
 
 def main():
@@ -177,15 +428,40 @@ def main():
     ap.add_argument("--src", type=Path, default=DEFAULT_SRC)
     ap.add_argument("--dst", type=Path, default=DEFAULT_DST)
     ap.add_argument("--limit", type=int, default=40, help="procesar solo N puntos (prueba)")
-    ap.add_argument("--throttle", type=float, default=0.2, help="pausa entre peticiones (s)")
+    ap.add_argument("--throttle", type=float, default=0.2,
+                    help="intervalo medio mínimo entre peticiones (s); 0 = sin límite de ritmo")
+    ap.add_argument("--workers", type=int, default=8, help="peticiones simultáneas a ERDDAP")
+    ap.add_argument("--batch", action="store_true",
+                    help="una petición por fecha (o mes) con la caja lat/lon de todos sus puntos")
+    ap.add_argument("--max-cells", type=int, default=MAX_GRID_CELLS,
+                    help="máximo de celdas por caja en modo batch (si se supera se usa stride)")
+    ap.add_argument("--erddap", default=ERDDAP_BASE,
+                    help="URL base griddap (p.ej. un servidor ERDDAP local para pruebas)")
+    ap.add_argument("--chunk", type=int, default=CHUNK, help="features por bloque")
+    ap.add_argument("--cache-max", type=int, default=None,
+                    help="máximo de entradas en la caché SST (expulsión LRU); por defecto sin límite")
+    ap.add_argument("--local", type=Path, default=None,
+                    help="carpeta con granulos NetCDF de MUR/GHRSST (diarios o mensuales); sustituye a ERDDAP")
+    ap.add_argument("--interp", choices=INTERP_METHODS, default="nearest",
+                    help="interpolación con --local")
+    add_incremental_arguments(ap)
+    add_metrics_arguments(ap)
     args = ap.parse_args()
 
-    print(f"[run] src={args.src} -> dst={args.dst}  limit={args.limit}  throttle={args.throttle}")
+    print(f"[run] src={args.src} -> dst={args.dst}  limit={args.limit}  throttle={args.throttle}"
+          f"  workers={args.workers}  batch={args.batch}")
 
-    global SST_CACHE
-    SST_CACHE = load_cache()
-
-    enrich_file(args.src, args.dst, args.limit, args.throttle)
+    with instrument(args, "enrich_sst_real"):
+        setup(args.erddap, args.workers, args.throttle, args.cache_max, args.local, args.interp)
+        state = open_state(args, args.dst, state_config(args.batch, args.max_cells), ["sst_c"], first_date)
+        try:
+            enrich_file(args.src, args.dst, args.limit, args.batch, args.max_cells, args.chunk, state)
+        finally:
+            SST_CACHE.close()
+            if LOCAL is not None:
+                LOCAL.close()
+            if state:
+                state.close()
 
 
 if __name__ == "__main__":
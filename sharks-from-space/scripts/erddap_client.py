@@ -0,0 +1,150 @@
+# scripts/erddap_client.py
+# Cliente HTTP compartido por los enriquecedores de SST: pool de hilos con límite de
+# concurrencia, token bucket para no pasar de N peticiones/s, reintentos con backoff
+# exponencial + jitter y conexiones keep-alive reutilizadas (requests.Session).
+import time, random, threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import METRICS
+
+ERDDAP_BASE = "https://coastwatch.pfeg.noaa.gov/erddap/griddap"
+USER_AGENT = "sphyrna-sst-enricher/1.0"
+
+# 4xx que sí merece la pena reintentar; el resto (p.ej. 404 "no matching results") es definitivo
+RETRY_STATUS = {408, 425, 429}
+
+
+class TokenBucket:
+    """Limitador token bucket: `rate` fichas/s con ráfagas de hasta `burst`. rate <= 0 = sin límite."""
+
+    def __init__(self, rate: float, burst: float | None = None):
+        self.rate = rate
+        self.capacity = burst if burst is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class ErddapClient:
+    """
+    Descargas concurrentes contra ERDDAP (o cualquier servidor HTTP equivalente).
+    `fetch(url)` devuelve el texto de la respuesta o None si falla tras los reintentos;
+    `fetch_many(urls)` hace lo mismo en paralelo y va devolviendo (índice, texto).
+    """
+
+    def __init__(self, base: str = ERDDAP_BASE, workers: int = 8, rate: float = 5.0,
+                 retries: int = 3, backoff: float = 1.0, max_backoff: float = 30.0, timeout: float = 60):
+        self.base = base.rstrip("/")
+        self.workers = max(1, workers)
+        self.bucket = TokenBucket(rate)
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        self.session.headers.update({"User-Agent": USER_AGENT})
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self.stats_lock = threading.Lock()
+        self.requests = 0
+        self.retried = 0
+        self.failed = 0
+        self._t_first = None
+        self._t_last = None
+
+    def griddap_url(self, dataset: str, query: str, fmt: str = "csv") -> str:
+        return f"{self.base}/{dataset}.{fmt}?{query}"
+
+    def _count(self, **kw):
+        with self.stats_lock:
+            now = time.monotonic()
+            if self._t_first is None:
+                self._t_first = now
+            self._t_last = now
+            for k, v in kw.items():
+                setattr(self, k, getattr(self, k) + v)
+
+    @staticmethod
+    def _observe(t0: float):
+        """Latencia de una petición (con o sin respuesta) al histograma y al temporizador 'http'."""
+        dt = time.perf_counter() - t0
+        METRICS.observe("http", dt)
+        METRICS.add_time("http", dt)
+        METRICS.count("http_requests")
+
+    def _sleep_backoff(self, attempt: int):
+        # full jitter: U(0, min(max, base·2^n))
+        time.sleep(random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt)))
+
+    def fetch(self, url: str) -> str | None:
+        last_err = None
+        for attempt in range(self.retries):
+            with METRICS.timer("throttle"):
+                self.bucket.acquire()
+            self._count()
+            t0 = time.perf_counter()
+            try:
+                r = self.session.get(url, timeout=self.timeout)
+                self._count(requests=1)
+                self._observe(t0)
+                if r.status_code < 400:
+                    return r.text
+                last_err = f"HTTP {r.status_code}"
+                METRICS.count(f"http_{r.status_code}")
+                if r.status_code < 500 and r.status_code not in RETRY_STATUS:
+                    break
+            except requests.RequestException as e:
+                self._count(requests=1)
+                self._observe(t0)
+                METRICS.count("http_errors")
+                last_err = e
+            if attempt + 1 < self.retries:
+                self._count(retried=1)
+                METRICS.count("http_retries")
+                with METRICS.timer("backoff"):
+                    self._sleep_backoff(attempt)
+
+        self._count(failed=1)
+        METRICS.count("http_failed")
+        print(f"[warn] ERDDAP fallo ({last_err}): {url}")
+        return None
+
+    def fetch_many(self, urls):
+        """Descarga todas las URLs con `workers` hilos; genera (índice, texto|None) según terminan."""
+        urls = list(urls)
+        if not urls:
+            return
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futures = {pool.submit(self.fetch, u): i for i, u in enumerate(urls)}
+            for fut in as_completed(futures):
+                yield futures[fut], fut.result()
+
+    def rate(self) -> float:
+        """Peticiones/s conseguidas entre la primera y la última petición."""
+        if self._t_first is None or self._t_last <= self._t_first:
+            return 0.0
+        return self.requests / (self._t_last - self._t_first)
+
+    def summary(self) -> str:
+        return (f"{self.requests} peticiones ({self.rate():.2f} req/s, workers={self.workers}, "
+                f"reintentos={self.retried}, fallos={self.failed})")
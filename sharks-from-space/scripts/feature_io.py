@@ -0,0 +1,203 @@
+# scripts/feature_io.py
+# E/S de features en streaming, compartida por todos los scripts:
+#   - lectura incremental de un FeatureCollection (.geojson) sin cargarlo entero;
+#   - GeoJSON por líneas (.ndjson / .geojsonl / .jsonl): un Feature por línea;
+#   - escritura progresiva (y atómica: .tmp + rename) en cualquiera de los dos formatos;
+#   - iteración por bloques para procesar N features a la vez.
+# La memoria depende del tamaño de bloque, no del tamaño del fichero.
+import json, os
+from itertools import islice
+from pathlib import Path
+
+NDJSON_SUFFIXES = {".ndjson", ".geojsonl", ".geojsons", ".jsonl"}
+READ_SIZE = 1 << 20   # 1 MiB por lectura
+CHUNK = 10_000        # features por bloque por defecto
+
+_decoder = json.JSONDecoder()
+
+
+def is_ndjson(path) -> bool:
+    return Path(path).suffix.lower() in NDJSON_SUFFIXES
+
+
+class FeatureReader:
+    """
+    Itera los features de un .geojson (FeatureCollection) o de un GeoJSON por líneas.
+    En un FeatureCollection, los miembros de primer nivel anteriores a "features"
+    (p.ej. "name", "crs") quedan en `meta` nada más abrirlo.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.f = open(self.path, "r", encoding="utf-8")
+        self.meta = {}
+        self.ndjson = is_ndjson(self.path)
+        self.buf, self.pos, self.eof = "", 0, False
+        if not self.ndjson:
+            self._read_header()
+
+    # --- buffer ---
+    def _fill(self) -> bool:
+        if self.eof:
+            return False
+        data = self.f.read(READ_SIZE)
+        if not data:
+            self.eof = True
+            return False
+        if self.pos > READ_SIZE:
+            self.buf, self.pos = self.buf[self.pos:], 0
+        self.buf += data
+        return True
+
+    def _peek(self) -> str:
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in " \t\r\n":
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ""
+
+    def _expect(self, ch: str):
+        if self._peek() != ch:
+            raise ValueError(f"{self.path}: se esperaba '{ch}' en la posición {self.pos}")
+        self.pos += 1
+
+    def _value(self):
+        self._peek()
+        while True:
+            try:
+                val, end = _decoder.raw_decode(self.buf, self.pos)
+                # un número al final del buffer puede estar cortado: leer más y repetir
+                if end < len(self.buf) or self.eof or not isinstance(val, (int, float)):
+                    self.pos = end
+                    return val
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self._fill()
+
+    # --- FeatureCollection ---
+    def _read_header(self):
+        self._expect("{")
+        while True:
+            if self._peek() == "}":
+                self.pos += 1
+                self.in_features = False
+                return
+            key = self._value()
+            self._expect(":")
+            if key == "features":
+                self._expect("[")
+                self.in_features = True
+                self.first = True
+                return
+            self.meta[key] = self._value()
+            if self._peek() == ",":
+                self.pos += 1
+
+    def _iter_collection(self):
+        while self.in_features:
+            ch = self._peek()
+            if ch == "]":
+                self.pos += 1
+                self.in_features = False
+                break
+            if not self.first:
+                self._expect(",")
+            self.first = False
+            yield self._value()
+
+    def _iter_lines(self):
+        for line in self.f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+    def __iter__(self):
+        return self._iter_lines() if self.ndjson else self._iter_collection()
+
+    def close(self):
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class FeatureWriter:
+    """
+    Escribe features según llegan. El formato lo decide la extensión (.geojson ->
+    FeatureCollection, .ndjson/.geojsonl -> uno por línea). Se escribe en `<dst>.tmp`
+    y se renombra al cerrar sin error, así nunca queda un fichero a medias.
+    """
+
+    def __init__(self, path, meta: dict | None = None):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.tmp = self.path.with_name(self.path.name + ".tmp")
+        self.f = open(self.tmp, "w", encoding="utf-8")
+        self.ndjson = is_ndjson(self.path)
+        self.count = 0
+        if not self.ndjson:
+            head = {"type": "FeatureCollection", **{k: v for k, v in (meta or {}).items()
+                                                    if k not in ("type", "features")}}
+            self.f.write(json.dumps(head, ensure_ascii=False)[:-1] + ', "features": [')
+
+    def write(self, feat: dict):
+        if self.ndjson:
+            self.f.write(json.dumps(feat, ensure_ascii=False) + "\n")
+        else:
+            self.f.write((",\n" if self.count else "\n") + json.dumps(feat, ensure_ascii=False))
+        self.count += 1
+
+    def write_many(self, feats):
+        for feat in feats:
+            self.write(feat)
+
+    def close(self, ok: bool = True):
+        if self.f.closed:
+            return
+        if not self.ndjson:
+            self.f.write("\n]}\n")
+        self.f.close()
+        if ok:
+            os.replace(self.tmp, self.path)
+        else:
+            self.tmp.unlink(missing_ok=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        self.close(ok=exc_type is None)
+
+
+def iter_features(path):
+    """Genera los features de `path` (FeatureCollection o por líneas) uno a uno."""
+    with FeatureReader(path) as reader:
+        yield from reader
+
+
+def iter_chunks(iterable, size: int = CHUNK):
+    """Agrupa cualquier iterable en listas de hasta `size` elementos."""
+    it = iter(iterable)
+    while True:
+        chunk = list(islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def read_features(path) -> list:
+    """Todos los features en una lista (solo para ficheros que caben en memoria)."""
+    return list(iter_features(path))
+
+
+def write_features(path, feats, meta: dict | None = None) -> int:
+    """Escribe un iterable de features en streaming; devuelve cuántos se escribieron."""
+    with FeatureWriter(path, meta) as w:
+        w.write_many(feats)
+    return w.count
@@ -1,5 +1,7 @@
 #!/usr/bin/env python3
-import json, random, argparse, os
+import random, argparse
+
+from feature_io import FeatureWriter
 
 def main():
     ap = argparse.ArgumentParser()
@@ -13,24 +15,20 @@ def main():
     ap.add_argument("--monthly", action="store_true", help="añade campo month 1..12")
     args = ap.parse_args()
 
-    feats = []
-    for i in range(args.n):
-        lon = random.uniform(args.lon_min, args.lon_max)
-        lat = random.uniform(args.lat_min, args.lat_max)
-        props = {"type":"background","id": i}
-        if args.monthly:
-            props["month"] = random.randint(1,12)
-        feats.append({
-            "type":"Feature",
-            "geometry":{"type":"Point","coordinates":[lon, lat]},
-            "properties": props
-        })
-
-    os.makedirs(os.path.dirname(args.out), exist_ok=True)
-    with open(args.out, "w", encoding="utf-8") as f:
-        json.dump({"type":"FeatureCollection","features":feats}, f)
+    with FeatureWriter(args.out) as out:
+        for i in range(args.n):
+            lon = random.uniform(args.lon_min, args.lon_max)
+            lat = random.uniform(args.lat_min, args.lat_max)
+            props = {"type":"background","id": i}
+            if args.monthly:
+                props["month"] = random.randint(1,12)
+            out.write({
+                "type":"Feature",
+                "geometry":{"type":"Point","coordinates":[lon, lat]},
+                "properties": props
+            })
 
-    print(f"[ok] background raw -> {args.out} ({len(feats)} puntos)")
+    print(f"[ok] background raw -> {args.out} ({out.count} puntos)")
 
 if __name__ == "__main__":
     main()
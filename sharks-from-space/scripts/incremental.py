@@ -0,0 +1,176 @@
+# scripts/incremental.py
+# Modo incremental de los enriquecedores (SST, batimetría, distancia a costa). Cada feature
+# tiene una huella (coordenadas + fecha + propiedades que influyen en el resultado) y lo que
+# se calculó para ella queda en un fichero de estado SQLite junto a la salida
+# (<dst>.state.sqlite). En la siguiente ejecución los features con huella conocida copian sus
+# valores sin volver a calcularlos, así que el coste es proporcional a lo que ha cambiado.
+# El estado se confirma tras cada bloque (checkpoint): si el proceso se corta, relanzar el
+# mismo comando retoma desde ahí. --reuse siembra el estado con una salida anterior hecha sin
+# este modo.
+#
+#   python scripts/enrich_bathymetry.py --src pts.geojson --dst pts_bathy.geojson --incremental
+#   python scripts/enrich_sst_real.py --batch --limit 0 --incremental --reuse public/data/old_enriched.geojson
+#
+# Si cambia la configuración que determina los valores (raster, costa, dataset, modo…), el
+# estado guardado no vale y se descarta entero. Con --reuse no hay forma de comprobarlo: se
+# da por hecho que la salida anterior se hizo con la misma configuración.
+import hashlib, json, os, sqlite3, struct
+from pathlib import Path
+
+from feature_io import iter_chunks, iter_features
+from metrics import METRICS
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS done (
+    fp    BLOB PRIMARY KEY,   -- huella del feature (blake2b 16 bytes)
+    props TEXT NOT NULL       -- JSON {propiedad: valor} que añadió el enriquecimiento
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS meta (k TEXT PRIMARY KEY, v TEXT);
+"""
+LOOKUP_BATCH = 500    # huellas por SELECT … IN (…)
+
+
+def file_signature(path) -> dict:
+    """Ruta, tamaño y mtime de un fichero de entrada (raster, costa): si cambia, el estado no vale."""
+    st = os.stat(path)
+    return {"path": str(Path(path).resolve()), "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+def fingerprint(f: dict, date_fn=None, keys=()) -> bytes:
+    """
+    Huella de un feature: coordenadas exactas, fecha (con `date_fn(props)`, p.ej. first_date)
+    y el valor de las propiedades `keys`. Features sin coordenadas tienen también su huella.
+    """
+    coords = ((f.get("geometry") or {}).get("coordinates") or [])[:2]
+    props = f.get("properties") or {}
+    h = hashlib.blake2b(digest_size=16)
+    try:
+        h.update(struct.pack("<2d", *map(float, coords)) if len(coords) == 2 else b"-")
+    except (TypeError, ValueError):
+        h.update(repr(coords).encode())
+    if date_fn is not None:
+        h.update(str(date_fn(props)).encode())
+    for k in keys:
+        h.update(b"\0" + json.dumps(props.get(k), sort_keys=True, default=str).encode())
+    return h.digest()
+
+
+class IncrementalState:
+    """
+    Estado de un enriquecimiento: huella -> propiedades calculadas. `split(feats)` copia lo ya
+    conocido y devuelve los features pendientes; `record(feats)` guarda lo calculado para ellos
+    y `checkpoint()` lo confirma en disco.
+    """
+
+    def __init__(self, path: Path, config: dict, props, date_fn=None, keys=()):
+        self.path = Path(path)
+        self.props = list(props)
+        self.date_fn, self.keys = date_fn, tuple(keys)
+        self.config = json.dumps(config, sort_keys=True, default=str)
+        self.db = sqlite3.connect(self.path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(SCHEMA)
+        row = self.db.execute("SELECT v FROM meta WHERE k = 'config'").fetchone()
+        if row is not None and row[0] != self.config:
+            n = self.db.execute("SELECT COUNT(*) FROM done").fetchone()[0]
+            print(f"[warn] {self.path}: la configuración ha cambiado, se descartan {n} features guardados")
+            self.db.execute("DELETE FROM done")
+        self.db.execute("INSERT OR REPLACE INTO meta(k, v) VALUES ('config', ?)", (self.config,))
+        self.db.commit()
+        self.pending = {}
+        self.reused = self.computed = 0
+
+    def fingerprint(self, f: dict) -> bytes:
+        return fingerprint(f, self.date_fn, self.keys)
+
+    def _lookup(self, fps) -> dict:
+        found = {}
+        fps = list(set(fps))
+        for i in range(0, len(fps), LOOKUP_BATCH):
+            part = fps[i:i + LOOKUP_BATCH]
+            q = f"SELECT fp, props FROM done WHERE fp IN ({','.join('?' * len(part))})"
+            found.update(self.db.execute(q, part).fetchall())
+        for fp in fps:
+            if fp in self.pending:
+                found[fp] = self.pending[fp]
+        return found
+
+    def known(self, feats) -> list:
+        """Máscara (lista de bool) de los features que ya están en el estado, sin tocarlos."""
+        fps = [self.fingerprint(f) for f in feats]
+        found = self._lookup(fps)
+        return [fp in found for fp in fps]
+
+    def split(self, feats) -> list:
+        """Completa los features conocidos con sus valores guardados; devuelve los pendientes."""
+        with METRICS.timer("state"):
+            fps = [self.fingerprint(f) for f in feats]
+            found = self._lookup(fps)
+            todo = []
+            for f, fp in zip(feats, fps):
+                stored = found.get(fp)
+                if stored is None:
+                    todo.append(f)
+                    continue
+                props = f.get("properties") or {}
+                props.update(json.loads(stored))
+                f["properties"] = props
+        self.reused += len(feats) - len(todo)
+        self.computed += len(todo)
+        METRICS.count("state_reused", len(feats) - len(todo))
+        METRICS.count("state_computed", len(todo))
+        return todo
+
+    def record(self, feats):
+        """Guarda (pendiente de checkpoint) las propiedades calculadas de los features `feats`."""
+        for f in feats:
+            props = f.get("properties") or {}
+            self.pending[self.fingerprint(f)] = json.dumps({k: props[k] for k in self.props if k in props})
+
+    def checkpoint(self):
+        if not self.pending:
+            return
+        with METRICS.timer("checkpoint"), self.db:
+            self.db.executemany("INSERT OR REPLACE INTO done(fp, props) VALUES (?, ?)", self.pending.items())
+        self.pending.clear()
+
+    def seed(self, previous: Path, chunk: int = 10_000) -> int:
+        """
+        Importa los valores de una salida anterior (GeoJSON/NDJSON ya enriquecido): cada feature
+        que tenga todas las propiedades del enriquecimiento pasa al estado tal cual.
+        """
+        n = 0
+        for feats in iter_chunks(iter_features(previous), chunk):
+            done = [f for f in feats if all(k in (f.get("properties") or {}) for k in self.props)]
+            self.record(done)
+            n += len(done)
+            self.checkpoint()
+        print(f"[info] estado: {n} features reutilizables desde {previous}")
+        return n
+
+    def summary(self) -> str:
+        return f"{self.reused} reutilizados, {self.computed} calculados ({self.path})"
+
+    def close(self):
+        self.checkpoint()
+        self.db.close()
+
+
+def add_arguments(ap):
+    g = ap.add_argument_group("modo incremental")
+    g.add_argument("--incremental", action="store_true",
+                   help="recalcular solo features nuevos o cambiados (estado en <dst>.state.sqlite)")
+    g.add_argument("--state", type=Path, default=None, help="fichero de estado (implica --incremental)")
+    g.add_argument("--reuse", type=Path, default=None,
+                   help="salida enriquecida anterior cuyos valores se reutilizan (implica --incremental)")
+
+
+def open_state(args, dst: Path, config: dict, props, date_fn=None, keys=()) -> IncrementalState | None:
+    """El IncrementalState que piden los flags de add_arguments, o None si no se usa el modo incremental."""
+    if not (args.incremental or args.state or args.reuse):
+        return None
+    state = IncrementalState(args.state or Path(str(dst) + ".state.sqlite"), config, props, date_fn, keys)
+    if args.reuse:
+        state.seed(args.reuse)
+    return state
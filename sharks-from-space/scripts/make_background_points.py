@@ -1,30 +1,66 @@
 # scripts/make_background_points.py
-import json, random, argparse
+import argparse, math
 from pathlib import Path
-from datetime import date
-from shapely.geometry import shape, Point
-from shapely.prepared import prep
-
-def load_land_mask(land_path: Path):
-    with open(land_path, "r", encoding="utf-8") as f:
-        gj = json.load(f)
-    # Unimos todos los polígonos de tierra en una sola mask preparada
-    polys = [shape(feat["geometry"]) for feat in gj.get("features", [])]
+
+import numpy as np
+import shapely
+from shapely.geometry import shape
+
+from feature_io import FeatureWriter, iter_features
+
+BLOCK = 1_000_000   # máximo de candidatos por bloque
+MAX_TRIES = 50      # como antes: como mucho n*50 candidatos en total
+YEARS = (2003, 2015)
+
+def load_land(land_path: Path):
+    # Unimos todos los polígonos de tierra en una sola geometría preparada
+    polys = [shape(feat["geometry"]) for feat in iter_features(land_path)]
     if not polys:
         return None
-    from shapely.ops import unary_union
-    land = unary_union(polys)
-    return prep(land)
+    land = shapely.union_all(polys)
+    shapely.prepare(land)
+    return land
+
+class LandMask:
+    """
+    Máscara de tierra pre-rasterizada sobre la caja de muestreo, con el mismo resultado que
+    contains_xy: las celdas que toca la línea de costa se resuelven con la geometría exacta
+    y el resto (enteras en tierra o en mar) con una consulta a la rejilla.
+    """
+    WATER, LAND, COAST = 0, 1, 2
+
+    def __init__(self, land, bounds, res: float):
+        from rasterio.features import rasterize
+        from rasterio.transform import from_origin
+
+        minLat, minLon, maxLat, maxLon = bounds
+        self.land, self.res = land, res
+        self.lon0, self.lat1 = minLon, maxLat
+        w = max(1, math.ceil((maxLon - minLon) / res))
+        h = max(1, math.ceil((maxLat - minLat) / res))
+        transform = from_origin(minLon, maxLat, res, res)
+        grid = rasterize([land], out_shape=(h, w), transform=transform, dtype="uint8")
+        coast = rasterize([land.boundary], out_shape=(h, w), transform=transform,
+                          all_touched=True, dtype="uint8")
+        grid[coast > 0] = self.COAST
+        self.grid = grid
+
+    def contains(self, lons, lats):
+        h, w = self.grid.shape
+        r = np.clip(((self.lat1 - lats) / self.res).astype(int), 0, h - 1)
+        c = np.clip(((lons - self.lon0) / self.res).astype(int), 0, w - 1)
+        cell = self.grid[r, c]
+        out = cell == self.LAND
+        edge = cell == self.COAST
+        out[edge] = shapely.contains_xy(self.land, lons[edge], lats[edge])
+        return out
 
 def load_presence_month_hist(presence_path: Path):
     """Construye una distribución simple de meses a partir de presencias (si existe eventDate o date)."""
-    try:
-        with open(presence_path, "r", encoding="utf-8") as f:
-            gj = json.load(f)
-    except FileNotFoundError:
+    if not Path(presence_path).exists():
         return None
     counts = [0]*12
-    for feat in gj.get("features", []):
+    for feat in iter_features(presence_path):
         props = feat.get("properties", {})
         d = props.get("eventDate") or props.get("date") or ""
         if isinstance(d, str) and len(d) >= 7:
@@ -41,72 +77,91 @@ def load_presence_month_hist(presence_path: Path):
     probs = [c/total for c in counts]
     return probs
 
-def sample_month(probs):
+def sample_months(rng, probs, n):
+    """n meses (1..12) según el histograma de presencias, o uniformes si no hay."""
     if not probs:
-        return random.randint(1, 12)
-    r = random.random()
-    acc = 0.0
-    for i, p in enumerate(probs, start=1):
-        acc += p
-        if r <= acc:
-            return i
-    return 12
-
-def random_point_in_bounds(bounds):
-    """bounds = [minLat, minLon, maxLat, maxLon]"""
+        return rng.integers(1, 13, size=n)
+    return rng.choice(np.arange(1, 13), size=n, p=probs)
+
+def random_points_in_bounds(rng, bounds, n):
+    """
+    n puntos uniformes en bounds = [minLat, minLon, maxLat, maxLon].
+    Si minLon > maxLon la caja cruza el antimeridiano (p.ej. 170 .. -170).
+    """
     minLat, minLon, maxLat, maxLon = bounds
-    lat = random.uniform(minLat, maxLat)
-    lon = random.uniform(minLon, maxLon)
-    return lon, lat
+    if maxLon < minLon:
+        maxLon += 360
+    lons = rng.uniform(minLon, maxLon, size=n)
+    lons = np.where(lons > 180, lons - 360, lons)
+    lats = rng.uniform(minLat, maxLat, size=n)
+    return lons, lats
+
+def generate(bounds, n, rng, in_land=None, month_probs=None, block=BLOCK):
+    """
+    Genera bloques de (lons, lats, meses, años) en mar. Cada bloque sortea tantos candidatos
+    como hacen falta según la tasa de aceptación vista hasta ahora, así el número de bloques
+    no crece con n ni con la proporción de tierra de la caja.
+    """
+    done = drawn = accepted = 0
+    while done < n and drawn < n * MAX_TRIES:
+        rate = (accepted + 1) / (drawn + 1)
+        size = min(block, n * MAX_TRIES - drawn, math.ceil((n - done) / rate * 1.1) + 16)
+        lons, lats = random_points_in_bounds(rng, bounds, size)
+        drawn += size
+        # Rechaza los que caen en tierra
+        if in_land is not None:
+            sea = ~in_land(lons, lats)
+            lons, lats = lons[sea], lats[sea]
+        accepted += len(lons)
+        lons, lats = lons[:n - done], lats[:n - done]
+        done += len(lons)
+        months = sample_months(rng, month_probs, len(lons))
+        years = rng.integers(YEARS[0], YEARS[1] + 1, size=len(lons))
+        yield lons, lats, months, years
 
 def main():
     ap = argparse.ArgumentParser(description="Genera background points (ausencias) en Caribe")
     # Bounding box Caribe/Florida por defecto (ajústalo si quieres)
     ap.add_argument("--bounds", type=float, nargs=4, default=[8, -98, 34, -60],
-                    help="minLat minLon maxLat maxLon")
+                    help="minLat minLon maxLat maxLon (minLon > maxLon cruza el antimeridiano)")
     ap.add_argument("--n", type=int, default=5000, help="número de puntos a generar")
     ap.add_argument("--land", type=Path, default=Path("public/data/land.geojson"))
     ap.add_argument("--presence", type=Path, default=Path("public/data/sphyrna_points_enriched_0_5000.geojson"),
                     help="GeoJSON de presencias para copiar distribución de meses (opcional)")
     ap.add_argument("--out", type=Path, default=Path("public/data/background_raw.geojson"))
+    ap.add_argument("--seed", type=int, default=None, help="semilla (misma semilla = mismos puntos)")
+    ap.add_argument("--mask-res", type=float, default=None,
+                    help="rasterizar la tierra a esta resolución (grados) y usar geometría solo en la costa")
+    ap.add_argument("--block", type=int, default=BLOCK, help="máximo de candidatos por bloque")
     args = ap.parse_args()
 
-    land_mask = load_land_mask(args.land)
+    rng = np.random.default_rng(args.seed)
+    land = load_land(args.land)
     month_probs = load_presence_month_hist(args.presence)
 
-    feats = []
-    tries = 0
-    needed = args.n
-
-    minLat, minLon, maxLat, maxLon = args.bounds
-    while len(feats) < needed and tries < needed * 50:
-        tries += 1
-        lon, lat = random_point_in_bounds(args.bounds)
-        # Rechaza si cae en tierra
-        if land_mask and land_mask.contains(Point(lon, lat)):
-            continue
-
-        m = sample_month(month_probs)
-        # usa día 15 como aproximación mensual (estable)
-        day = 15
-        # si quieres un año fijo, usa 2008; o al azar 2003–2015:
-        year = random.randint(2003, 2015)
-        d = date(year, m, day).isoformat()
-
-        feats.append({
-            "type": "Feature",
-            "geometry": {"type": "Point", "coordinates": [lon, lat]},
-            "properties": {
-                "source": "background",
-                "date": d
-            }
-        })
-
-    out = {"type": "FeatureCollection", "features": feats}
-    args.out.parent.mkdir(parents=True, exist_ok=True)
-    with open(args.out, "w", encoding="utf-8") as f:
-        json.dump(out, f, ensure_ascii=False)
-    print(f"[ok] background points: {len(feats)} guardados en {args.out}")
+    in_land = None
+    if land is not None:
+        if args.mask_res:
+            minLat, minLon, maxLat, maxLon = args.bounds
+            if maxLon < minLon:
+                raise SystemExit("--mask-res no admite cajas que cruzan el antimeridiano")
+            in_land = LandMask(land, args.bounds, args.mask_res).contains
+        else:
+            in_land = lambda lons, lats: shapely.contains_xy(land, lons, lats)
+
+    # se escribe según se generan: no hace falta tener todos los puntos en memoria
+    with FeatureWriter(args.out) as out:
+        for lons, lats, months, years in generate(args.bounds, args.n, rng, in_land, month_probs, args.block):
+            # usa día 15 como aproximación mensual (estable)
+            out.write_many({
+                "type": "Feature",
+                "geometry": {"type": "Point", "coordinates": [lon, lat]},
+                "properties": {
+                    "source": "background",
+                    "date": f"{y:04d}-{m:02d}-15"
+                }
+            } for lon, lat, m, y in zip(lons.tolist(), lats.tolist(), months.tolist(), years.tolist()))
+    print(f"[ok] background points: {out.count} guardados en {args.out}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,237 @@
+# scripts/metrics.py
+# Instrumentación ligera compartida por los scripts de enriquecimiento:
+#   - temporizadores por etapa (load, lookup, http, serialize, …): segundos acumulados y llamadas;
+#   - contadores (hits/misses de caché, reintentos, resultados None, coordenadas descartadas…);
+#   - histogramas de latencia (p.ej. de cada petición HTTP) con percentiles aproximados;
+#   - progreso periódico (como mucho cada --metrics-every s) en consola y, con --metrics, en un
+#     fichero JSON-lines; al terminar, un resumen en consola y una última línea "summary";
+#   - --profile (cProfile, volcado .prof + funciones más caras) y --tracemalloc (pico y
+#     líneas que más memoria reservan), sin tocar el código del script.
+#
+#   python scripts/enrich_sst_real.py --batch --metrics logs/sst_metrics.jsonl --profile logs/sst.prof
+#
+# Los scripts usan el objeto global METRICS; `add_arguments(ap)` añade los flags y
+# `instrument(args, nombre)` envuelve la ejecución (configura, perfila y emite el resumen).
+import json, threading, time
+from bisect import bisect_left
+from contextlib import contextmanager
+from pathlib import Path
+
+# límites superiores (ms) de los cubos de los histogramas de latencia; el último es +inf
+BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+EVERY = 10.0        # segundos mínimos entre dos líneas de progreso
+PROFILE_TOP = 25    # funciones del resumen de cProfile
+TRACEMALLOC_TOP = 15
+
+
+class Histogram:
+    """Latencias en cubos fijos (BUCKETS_MS) con recuento, suma, mínimo y máximo."""
+
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS_MS) + 1)
+        self.n = 0
+        self.total = 0.0
+        self.min = float("inf")
+        self.max = 0.0
+
+    def add(self, seconds: float):
+        ms = seconds * 1000
+        self.buckets[bisect_left(BUCKETS_MS, ms)] += 1
+        self.n += 1
+        self.total += seconds
+        self.min = min(self.min, seconds)
+        self.max = max(self.max, seconds)
+
+    def quantile(self, q: float) -> float:
+        """Cuantil aproximado (s): límite superior del cubo donde cae (el máximo en el último)."""
+        if not self.n:
+            return 0.0
+        rank, seen = q * self.n, 0
+        for i, c in enumerate(self.buckets):
+            seen += c
+            if seen >= rank and c:
+                return round(min(BUCKETS_MS[i] / 1000, self.max) if i < len(BUCKETS_MS) else self.max, 4)
+        return round(self.max, 4)
+
+    def to_dict(self) -> dict:
+        return {"n": self.n, "mean_s": round(self.total / self.n, 4) if self.n else 0.0,
+                "min_s": round(self.min, 4) if self.n else 0.0, "max_s": round(self.max, 4),
+                "p50_s": self.quantile(0.5), "p95_s": self.quantile(0.95), "p99_s": self.quantile(0.99),
+                "buckets_ms": {str(b): c for b, c in zip(BUCKETS_MS + ("inf",), self.buckets) if c}}
+
+
+class Metrics:
+    """
+    Temporizadores, contadores e histogramas de un proceso (seguro entre hilos). Sin
+    `configure` solo acumula; el progreso y el resumen van a consola y, si hay fichero, a JSON-lines.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.timers = {}        # etapa -> [segundos, llamadas]
+            self.counters = {}
+            self.histograms = {}
+            self.t0 = time.monotonic()
+            self.last_progress = self.t0
+        self.script = None
+        self.path = None
+        self.every = EVERY
+
+    def configure(self, script: str, path: Path | None = None, every: float = EVERY):
+        """Empieza una ejecución: nombre del script, fichero JSON-lines (opcional) e intervalo de progreso."""
+        self.reset()
+        self.script, self.every = script, every
+        if path is not None:
+            self.path = Path(path)
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self.path.write_text("")
+            self._emit("start")
+
+    # --- registro ---
+    @contextmanager
+    def timer(self, stage: str):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(stage, time.perf_counter() - t0)
+
+    def add_time(self, stage: str, seconds: float):
+        with self.lock:
+            t = self.timers.setdefault(stage, [0.0, 0])
+            t[0] += seconds
+            t[1] += 1
+
+    def timed(self, iterable, stage: str):
+        """Itera `iterable` sumando a `stage` el tiempo de cada next() (p.ej. la lectura de bloques)."""
+        it = iter(iterable)
+        while True:
+            t0 = time.perf_counter()
+            try:
+                item = next(it)
+            except StopIteration:
+                self.add_time(stage, time.perf_counter() - t0)
+                return
+            self.add_time(stage, time.perf_counter() - t0)
+            yield item
+
+    def count(self, name: str, n: int = 1):
+        if n:
+            with self.lock:
+                self.counters[name] = self.counters.get(name, 0) + n
+
+    def observe(self, name: str, seconds: float):
+        with self.lock:
+            self.histograms.setdefault(name, Histogram()).add(seconds)
+
+    # --- salida ---
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {
+                "elapsed_s": round(time.monotonic() - self.t0, 3),
+                "timers": {k: {"seconds": round(s, 4), "calls": c} for k, (s, c) in self.timers.items()},
+                "counters": dict(self.counters),
+                "histograms": {k: h.to_dict() for k, h in self.histograms.items()},
+            }
+
+    def _emit(self, event: str, **fields):
+        if self.path is None:
+            return
+        record = {"ts": time.time(), "script": self.script, "event": event, **fields, **self.snapshot()}
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+
+    def progress(self, done: int, total: int | None = None, what: str = "procesados",
+                 force: bool = False, **fields):
+        """Línea de progreso (consola + JSON-lines) si han pasado `every` s desde la anterior."""
+        now = time.monotonic()
+        if not force and now - self.last_progress < self.every:
+            return
+        self.last_progress = now
+        elapsed = now - self.t0
+        rate = done / elapsed if elapsed > 0 else 0.0
+        extra = "".join(f" {k}={v}" for k, v in fields.items())
+        of = f"/{total}" if total is not None else ""
+        print(f"[info] {done}{of} {what} ({rate:.0f}/s, {elapsed:.0f}s){extra}")
+        self._emit("progress", what=what, done=done, total=total, rate=round(rate, 1), **fields)
+
+    def summary(self, **fields):
+        """Resumen final en consola (etapas, contadores, latencias) y última línea JSON 'summary'."""
+        snap = self.snapshot()
+        elapsed = snap["elapsed_s"]
+        # las etapas que corren en varios hilos (http) suman el tiempo de todos y pueden pasar del 100%
+        print(f"[info] métricas ({self.script or 'script'}, {elapsed:.1f}s):")
+        for stage, t in sorted(snap["timers"].items(), key=lambda kv: -kv[1]["seconds"]):
+            share = 100 * t["seconds"] / elapsed if elapsed > 0 else 0.0
+            print(f"         {stage:<14}{t['seconds']:>9.2f}s {share:>5.1f}%  ({t['calls']} llamadas)")
+        if snap["counters"]:
+            print("         " + "  ".join(f"{k}={v}" for k, v in sorted(snap["counters"].items())))
+        for name, h in snap["histograms"].items():
+            print(f"         {name}: n={h['n']} media={h['mean_s'] * 1000:.0f}ms p50≤{h['p50_s'] * 1000:.0f}ms "
+                  f"p95≤{h['p95_s'] * 1000:.0f}ms máx={h['max_s'] * 1000:.0f}ms")
+        self._emit("summary", **fields)
+
+
+METRICS = Metrics()
+
+
+# --------- flags y perfilado ----------
+def add_arguments(ap):
+    g = ap.add_argument_group("métricas y perfilado")
+    g.add_argument("--metrics", type=Path, default=None,
+                   help="fichero JSON-lines con progreso periódico y resumen final de métricas")
+    g.add_argument("--metrics-every", type=float, default=EVERY,
+                   help="segundos mínimos entre líneas de progreso")
+    g.add_argument("--profile", type=Path, default=None,
+                   help="perfilar con cProfile y volcar las estadísticas a este .prof")
+    g.add_argument("--tracemalloc", action="store_true",
+                   help="seguir las reservas de memoria (tracemalloc) e informar del pico y las líneas top")
+
+
+@contextmanager
+def instrument(args, script: str):
+    """Configura METRICS desde los flags de add_arguments, perfila si se pidió y emite el resumen al salir."""
+    METRICS.configure(script, getattr(args, "metrics", None), getattr(args, "metrics_every", EVERY))
+    profiler = None
+    if getattr(args, "tracemalloc", False):
+        import tracemalloc
+        tracemalloc.start()
+    if getattr(args, "profile", None):
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    ok = False
+    try:
+        yield METRICS
+        ok = True
+    finally:
+        fields = {"ok": ok}
+        if profiler is not None:
+            profiler.disable()
+            _report_profile(profiler, args.profile)
+        if getattr(args, "tracemalloc", False):
+            fields["tracemalloc_peak_mb"] = _report_tracemalloc()
+        METRICS.summary(**fields)
+
+
+def _report_profile(profiler, path: Path):
+    import pstats
+    path.parent.mkdir(parents=True, exist_ok=True)
+    profiler.dump_stats(path)
+    print(f"[info] perfil cProfile: {path}  (top {PROFILE_TOP} por tiempo acumulado)")
+    pstats.Stats(profiler).sort_stats("cumulative").print_stats(PROFILE_TOP)
+
+
+def _report_tracemalloc() -> float:
+    import tracemalloc
+    current, peak = tracemalloc.get_traced_memory()
+    top = tracemalloc.take_snapshot().statistics("lineno")[:TRACEMALLOC_TOP]
+    tracemalloc.stop()
+    print(f"[info] tracemalloc: actual {current / 2 ** 20:.1f} MB, pico {peak / 2 ** 20:.1f} MB")
+    for stat in top:
+        print(f"         {stat}")
+    return round(peak / 2 ** 20, 1)
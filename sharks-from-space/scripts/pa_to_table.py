@@ -1,27 +1,39 @@
 #!/usr/bin/env python3
-import json, argparse, pandas as pd, pathlib
+import argparse, pandas as pd, pathlib
+import pyarrow as pa, pyarrow.parquet as pq
+
+from feature_io import iter_features, iter_chunks
+
+SCHEMA = pa.schema([("lon", pa.float64()), ("lat", pa.float64()), ("date", pa.string()),
+                    ("month", pa.float64()), ("sst_c", pa.float64()), ("presence", pa.int64())])
+
+def to_row(f):
+    p=f.get("properties",{})
+    lon,lat=f["geometry"]["coordinates"][:2]
+    return {
+        "lon":lon,"lat":lat,
+        "date":p.get("date") or p.get("eventDate"),
+        "month":p.get("month"),
+        "sst_c":p.get("sst_c"),
+        "presence":p.get("presence", 1 if p.get("type")=="presence" else 0)
+    }
+
 def main():
     ap=argparse.ArgumentParser()
     ap.add_argument("--src", default="data/processed/pa_dataset.geojson")
     ap.add_argument("--csv", default="data/processed/pa_dataset.csv")
     ap.add_argument("--parquet", default="data/processed/pa_dataset.parquet")
+    ap.add_argument("--chunk", type=int, default=50_000, help="filas por bloque")
     args=ap.parse_args()
 
-    gj=json.load(open(args.src))
-    rows=[]
-    for f in gj["features"]:
-        p=f.get("properties",{})
-        lon,lat=f["geometry"]["coordinates"][:2]
-        rows.append({
-            "lon":lon,"lat":lat,
-            "date":p.get("date") or p.get("eventDate"),
-            "month":p.get("month"),
-            "sst_c":p.get("sst_c"),
-            "presence":p.get("presence", 1 if p.get("type")=="presence" else 0)
-        })
-    df=pd.DataFrame(rows)
     pathlib.Path(args.csv).parent.mkdir(parents=True, exist_ok=True)
-    df.to_csv(args.csv, index=False)
-    df.to_parquet(args.parquet, index=False)
-    print("[ok]", args.csv, "|", args.parquet, "rows:", len(df))
+    n=0
+    # CSV y Parquet se escriben por bloques (un row group por bloque)
+    with pq.ParquetWriter(args.parquet, SCHEMA) as pw:
+        for chunk in iter_chunks(map(to_row, iter_features(args.src)), args.chunk):
+            df=pd.DataFrame(chunk, columns=SCHEMA.names).astype({"month":"float64","sst_c":"float64"})
+            df.to_csv(args.csv, index=False, mode="w" if n==0 else "a", header=n==0)
+            pw.write_table(pa.Table.from_pandas(df, schema=SCHEMA, preserve_index=False))
+            n+=len(df)
+    print("[ok]", args.csv, "|", args.parquet, "rows:", n)
 if __name__=="__main__": main()
@@ -0,0 +1,167 @@
+# scripts/sst_cache.py
+# Caché persistente de SST sobre SQLite (WAL): cada escritura es un append al log,
+# las transacciones son atómicas (un corte a mitad no corrompe nada), la clave primaria
+# da búsquedas indexadas sin cargar el fichero y varios procesos pueden compartirla.
+#
+#   python scripts/sst_cache.py --migrate .cache_sst.json    # importar la caché JSON antigua
+#   python scripts/sst_cache.py --max-entries 200000         # recortar por LRU
+import json, time, sqlite3, argparse
+from pathlib import Path
+
+from metrics import METRICS
+
+DEFAULT_PATH = Path(".cache_sst.sqlite")
+LEGACY_JSON = Path(".cache_sst.json")
+FLUSH_EVERY = 500   # escrituras pendientes antes de volcar en una transacción
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sst (
+    key   TEXT PRIMARY KEY,   -- 'YYYY-MM-DD|lat|lon0360' (lat/lon redondeados a 2 decimales)
+    value REAL,               -- °C; NULL = consultado sin dato
+    used  REAL NOT NULL       -- último uso (epoch s), para expulsión LRU
+);
+CREATE INDEX IF NOT EXISTS sst_used ON sst(used);
+CREATE TABLE IF NOT EXISTS meta (k TEXT PRIMARY KEY, v TEXT);
+"""
+
+
+class SstCache:
+    """
+    Caché clave -> SST (°C o None) con interfaz de dict (`in`, `[]`, `get`, `len`).
+    Las escrituras se acumulan y se vuelcan con `flush()` (o solas cada FLUSH_EVERY);
+    si `max_entries` está fijado, al volcar se expulsan las entradas menos usadas. El número
+    de filas se cuenta una vez al abrir y se lleva en memoria, así que solo se expulsa (y solo
+    se recorre el índice de `used`) cuando un volcado pasa del límite; las filas que añada
+    otro proceso a la vez no se ven hasta reabrir la caché.
+    """
+
+    def __init__(self, path: Path = DEFAULT_PATH, max_entries: int | None = None, timeout: float = 30.0):
+        self.path = Path(path)
+        self.max_entries = max_entries
+        self.db = sqlite3.connect(self.path, timeout=timeout)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(SCHEMA)
+        self.rows = self.db.execute("SELECT COUNT(*) FROM sst").fetchone()[0] if max_entries else 0
+        self.pending = {}   # key -> value aún no volcado
+        self.touched = set()
+        self.hits = 0
+        self.misses = 0
+
+    # --- lectura ---
+    def _lookup(self, key: str):
+        """(encontrado, valor)."""
+        if key in self.pending:
+            return True, self.pending[key]
+        row = self.db.execute("SELECT value FROM sst WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return False, None
+        self.touched.add(key)
+        return True, row[0]
+
+    def __contains__(self, key: str) -> bool:
+        found, _ = self._lookup(key)
+        if found:
+            self.hits += 1
+        else:
+            self.misses += 1
+        METRICS.count("cache_hits" if found else "cache_misses")
+        return found
+
+    def __getitem__(self, key: str):
+        found, value = self._lookup(key)
+        if not found:
+            raise KeyError(key)
+        return value
+
+    def get(self, key: str, default=None):
+        found, value = self._lookup(key)
+        return value if found else default
+
+    def __len__(self) -> int:
+        self.flush()
+        return self.db.execute("SELECT COUNT(*) FROM sst").fetchone()[0]
+
+    # --- escritura ---
+    def __setitem__(self, key: str, value):
+        self.pending[key] = None if value is None else float(value)
+        if len(self.pending) >= FLUSH_EVERY:
+            self.flush()
+
+    def update(self, items):
+        for k, v in dict(items).items():
+            self[k] = v
+
+    def flush(self):
+        """Vuelca escrituras y usos pendientes en una sola transacción y aplica el límite LRU."""
+        over = bool(self.max_entries) and self.rows > self.max_entries
+        if not self.pending and not self.touched and not over:
+            return
+        now = time.time()
+        with METRICS.timer("cache_flush"), self.db:
+            before = self.db.total_changes
+            self.db.executemany("INSERT OR IGNORE INTO sst(key, value, used) VALUES (?, ?, ?)",
+                                [(k, v, now) for k, v in self.pending.items()])
+            self.rows += self.db.total_changes - before   # solo cuentan las claves nuevas
+            self.db.executemany("UPDATE sst SET value = ?, used = ? WHERE key = ?",
+                                [(v, now, k) for k, v in self.pending.items()])
+            self.db.executemany("UPDATE sst SET used = ? WHERE key = ?",
+                                [(now, k) for k in self.touched - self.pending.keys()])
+            if self.max_entries and self.rows > self.max_entries:
+                self.db.execute("DELETE FROM sst WHERE key IN (SELECT key FROM sst ORDER BY used ASC LIMIT ?)",
+                                (self.rows - self.max_entries,))
+                self.rows = self.max_entries
+        self.pending.clear()
+        self.touched.clear()
+
+    def close(self):
+        self.flush()
+        self.db.close()
+
+    # --- migración ---
+    def migrate_json(self, json_path: Path = LEGACY_JSON) -> int:
+        """
+        Importa una sola vez la caché JSON antigua {'fecha|lat|lon': sst}. Las claves que ya
+        existan no se pisan. Devuelve cuántas entradas se importaron (0 si ya se migró).
+        """
+        json_path = Path(json_path)
+        tag = f"migrated:{json_path.resolve()}"
+        if not json_path.exists() or self.db.execute("SELECT 1 FROM meta WHERE k = ?", (tag,)).fetchone():
+            return 0
+
+        with open(json_path, "r", encoding="utf-8") as f:
+            legacy = json.load(f)
+
+        now = time.time()
+        with self.db:
+            before = self.db.total_changes
+            self.db.executemany(
+                "INSERT OR IGNORE INTO sst(key, value, used) VALUES (?, ?, ?)",
+                [(k, None if v is None else float(v), now) for k, v in legacy.items()],
+            )
+            n = self.db.total_changes - before
+            self.db.execute("INSERT INTO meta(k, v) VALUES (?, ?)", (tag, str(n)))
+        self.rows += n
+        return n
+
+    def stats(self) -> str:
+        return f"{len(self)} entradas, hits={self.hits}, misses={self.misses}"
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Mantenimiento de la caché SQLite de SST")
+    ap.add_argument("--cache", type=Path, default=DEFAULT_PATH)
+    ap.add_argument("--migrate", type=Path, help="caché JSON antigua a importar")
+    ap.add_argument("--max-entries", type=int, help="recortar la caché a N entradas (LRU)")
+    args = ap.parse_args()
+
+    cache = SstCache(args.cache, max_entries=args.max_entries)
+    if args.migrate:
+        print(f"[ok] migradas {cache.migrate_json(args.migrate)} entradas desde {args.migrate}")
+    cache.flush()
+    print(f"[info] {args.cache}: {cache.stats()}")
+    cache.close()
+
+
+if __name__ == "__main__":
+    main()
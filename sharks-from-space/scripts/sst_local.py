@@ -0,0 +1,238 @@
+# scripts/sst_local.py
+# SST desde una copia local de granulos NetCDF de MUR/GHRSST (diarios o mensuales), sin ERDDAP.
+# Los ficheros se indexan por fecha una vez (por el nombre, o por su eje time si el nombre no
+# la lleva) y se abren en perezoso con xarray: de cada fichero solo se lee, por bloques de
+# BLOCK_DEG grados, la ventana lat/lon que cubre los puntos, y todos los puntos de una fecha
+# se resuelven de una vez (vecino más cercano o bilineal).
+#
+#   python scripts/enrich_sst_real.py --local data/env/mur --batch ...
+#   python scripts/enrich_pipeline.py --sst-local data/env/mur --stages sst ...
+#
+#   data/env/mur/20200101090000-JPL-L4_GHRSST-SSTfnd-MUR-GLOB-v02.0-fv04.1.nc   (diario)
+#   data/env/mur/jplMURSST41mday_2020-01.nc                                     (mensual)
+import re, time
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+
+PATTERNS = ("*.nc", "*.nc4")
+VARIABLES = ("analysed_sst", "sst", "sea_surface_temperature")
+LAT_NAMES = ("lat", "latitude")
+LON_NAMES = ("lon", "longitude")
+KELVIN = ("kelvin", "k", "degrees_kelvin", "degree_kelvin")
+METHODS = ("nearest", "bilinear")
+BLOCK_DEG = 5.0     # lado de los bloques de puntos que comparten ventana de lectura
+OPEN_FILES = 4      # granulos abiertos a la vez (LRU)
+
+DAY_RE = re.compile(r"(?<!\d)(\d{4})-?(\d{2})-?(\d{2})")
+MONTH_RE = re.compile(r"(?<!\d)(\d{4})-?(\d{2})(?!\d)")
+
+
+def _valid(y: str, m: str, d: str = "01") -> bool:
+    return 1900 < int(y) < 2100 and 1 <= int(m) <= 12 and 1 <= int(d) <= 31
+
+
+def date_from_name(name: str) -> str | None:
+    """'YYYY-MM-DD' (granulo diario) o 'YYYY-MM' (mensual) desde el nombre; None si no lo lleva."""
+    for m in DAY_RE.finditer(name):
+        if _valid(*m.groups()):
+            return "-".join(m.groups())
+    for m in MONTH_RE.finditer(name):
+        if _valid(*m.groups()):
+            return "-".join(m.groups())
+    return None
+
+
+def _pick(names, candidates, what: str, path) -> str:
+    for c in candidates:
+        if c in names:
+            return c
+    raise KeyError(f"{path}: no se encuentra {what} (probado: {', '.join(candidates)})")
+
+
+class LocalSst:
+    """
+    Granulos NetCDF locales indexados por día ('YYYY-MM-DD') o mes ('YYYY-MM'). `key(fecha)`
+    da la entrada que corresponde a una fecha (el día exacto y si no su mes) y `sample` /
+    `sample_many` devuelven SST en °C (NaN sin dato o fuera de la rejilla).
+    """
+
+    def __init__(self, root: Path, variable: str | None = None, method: str = "nearest",
+                 block_deg: float = BLOCK_DEG):
+        import xarray as xr   # solo hace falta con el backend local
+
+        if method not in METHODS:
+            raise ValueError(f"método de interpolación no soportado: {method} ({', '.join(METHODS)})")
+        self.xr = xr
+        self.root = Path(root)
+        self.variable, self.method, self.block_deg = variable, method, block_deg
+        self.files = {}       # clave de fecha -> (fichero, índice en el eje time)
+        self.open_files = OrderedDict()
+        self.reads = self.cells = self.points = self.missing = 0
+        self.seconds = 0.0
+        self._index()
+
+    # --------- índice ----------
+    def _index(self):
+        paths = sorted(p for pat in PATTERNS for p in self.root.rglob(pat))
+        for path in paths:
+            key = date_from_name(path.name)
+            if key is not None:
+                self.files.setdefault(key, (path, 0))
+                continue
+            # sin fecha en el nombre: se usa el eje time (p.ej. una descarga ERDDAP con varios meses)
+            with self.xr.open_dataset(path) as ds:
+                if "time" not in ds.coords:
+                    print(f"[warn] {path}: sin fecha en el nombre ni eje time, se ignora")
+                    continue
+                times = np.asarray(ds["time"].values, dtype="datetime64[D]")
+            monthly = len(times) > 1 and np.median(np.diff(times).astype(int)) >= 28
+            for t, day in enumerate(times):
+                self.files.setdefault(str(day)[:7] if monthly else str(day), (path, t))
+        if not self.files:
+            raise FileNotFoundError(f"no hay granulos NetCDF ({', '.join(PATTERNS)}) en {self.root}")
+        days = sum(len(k) == 10 for k in self.files)
+        print(f"[load] SST local: {len(paths)} ficheros en {self.root} "
+              f"({days} días, {len(self.files) - days} meses)")
+
+    def key(self, date_iso: str | None) -> str | None:
+        if not date_iso:
+            return None
+        if date_iso[:10] in self.files:
+            return date_iso[:10]
+        return date_iso[:7] if date_iso[:7] in self.files else None
+
+    # --------- lectura ----------
+    def _grid(self, path: Path, t: int):
+        """(DataArray 2D lat x lon perezoso, eje lat, eje lon, en Kelvin) de un paso de tiempo."""
+        if path in self.open_files:
+            self.open_files.move_to_end(path)
+            ds = self.open_files[path]
+        else:
+            ds = self.xr.open_dataset(path)
+            self.open_files[path] = ds
+            if len(self.open_files) > OPEN_FILES:
+                self.open_files.popitem(last=False)[1].close()
+        var = self.variable or _pick(ds.data_vars, VARIABLES, "la variable de SST", path)
+        lat = _pick(ds.coords, LAT_NAMES, "el eje de latitud", path)
+        lon = _pick(ds.coords, LON_NAMES, "el eje de longitud", path)
+        da = ds[var]
+        if "time" in da.dims:
+            da = da.isel(time=t)
+        da = da.squeeze(drop=True).transpose(lat, lon)
+        kelvin = str(da.attrs.get("units", "")).lower() in KELVIN
+        return da, ds[lat].values.astype(float), ds[lon].values.astype(float), kelvin
+
+    def sample(self, key: str, lats, lons) -> np.ndarray:
+        """SST (°C) de todos los puntos de una clave de fecha, leyendo una ventana por bloque."""
+        t0 = time.monotonic()
+        lats = np.asarray(lats, dtype=float)
+        lons = np.asarray(lons, dtype=float)
+        da, lat_axis, lon_axis, kelvin = self._grid(*self.files[key])
+        if lon_axis.max() > 180:
+            lons = lons % 360          # rejilla 0–360 (p.ej. los productos *_Lon0360)
+
+        rows = _Axis(lat_axis).locate(lats, self.method)
+        cols = _Axis(lon_axis).locate(lons, self.method)
+        out = np.full(len(lats), np.nan)
+        inside = np.flatnonzero(rows.inside & cols.inside)
+        cells = np.stack([lats[inside] // self.block_deg, lons[inside] // self.block_deg], axis=1)
+        _, block = np.unique(cells, axis=0, return_inverse=True)
+        block = block.ravel()
+        order = np.argsort(block, kind="stable")
+        bounds = np.flatnonzero(np.diff(block[order])) + 1
+
+        for g in np.split(inside[order], bounds) if len(inside) else []:
+            r0, r1 = int(rows.lo[g].min()), int(rows.hi[g].max())
+            c0, c1 = int(cols.lo[g].min()), int(cols.hi[g].max())
+            win = np.asarray(da[r0:r1 + 1, c0:c1 + 1].values, dtype=float)
+            self.reads += 1
+            self.cells += win.size
+            out[g] = _interpolate(win, rows, cols, g, r0, c0)
+
+        if kelvin:
+            out -= 273.15
+        self.points += len(lats)
+        self.seconds += time.monotonic() - t0
+        return out
+
+    def sample_many(self, dates, lats, lons) -> np.ndarray:
+        """SST (°C) punto a punto, agrupando por clave de fecha; NaN si no hay granulo para la fecha."""
+        keys = np.array([self.key(d) or "" for d in dates], dtype=object)
+        lats = np.asarray(lats, dtype=float)
+        lons = np.asarray(lons, dtype=float)
+        out = np.full(len(keys), np.nan)
+        for key in sorted(set(keys)):
+            idx = np.flatnonzero(keys == key)
+            if key:
+                out[idx] = self.sample(key, lats[idx], lons[idx])
+            else:
+                self.missing += len(idx)
+        return out
+
+    def summary(self) -> str:
+        return (f"{self.points} puntos en {self.reads} ventanas ({self.cells} celdas leídas), "
+                f"{self.missing} sin granulo para su fecha, {self.seconds:.1f}s de lectura")
+
+    def close(self):
+        for ds in self.open_files.values():
+            ds.close()
+        self.open_files.clear()
+
+
+class _Located:
+    """Posición de los puntos en un eje: celdas lo/hi que hay que leer y peso de hi (bilineal)."""
+
+    def __init__(self, lo, hi, weight, inside):
+        self.lo, self.hi, self.weight, self.inside = lo, hi, weight, inside
+
+
+class _Axis:
+    """Eje 1D de una rejilla (creciente o decreciente)."""
+
+    def __init__(self, values):
+        self.values = values
+        self.descending = len(values) > 1 and values[0] > values[-1]
+        self.asc = values[::-1] if self.descending else values
+        half = abs(float(np.diff(self.asc).min())) / 2 if len(values) > 1 else 0.0
+        self.lo, self.hi = self.asc[0] - half, self.asc[-1] + half
+
+    def _flip(self, i):
+        return len(self.values) - 1 - i if self.descending else i
+
+    def locate(self, x, method: str) -> _Located:
+        n = len(self.asc)
+        inside = (x >= self.lo) & (x <= self.hi)
+        if method == "nearest" or n == 1:
+            if n == 1:
+                i = np.zeros(len(x), dtype=int)
+            else:
+                i = np.searchsorted(self.asc, x).clip(1, n - 1)
+                i -= (x - self.asc[i - 1]) < (self.asc[i] - x)
+            i = self._flip(i)
+            return _Located(i, i, np.zeros(len(x)), inside)
+        f = np.interp(x, self.asc, np.arange(n))      # posición fraccionaria (se pega a los bordes)
+        i0 = np.clip(np.floor(f).astype(int), 0, n - 2)
+        w = f - i0
+        a, b = self._flip(i0), self._flip(i0 + 1)
+        if self.descending:       # en el eje original b queda antes que a
+            return _Located(b, a, 1 - w, inside)
+        return _Located(a, b, w, inside)
+
+
+def _interpolate(win: np.ndarray, rows: _Located, cols: _Located, g, r0: int, c0: int) -> np.ndarray:
+    """Vecino (lo == hi) o bilineal sobre las celdas con dato, repartiendo el peso de las vacías."""
+    rl, rh = rows.lo[g] - r0, rows.hi[g] - r0
+    cl, ch = cols.lo[g] - c0, cols.hi[g] - c0
+    wr, wc = rows.weight[g], cols.weight[g]
+    corners = [(win[rl, cl], (1 - wr) * (1 - wc)), (win[rl, ch], (1 - wr) * wc),
+               (win[rh, cl], wr * (1 - wc)), (win[rh, ch], wr * wc)]
+    total = np.zeros(len(g))
+    weight = np.zeros(len(g))
+    for v, w in corners:
+        ok = ~np.isnan(v)
+        total[ok] += v[ok] * w[ok]
+        weight[ok] += w[ok]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(weight > 0, total / weight, np.nan)
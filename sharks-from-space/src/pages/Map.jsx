@@ -4,13 +4,16 @@ import {
   MapContainer,
   TileLayer,
   GeoJSON,
+  LayerGroup,
   LayersControl,
   useMap,
+  useMapEvents,
 } from "react-leaflet";
-import { useEffect, useMemo, useState } from "react";
+import { useEffect, useMemo, useRef, useState } from "react";
 import { Helmet } from "@dr.pogodin/react-helmet";
-import booleanPointInPolygon from "@turf/boolean-point-in-polygon";
-import { point } from "@turf/helpers";
+
+// Teselas generadas con scripts/build_map_tiles.py (los puntos en tierra ya vienen quitados)
+const TILES_URL = "/tiles";
 
 // ============ util & hooks que NO usan contexto de leaflet ============
 function useGeoJson(url) {
@@ -18,6 +21,7 @@ function useGeoJson(url) {
   const [err, setErr] = useState(null);
   const [loading, setLoading] = useState(true);
   useEffect(() => {
+    if (!url) return;
     let cancelled = false;
     setLoading(true);
     fetch(url)
@@ -35,18 +39,74 @@ function useGeoJson(url) {
   return { data, err, loading };
 }
 
-function filterSeaPoints(fc, land) {
-  if (!fc || !land) return fc;
-  const landFeatures = land.features || [];
-  const seaFeatures = (fc.features || []).filter((f) => {
-    const coords = f?.geometry?.coordinates;
-    if (!coords || !Number.isFinite(coords[0]) || !Number.isFinite(coords[1]))
-      return false;
-    const pt = point([coords[0], coords[1]]);
-    const onLand = landFeatures.some((poly) => booleanPointInPolygon(pt, poly));
-    return !onLand;
-  });
-  return { ...fc, features: seaFeatures };
+// Una tesela binaria: cabecera "SPT1" (n puntos + bounds) y columnas contiguas
+// (lon/lat uint16 cuantizadas dentro de la tesela y luego las del manifest, en su orden).
+const TYPED = {
+  uint8: Uint8Array,
+  uint16: Uint16Array,
+  int16: Int16Array,
+};
+
+function decodeTile(buf, layer) {
+  const view = new DataView(buf);
+  const magic = String.fromCharCode(...new Uint8Array(buf, 0, 4));
+  if (magic !== layer.header.magic) throw new Error(`bad tile (${magic})`);
+  const n = view.getUint32(4, true);
+  const [west, south, east, north] = [8, 16, 24, 32].map((o) =>
+    view.getFloat64(o, true)
+  );
+  let offset = layer.header.bytes;
+  const column = (Type) => {
+    const arr = new Type(buf, offset, n);
+    offset += n * Type.BYTES_PER_ELEMENT;
+    return arr;
+  };
+  const qx = column(Uint16Array);
+  const qy = column(Uint16Array);
+  const cols = {};
+  for (const c of layer.columns) cols[c.name] = column(TYPED[c.type]);
+
+  const q = layer.quantization;
+  const points = new Array(n);
+  for (let i = 0; i < n; i++) {
+    const props = {};
+    for (const c of layer.columns) {
+      const v = cols[c.name][i];
+      if (c.values) props[c.name] = c.values[v] || null;
+      else if (v === c.nodata) props[c.name] = null;
+      else if (c.name === "date")
+        props.date = new Date(v * 86400000).toISOString().slice(0, 10);
+      else props[c.name] = v / (c.scale || 1);
+    }
+    points[i] = {
+      lng: west + (qx[i] / q) * (east - west),
+      lat: south + (qy[i] / q) * (north - south),
+      props,
+    };
+  }
+  return points;
+}
+
+// Teselas XYZ visibles a zoom z (solo las que existen según el manifest)
+function visibleTiles(bounds, z, available) {
+  const n = 2 ** z;
+  const clampLat = (lat) => Math.max(-85.0511, Math.min(85.0511, lat));
+  const tx = (lng) => Math.floor(((lng + 180) / 360) * n);
+  const ty = (lat) => {
+    const r = (clampLat(lat) * Math.PI) / 180;
+    return Math.floor(
+      ((1 - Math.log(Math.tan(r) + 1 / Math.cos(r)) / Math.PI) / 2) * n
+    );
+  };
+  const x0 = Math.max(0, tx(bounds.getWest()));
+  const x1 = Math.min(n - 1, tx(bounds.getEast()));
+  const y0 = Math.max(0, ty(bounds.getNorth()));
+  const y1 = Math.min(n - 1, ty(bounds.getSouth()));
+  const out = [];
+  for (let x = x0; x <= x1; x++)
+    for (let y = y0; y <= y1; y++)
+      if (available.has(`${x}/${y}`)) out.push(`${z}/${x}/${y}`);
+  return out;
 }
 
 const COLORS = {
@@ -58,12 +118,8 @@ const COLORS = {
   default: "#34d399",
 };
 
-function colorForFeature(feature) {
-  const s = (
-    feature?.properties?.species ||
-    feature?.properties?.scientificName ||
-    ""
-  ).toLowerCase();
+function colorForSpecies(species) {
+  const s = (species || "").toLowerCase();
   if (s.includes("lewini")) return COLORS.lewini;
   if (s.includes("tiburo")) return COLORS.tiburo;
   if (s.includes("mokarran")) return COLORS.mokarran;
@@ -72,40 +128,128 @@ function colorForFeature(feature) {
   return COLORS.default;
 }
 
-const pointToLayer = (feature, latlng) =>
-  L.circleMarker(latlng, {
+const pointToLayer = (pt, renderer) =>
+  L.circleMarker([pt.lat, pt.lng], {
+    renderer,
     radius: 3,
-    color: colorForFeature(feature),
-    fillColor: colorForFeature(feature),
+    color: colorForSpecies(pt.props.species),
+    fillColor: colorForSpecies(pt.props.species),
     fillOpacity: 0.75,
     weight: 0.8,
   });
 
-const popupHtml = (feature) => {
-  const species =
-    feature?.properties?.species ||
-    feature?.properties?.scientificName ||
-    "Shark";
-  const [lng, lat] = feature?.geometry?.coordinates || [];
-  const src =
-    feature?.properties?.datasetName || feature?.properties?.publisher || "";
-  const sst = feature?.properties?.sst_c;
-  const dist = feature?.properties?.dist_coast_km;
+const popupHtml = ({ lat, lng, props }) => {
+  const species = props.species || "Shark";
+  const { sst_c: sst, dist_coast_km: dist, bathy_m: bathy, date, source } =
+    props;
 
   return `<strong>${species}</strong><br/>
-          lat: ${lat?.toFixed(3)}, lng: ${lng?.toFixed(3)}
+          lat: ${lat.toFixed(3)}, lng: ${lng.toFixed(3)}
+          ${date ? `<br/>${date}` : ""}
           ${sst != null ? `<br/>SST: ${Number(sst).toFixed(2)} °C` : ""}
           ${
             dist != null
               ? `<br/>Dist. costa: ${Number(dist).toFixed(2)} km`
               : ""
           }
-          ${src ? `<br/><span class="muted">${src}</span>` : ""}`;
+          ${bathy != null ? `<br/>Profundidad: ${bathy} m` : ""}
+          ${source ? `<br/><span class="muted">${source}</span>` : ""}`;
 };
 
-const onEachFeature = (feature, layer) => {
-  layer.bindPopup(popupHtml(feature));
-};
+// Pinta en `group` los puntos de las teselas visibles; cada tesela se descarga una vez
+function PointTiles({ name, layer, group, onStatus }) {
+  const map = useMap();
+  const cache = useRef(new globalThis.Map()); // url -> Promise<points>
+  const renderer = useMemo(() => L.canvas({ padding: 0.2 }), []);
+  const available = useMemo(
+    () =>
+      Object.fromEntries(
+        Object.entries(layer.tiles).map(([z, tiles]) => [
+          z,
+          new Set(tiles.map(([x, y]) => `${x}/${y}`)),
+        ])
+      ),
+    [layer]
+  );
+
+  useEffect(() => {
+    let current = 0;
+    const load = (key) => {
+      const url = `${TILES_URL}/${name}/${key}.bin`;
+      if (!cache.current.has(url)) {
+        const p = fetch(url)
+          .then((r) => {
+            if (!r.ok) throw new Error(`HTTP ${r.status}`);
+            return r.arrayBuffer();
+          })
+          .then((buf) => decodeTile(buf, layer));
+        p.catch(() => cache.current.delete(url)); // se reintenta en el siguiente movimiento
+        cache.current.set(url, p);
+      }
+      return cache.current.get(url);
+    };
+
+    const update = () => {
+      const g = group.current;
+      if (!g) return;
+      const z = Math.max(
+        layer.minzoom,
+        Math.min(layer.maxzoom, Math.floor(map.getZoom()))
+      );
+      const keys = visibleTiles(map.getBounds(), z, available[z] || new Set());
+      const request = ++current;
+      onStatus({ loading: true, error: null });
+      Promise.all(keys.map(load))
+        .then((tiles) => {
+          if (request !== current) return; // llegó otra vista mientras tanto
+          g.clearLayers();
+          for (const pts of tiles)
+            for (const pt of pts)
+              pointToLayer(pt, renderer)
+                .bindPopup(() => popupHtml(pt))
+                .addTo(g);
+          onStatus({ loading: false, error: null });
+        })
+        .catch(
+          (e) => request === current && onStatus({ loading: false, error: e })
+        );
+    };
+
+    update();
+    map.on("moveend", update);
+    return () => {
+      current = -1;
+      map.off("moveend", update);
+    };
+  }, [map, name, layer, available, group, renderer, onStatus]);
+
+  return null;
+}
+
+// Tierra simplificada con el nivel de detalle (LOD) que toca al zoom actual
+// (solo se descarga mientras la capa `name` está activa en el control de capas)
+function LandLod({ name, lods }) {
+  const [zoom, setZoom] = useState(null);
+  const [active, setActive] = useState(false);
+  const map = useMapEvents({
+    zoomend: () => setZoom(map.getZoom()),
+    overlayadd: (e) => e.name === name && setActive(true),
+    overlayremove: (e) => e.name === name && setActive(false),
+  });
+  const z = zoom ?? map.getZoom();
+  const lod =
+    lods.find((l) => z >= l.minzoom && z <= l.maxzoom) || lods[lods.length - 1];
+  const land = useGeoJson(active && lod ? `${TILES_URL}/${lod.path}` : null);
+  if (!active || !lod || !land.data) return null;
+  return (
+    <GeoJSON
+      key={lod.path}
+      data={land.data}
+      style={{ color: "#94a3b8", weight: 0.5, fillOpacity: 0.15 }}
+      interactive={false}
+    />
+  );
+}
 
 // --- NUEVO: arrancar centrado en Caribe/Florida ---
 function StartInCaribbean() {
@@ -137,22 +281,14 @@ function LegendDot({ color, label }) {
 }
 
 export default function Map() {
-  // ✅ usa el archivo con SST + distancia (y forzamos recarga con ?v=8)
-  const hammerheads = useGeoJson(
-    "/data/sphyrna_points_enriched_0_5000_with_dist.geojson?v=10"
-  );
-  const land = useGeoJson("/data/land.geojson");
-
-  const filteredAll = useMemo(
-    () =>
-      hammerheads.data && land.data
-        ? filterSeaPoints(hammerheads.data, land.data)
-        : hammerheads.data || null,
-    [hammerheads.data, land.data]
-  );
+  // manifest de scripts/build_map_tiles.py: solo se bajan las teselas del viewport
+  const manifest = useGeoJson(`${TILES_URL}/manifest.json`);
+  const hammerheads = manifest.data?.layers?.hammerheads;
+  const group = useRef(null);
+  const [tiles, setTiles] = useState({ loading: false, error: null });
 
-  const loading = hammerheads.loading || land.loading;
-  const error = hammerheads.err || land.err;
+  const loading = manifest.loading || tiles.loading;
+  const error = manifest.err || tiles.error;
 
   return (
     <div className="section">
@@ -181,22 +317,26 @@ export default function Map() {
           {/* 👇 centra al Caribe al montar */}
           <StartInCaribbean />
 
-          {/* Si prefieres que ajuste a todos los puntos, quita StartInCaribbean y deja esto */}
-          {/* {filteredAll && <FitToData featureCollection={filteredAll} />} */}
+          {hammerheads && (
+            <PointTiles
+              name="hammerheads"
+              layer={hammerheads}
+              group={group}
+              onStatus={setTiles}
+            />
+          )}
 
           <LayersControl position="topright">
             <LayersControl.Overlay checked name="Hammerheads (GBIF)">
-              <>
-                {filteredAll && (
-                  <GeoJSON
-                    key="sphyrna"
-                    data={filteredAll}
-                    pointToLayer={pointToLayer}
-                    onEachFeature={onEachFeature}
-                  />
-                )}
-              </>
+              <LayerGroup ref={group} />
             </LayersControl.Overlay>
+            {manifest.data?.land?.length > 0 && (
+              <LayersControl.Overlay name="Land (simplified)">
+                <LayerGroup>
+                  <LandLod name="Land (simplified)" lods={manifest.data.land} />
+                </LayerGroup>
+              </LayersControl.Overlay>
+            )}
           </LayersControl>
         </MapContainer>
       </div>